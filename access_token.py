@@ -1,32 +1,152 @@
 import msal
 import os
+import time
+import atexit
+import threading
 from dotenv import load_dotenv
 import logging
 # Load environment variables from .env file
 load_dotenv()
 logger = logging.getLogger('tt_sharepoint_logger')
 
+DEFAULT_SCOPE = ["https://graph.microsoft.com/.default"]
+# Tokens are refreshed this many seconds before they expire.
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+# Optional file the MSAL token cache is saved to, e.g. /tmp/msal_token_cache.bin. A restarted worker
+# reuses a still valid token from it instead of calling AAD.
+TOKEN_CACHE_PATH = os.getenv("TOKEN_CACHE_PATH")
+# Refresh tokens on a background thread shortly before they expire.
+TOKEN_BACKGROUND_REFRESH = os.getenv("TOKEN_BACKGROUND_REFRESH", "true").lower() == "true"
 
-def get_access_token():
-    CLIENT_ID = os.getenv("CLIENT_ID")
-    AUTHORITY = os.getenv("AUTHORITY")
-    CLIENT_SECRET = os.getenv("CLIENT_SECRET")
-    SCOPE = ["https://graph.microsoft.com/.default"]
-
-    app = msal.ConfidentialClientApplication(
-        CLIENT_ID,
-        authority=AUTHORITY,
-        client_credential=CLIENT_SECRET,
-    )
-
-    result = app.acquire_token_for_client(scopes=SCOPE)
-
-    if "access_token" in result:
-        access_token = result["access_token"]
-        logger.info("Access token acquired successfully.")
-        return access_token
-    else:
-        logger.critical("Error acquiring token:")
-        logger.error(result.get("error"))
-        logger.error(result.get("error_description"))
-        raise SystemExit("Failed to acquire access token; terminating program.")
+
+class TokenProvider:
+    """
+    App-only token provider for one authority/client pair.
+
+    Keeps a single msal.ConfidentialClientApplication, returns cached tokens until TOKEN_REFRESH_MARGIN
+    seconds before they expire and can refresh them in the background, so callers almost never wait on AAD.
+    """
+
+    def __init__(self, client_id, authority, client_secret, cache_path=TOKEN_CACHE_PATH,
+                 refresh_margin=TOKEN_REFRESH_MARGIN, background_refresh=TOKEN_BACKGROUND_REFRESH):
+        self.cache_path = cache_path
+        self.refresh_margin = refresh_margin
+        self.background_refresh = background_refresh
+        self.token_cache = msal.SerializableTokenCache()
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r") as cache_file:
+                    self.token_cache.deserialize(cache_file.read())
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable token cache {cache_path}: {e}")
+        self.app = msal.ConfidentialClientApplication(
+            client_id,
+            authority=authority,
+            client_credential=client_secret,
+            token_cache=self.token_cache,
+        )
+        self._tokens = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def get_token(self, scopes=None):
+        """Returns a valid access token for the scopes, acquiring a new one only when needed."""
+        scopes = tuple(scopes or DEFAULT_SCOPE)
+        cached = self._tokens.get(scopes)
+        if cached and cached[1] - self.refresh_margin > time.time():
+            return cached[0]
+        with self._lock:
+            cached = self._tokens.get(scopes)
+            if cached and cached[1] - self.refresh_margin > time.time():
+                return cached[0]
+            return self._acquire(scopes)
+
+    def _acquire(self, scopes):
+        # acquire_token_for_client answers from the MSAL cache when it holds a valid token
+        result = self.app.acquire_token_for_client(scopes=list(scopes))
+        if "access_token" not in result:
+            logger.critical("Error acquiring token:")
+            logger.error(result.get("error"))
+            logger.error(result.get("error_description"))
+            raise Exception("Failed to acquire access token.")
+
+        expires_at = time.time() + int(result.get("expires_in", 3600))
+        self._tokens[scopes] = (result["access_token"], expires_at)
+        if result.get("token_source") != "cache":
+            logger.info("Access token acquired successfully.")
+        self._save_cache()
+        if self.background_refresh:
+            self._schedule_refresh(scopes, expires_at)
+        return result["access_token"]
+
+    def _schedule_refresh(self, scopes, expires_at):
+        timer = self._timers.get(scopes)
+        if timer:
+            timer.cancel()
+        delay = max(expires_at - self.refresh_margin - time.time(), 1)
+        timer = threading.Timer(delay, self._refresh, args=(scopes,))
+        timer.daemon = True
+        self._timers[scopes] = timer
+        timer.start()
+
+    def _refresh(self, scopes):
+        try:
+            with self._lock:
+                # the cached entry is still inside the refresh margin, so MSAL fetches a new token
+                self._tokens.pop(scopes, None)
+                self._remove_cached_tokens(scopes)
+                self._acquire(scopes)
+            logger.info("Access token refreshed in the background.")
+        except Exception as e:
+            logger.warning(f"Background token refresh failed, the next call will retry: {e}")
+
+    def _remove_cached_tokens(self, scopes):
+        """Remove the MSAL cache entries of these scopes only, the tokens of other scopes stay cached."""
+        entries = self.token_cache.find(msal.TokenCache.CredentialType.ACCESS_TOKEN, target=list(scopes),
+                                        query={"client_id": self.app.client_id})
+        for entry in entries:
+            self.token_cache.remove_at(entry)
+
+    def _save_cache(self):
+        if not self.cache_path or not self.token_cache.has_state_changed:
+            return
+        try:
+            with open(self.cache_path, "w") as cache_file:
+                cache_file.write(self.token_cache.serialize())
+            self.token_cache.has_state_changed = False
+        except Exception as e:
+            logger.warning(f"Failed to save token cache to {self.cache_path}: {e}")
+
+    def close(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._save_cache()
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_token_provider(client_id=None, authority=None, client_secret=None):
+    """
+    Returns the process wide TokenProvider for an authority/client pair, creating it on first use.
+    Defaults come from the CLIENT_ID, AUTHORITY and CLIENT_SECRET environment variables.
+    """
+    client_id = client_id or os.getenv("CLIENT_ID")
+    authority = authority or os.getenv("AUTHORITY")
+    client_secret = client_secret or os.getenv("CLIENT_SECRET")
+    key = (authority, client_id)
+    with _providers_lock:
+        if key not in _providers:
+            _providers[key] = TokenProvider(client_id, authority, client_secret)
+            atexit.register(_providers[key].close)
+        return _providers[key]
+
+
+def get_access_token(scopes=None):
+    """
+    Returns an app-only access token. Uses the SCOPE environment variable when set, otherwise Microsoft Graph.
+    """
+    if scopes is None:
+        scopes = [os.getenv("SCOPE")] if os.getenv("SCOPE") else DEFAULT_SCOPE
+    return get_token_provider().get_token(scopes)
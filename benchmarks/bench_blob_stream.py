@@ -0,0 +1,73 @@
+"""
+Peak memory and time of uploading a merged register as one pretty printed json.dumps string (previous
+upload path) against streaming it with blob_stream into staged blocks. The blob client only counts the
+staged bytes, so nothing is sent anywhere.
+
+Run from the repository root:
+    python benchmarks/bench_blob_stream.py [number of risks ...]
+"""
+import os
+import sys
+import json
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_merged_cleaning import synthetic_merged_list
+from blob_stream import iter_json_array, upload_json_stream
+from merged_cleaning import clean_merged_data
+
+
+class CountingBlobClient:
+    blob_name = "benchmark.json"
+
+    def __init__(self):
+        self.size = 0
+
+    def upload_blob(self, data, overwrite=True):
+        self.size = len(data)
+
+    def stage_block(self, block_id, data):
+        self.size += len(data)
+
+    def commit_block_list(self, block_list):
+        return {"etag": '"0x1"'}
+
+
+def upload_whole(items):
+    blob_client = CountingBlobClient()
+    blob_client.upload_blob(json.dumps(clean_merged_data(items), indent=2), overwrite=True)
+    return blob_client.size
+
+
+def upload_streamed(items, indent=None):
+    blob_client = CountingBlobClient()
+    upload_json_stream(blob_client, iter_json_array((clean_merged_data(item) for item in items), indent))
+    return blob_client.size
+
+
+def measure(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    size = func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size / 2 ** 20, seconds, peak / 2 ** 20
+
+
+def main(sizes):
+    print(f"{'risks':>8} {'mode':>16} {'blob (MiB)':>11} {'time (s)':>9} {'peak (MiB)':>11}")
+    for n_risks in sizes:
+        items = synthetic_merged_list(n_risks)
+        for mode, func, args in [("whole, indent=2", upload_whole, ()),
+                                 ("stream, indent=2", upload_streamed, (2,)),
+                                 ("stream, compact", upload_streamed, (None,))]:
+            size, seconds, peak = measure(func, items, *args)
+            print(f"{n_risks:>8} {mode:>16} {size:>11.1f} {seconds:>9.3f} {peak:>11.1f}")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [10000, 50000])
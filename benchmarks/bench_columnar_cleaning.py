@@ -0,0 +1,85 @@
+"""
+Benchmark of the columnar cleaning mode of clean_and_format_data against the row-wise mode on raw
+Graph list items. Both modes must produce identical output.
+
+Run from the repository root:
+    python benchmarks/bench_columnar_cleaning.py [number of items ...]
+"""
+import os
+import sys
+import random
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_cleaning_anurag import allowed_columns, clean_and_format_data, column_schema, np
+
+
+def synthetic_items(list_type, n_items, seed=3):
+    """Items shaped like the Graph list item response, with the schema columns and some extra fields."""
+    rng = random.Random(seed)
+    values = {
+        "date": lambda: f"2025-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}T10:{rng.randint(10, 59)}:16Z",
+        int: lambda: str(rng.randint(1, 9999)),
+        float: lambda: rng.random() * 1e6,
+        bool: lambda: rng.choice([True, False]),
+        str: lambda: rng.choice(["  Supplier delay on phase 2 ", "Open", "owner@example.com;", "['DE', 'FR']"]),
+        list: lambda: [{"LookupId": rng.randint(1, 99), "LookupValue": "Owner", "Email": "o@example.com"}],
+    }
+    columns = column_schema[list_type]
+    items = []
+    for item_id in range(1, n_items + 1):
+        fields = {"@odata.etag": f'"{item_id},2"', "ContentType": "Item", "_UIVersionString": "2.0"}
+        fields.update({key: values[expected_type]() for key, expected_type in columns.items()})
+        items.append({
+            "@odata.etag": f'"{item_id},2"',
+            "createdDateTime": fields.pop("createdDateTime"),
+            "eTag": f'"{item_id},2"',
+            "id": str(item_id),
+            "lastModifiedDateTime": fields.pop("lastModifiedDateTime"),
+            "webUrl": f"https://example.sharepoint.com/Lists/items/{item_id}",
+            "fields": fields,
+        })
+    return items
+
+
+def edge_items():
+    """Layouts the columnar mode must handle like the row-wise one: key clashes, Owners, missing fields."""
+    return [
+        {"id": "1", "fields": {"Title": " a ", "Owners": "x@example.com;", "Owner s": ["y"], "ItemChildCount": "No"}},
+        {"id": "2", "fields": {"Owners": ["z@example.com"], "Countries": "['DE', 'FR']", "Archive": "yes"}},
+        {"id": "3", "fields": None, "Title": "top level only"},
+        {"id": "4"},
+        {"i d": "5", "id": 6, "fields": {"RiskId": {"id": "7", "Title": " nested "}, "Attachments": 1.0}},
+        {"fields": {"id": "8", "FinancialImpact": True, "Modified": "2025-02-30T00:00:00Z", "Created": 5}},
+        {"Fields": {"Title": "ignored"}, "fields ": {"Title": "kept", "Owners": 3}},
+        {},
+    ]
+
+
+def best_of(func, *args, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(sizes):
+    print(f"numpy: {'yes' if np is not None else 'no'}")
+    print(f"{'list':>18} {'items':>8} {'rows (s)':>9} {'columnar (s)':>13} {'speedup':>8}")
+    for list_type in allowed_columns:
+        items = edge_items() + synthetic_items(list_type, 10)
+        assert clean_and_format_data(items, list_type, "rows") == clean_and_format_data(items, list_type, "columnar")
+        for n_items in sizes:
+            items = synthetic_items(list_type, n_items)
+            assert clean_and_format_data(items, list_type, "rows") == clean_and_format_data(items, list_type, "columnar")
+            rows_seconds = best_of(clean_and_format_data, items, list_type, "rows")
+            columnar_seconds = best_of(clean_and_format_data, items, list_type, "columnar")
+            print(f"{list_type:>18} {n_items:>8} {rows_seconds:>9.4f} {columnar_seconds:>13.4f} "
+                  f"{rows_seconds / columnar_seconds:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [10000, 100000])
@@ -0,0 +1,73 @@
+"""
+Benchmark of normalize_date (precompiled ISO-8601 pattern + LRU) against date_parse(...).strftime, the
+previous conversion of "date" columns. Both must produce identical output.
+
+Run from the repository root:
+    python benchmarks/bench_date_normalization.py [number of values ...]
+"""
+import os
+import sys
+import random
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dateutil.parser import parse as date_parse
+from data_cleaning_anurag import DATE_FORMAT, normalize_date
+
+# inputs that are not strict ISO-8601 and go through dateutil
+ODD_VALUES = ["17/03/2025", "March 17, 2025 10:41", "2025-03-17T24:00:00Z", "not a date", ""]
+
+
+def synthetic_timestamps(n_values, distinct_share=0.2, seed=5):
+    """Graph style timestamps where only a share of the values are distinct, plus some odd inputs."""
+    rng = random.Random(seed)
+    distinct = [
+        f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:"
+        f"{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}Z"
+        for _ in range(max(int(n_values * distinct_share), 1))
+    ]
+    values = [rng.choice(distinct) for _ in range(n_values)]
+    for i in range(0, n_values, 1000):
+        values[i] = rng.choice(ODD_VALUES)
+    return values
+
+
+def previous(values):
+    converted = []
+    for value in values:
+        try:
+            converted.append(date_parse(value).strftime(DATE_FORMAT))
+        except Exception:
+            converted.append(None)
+    return converted
+
+
+def normalized(values):
+    normalize_date.cache_clear()
+    return [normalize_date(value) for value in values]
+
+
+def best_of(func, values, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(values)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(sizes):
+    print(f"{'values':>8} {'dateutil (s)':>13} {'normalize_date (s)':>19} {'speedup':>8} {'cache hits':>11}")
+    for n_values in sizes:
+        values = synthetic_timestamps(n_values)
+        assert previous(values) == normalized(values)
+        hits = normalize_date.cache_info().hits
+        previous_seconds = best_of(previous, values)
+        normalized_seconds = best_of(normalized, values)
+        print(f"{n_values:>8} {previous_seconds:>13.4f} {normalized_seconds:>19.4f} "
+              f"{previous_seconds / normalized_seconds:>7.2f}x {hits / n_values:>10.0%}")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [10000, 100000])
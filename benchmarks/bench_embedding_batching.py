@@ -0,0 +1,104 @@
+"""
+Requests and simulated time of generating the risk embeddings one text per request (previous
+merge_risk_data) against the batched generate_embeddings. No request is sent: request_embeddings is
+replaced by a fake service that sleeps a fixed round trip plus a small cost per input, rejects requests
+over a smaller input limit than the one configured (to exercise the automatic split) and returns
+vectors derived from the text, so both paths can be compared.
+
+Run from the repository root:
+    python benchmarks/bench_embedding_batching.py [number of risks ...]
+"""
+import os
+import sys
+import time
+import random
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding import AzureOpenAI, EMBEDDING_FIELDS, merge_risk_data
+from embedding_scheduler import RateLimiter
+
+ROUND_TRIP_SECONDS = 0.02
+SECONDS_PER_INPUT = 0.0002
+SERVICE_MAX_INPUTS = 1000
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+        self.text = "" if data is not None else "simulated error"
+
+    def json(self):
+        return {"data": self.data}
+
+
+def fake_vector(text):
+    return [zlib.crc32(text.encode()) / 2 ** 32, len(text)]
+
+
+class FakeAzureOpenAI(AzureOpenAI):
+    """Client whose requests are answered by a simulated service, without a quota of its own."""
+
+    def __init__(self, limiter=None):
+        super().__init__("key", "2024-02-01", "https://example.openai.azure.com",
+                         limiter=limiter or RateLimiter(10 ** 12, 10 ** 12))
+        self.requests = 0
+
+    def post_embeddings(self, texts):
+        self.requests += 1
+        time.sleep(ROUND_TRIP_SECONDS)
+        if len(texts) > SERVICE_MAX_INPUTS:
+            return FakeResponse(400)
+        time.sleep(SECONDS_PER_INPUT * len(texts))
+        return FakeResponse(200, [{"index": index, "embedding": fake_vector(text)}
+                                  for index, text in reversed(list(enumerate(texts)))])
+
+
+def one_request_per_text(documents, client):
+    """The previous behaviour: generate_embedding called for every field of every risk."""
+    for document in documents:
+        for field in EMBEDDING_FIELDS:
+            if field in document:
+                response = client.post_embeddings([str(document[field])])
+                document["embeddings"][field] = response.json()["data"][0]["embedding"]
+    return documents
+
+
+def synthetic_lists(n_risks, seed=3):
+    rng = random.Random(seed)
+    risks = [{"id": str(risk_id), "fields": {
+        "Title": f"Risk {risk_id}: supplier delay on {rng.choice(['rail', 'steel', 'chips'])} deliveries",
+        "Status": rng.choice(["Open", "Closed", "Monitoring"]),
+        "Likelihood": rng.choice(["Rare", "Unlikely", "Possible", "Likely"]),
+    }} for risk_id in range(1, n_risks + 1)]
+    mitigations = [{"id": str(n_risks + index), "fields": {"RiskId": str(rng.randint(1, n_risks))}}
+                   for index in range(n_risks)]
+    return risks, mitigations
+
+
+def main(sizes):
+    print(f"{'risks':>8} {'requests before':>16} {'seconds before':>15} {'requests now':>13} {'seconds now':>12}")
+    for n_risks in sizes:
+        risks, mitigations = synthetic_lists(n_risks)
+
+        client = FakeAzureOpenAI()
+        start = time.perf_counter()
+        batched = merge_risk_data(risks, mitigations, client)
+        batched_seconds = time.perf_counter() - start
+        batched_requests = client.requests
+
+        client = FakeAzureOpenAI()
+        start = time.perf_counter()
+        previous = one_request_per_text(
+            [{**document, "embeddings": {}} for document in batched], client)
+        previous_seconds = time.perf_counter() - start
+
+        assert previous == batched
+        print(f"{n_risks:>8} {client.requests:>16} {previous_seconds:>15.2f} {batched_requests:>13} {batched_seconds:>12.2f}")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [500, 3000])
@@ -0,0 +1,59 @@
+"""
+Requests, simulated time and hit rate of two consecutive embedding runs over the same register, the second
+after 5% of the titles were edited, without and with the SQLite embedding cache. The fake service of
+bench_embedding_batching answers the requests. Embeddings read from the cache must equal generated ones.
+
+Run from the repository root:
+    python benchmarks/bench_embedding_cache.py [number of risks ...]
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_embedding_batching import FakeAzureOpenAI, synthetic_lists
+from embedding import merge_risk_data
+from embedding_cache import EmbeddingCache
+
+
+def edit_titles(risks, share=0.05, seed=9):
+    rng = random.Random(seed)
+    edited = [{**risk, "fields": dict(risk["fields"])} for risk in risks]
+    for risk in rng.sample(edited, int(len(edited) * share)):
+        risk["fields"]["Title"] += " (revised)"
+    return edited
+
+
+def run(risks, mitigations, cache):
+    client = FakeAzureOpenAI()
+    client.cache = cache
+    start = time.perf_counter()
+    documents = merge_risk_data(risks, mitigations, client)
+    return documents, client.requests, time.perf_counter() - start
+
+
+def main(sizes):
+    print(f"{'risks':>8} {'cache':>6} {'run 2 requests':>15} {'run 2 seconds':>14} {'run 2 hit rate':>15}")
+    for n_risks in sizes:
+        risks, mitigations = synthetic_lists(n_risks)
+        edited = edit_titles(risks)
+
+        run(risks, mitigations, None)
+        expected, requests, seconds = run(edited, mitigations, None)
+        print(f"{n_risks:>8} {'no':>6} {requests:>15} {seconds:>14.2f} {'-':>15}")
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = EmbeddingCache(os.path.join(directory, "cache.sqlite"))
+            run(risks, mitigations, cache)
+            cache.stats = dict.fromkeys(cache.stats, 0)
+            documents, requests, seconds = run(edited, mitigations, cache)
+            assert documents == expected
+            print(f"{n_risks:>8} {'yes':>6} {requests:>15} {seconds:>14.2f} {cache.hit_rate():>15.1%}")
+            cache.close()
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [3000, 20000])
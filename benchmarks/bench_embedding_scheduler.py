@@ -0,0 +1,82 @@
+"""
+Re-embedding a register against a simulated deployment that enforces its tokens per minute quota and
+answers 429 with a Retry-After when it is exceeded:
+
+- serial: one request at a time, no limiter and no retry (generate_embeddings before the scheduler,
+  throttled texts were stored as [])
+- retry only: 4 concurrent requests retrying 429s, without the limiter
+- scheduler: 4 concurrent requests behind a RateLimiter sized to the quota
+
+Run from the repository root:
+    python benchmarks/bench_embedding_scheduler.py [number of distinct texts ...]
+"""
+import os
+import sys
+import math
+import time
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_embedding_batching import FakeResponse, fake_vector, ROUND_TRIP_SECONDS
+from embedding import count_tokens, pack_batches
+from embedding_scheduler import EmbeddingScheduler, RateLimiter, TokenBucket
+
+QUOTA_TPM = 600000
+QUOTA_RPM = 3600
+
+
+class QuotaService:
+    """Answers embedding requests within a token and request quota, 429 with Retry-After above it."""
+
+    def __init__(self, tokens_per_minute=QUOTA_TPM, requests_per_minute=QUOTA_RPM):
+        self.buckets = [TokenBucket(tokens_per_minute), TokenBucket(requests_per_minute)]
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+
+    def send(self, texts):
+        cost = [sum(count_tokens(text) for text in texts), 1]
+        with self.lock:
+            self.requests += 1
+            waits = [bucket.reserve(amount) for bucket, amount in zip(self.buckets, cost)]
+            if max(waits) > 0:
+                # a rejected request is not charged
+                for bucket, amount in zip(self.buckets, cost):
+                    bucket.tokens += amount
+                self.throttled += 1
+                return FakeResponse(429, headers={"Retry-After": str(math.ceil(max(waits)))})
+        time.sleep(ROUND_TRIP_SECONDS)
+        return FakeResponse(200, [{"index": index, "embedding": fake_vector(text)} for index, text in enumerate(texts)])
+
+
+def run(texts, limiter, max_concurrency, max_retries):
+    service = QuotaService()
+    scheduler = EmbeddingScheduler(service.send, count_tokens, limiter, max_concurrency, max_retries)
+    # packed to the burst of the quota in every mode, a larger request is never accepted
+    batches, _ = pack_batches(texts, max_tokens=QUOTA_TPM // 6)
+    start = time.perf_counter()
+    results = scheduler.run([[texts[index] for index in batch] for batch in batches])
+    return results, time.perf_counter() - start, service
+
+
+def main(sizes):
+    print(f"{'texts':>7} {'mode':>11} {'seconds':>8} {'requests':>9} {'429s':>6} {'embedded':>9} {'failed':>7}")
+    unlimited = 10 ** 12
+    for n_texts in sizes:
+        texts = [f"Risk {index}: supplier delay on critical deliveries for programme {index % 97}"
+                 for index in range(n_texts)]
+        for mode, limiter, max_concurrency, max_retries in [
+            ("serial", RateLimiter(unlimited, unlimited), 1, 0),
+            ("retry only", RateLimiter(unlimited, unlimited), 4, 6),
+            ("scheduler", RateLimiter(QUOTA_TPM, QUOTA_RPM), 4, 6),
+        ]:
+            results, seconds, service = run(texts, limiter, max_concurrency, max_retries)
+            if not results.failures:
+                assert results.embeddings == {text: fake_vector(text) for text in texts}
+            print(f"{n_texts:>7} {mode:>11} {seconds:>8.2f} {service.requests:>9} {service.throttled:>6} "
+                  f"{len(results.embeddings):>9} {len(results.failures):>7}")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [5000, 20000])
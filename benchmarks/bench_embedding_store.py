@@ -0,0 +1,92 @@
+"""
+Size and read time of the merged register with its embeddings inline as json float lists (previous
+format) against json documents that only keep row numbers plus an embedding_store sidecar in float32,
+float16 and int8. For the reduced types the worst cosine similarity to the original vectors is shown.
+
+Run from the repository root:
+    python benchmarks/bench_embedding_store.py [number of risks ...]
+"""
+import os
+import sys
+import copy
+import json
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from blob_stream import iter_json_array
+from embedding_store import SUPPORTED_DTYPES, load_sidecar, pack_embeddings
+
+DIMENSIONS = 1536
+
+
+def synthetic_documents(n_risks, seed=17):
+    """Risk documents as merge_risk_data returns them: identical Status/Likelihood texts share a vector."""
+    rng = np.random.default_rng(seed)
+    pick = random.Random(seed)
+
+    def vector():
+        values = rng.standard_normal(DIMENSIONS).astype(np.float32)
+        return (values / np.linalg.norm(values)).tolist()
+
+    shared = {text: vector() for text in ["Open", "Closed", "Rare", "Likely", "Possible"]}
+    documents = []
+    for risk_id in range(1, n_risks + 1):
+        status, likelihood = pick.choice(["Open", "Closed"]), pick.choice(["Rare", "Likely", "Possible"])
+        documents.append({
+            "id": str(risk_id), "Title": f"Risk {risk_id}", "Status": status, "Likelihood": likelihood,
+            "mitigations": [{"id": str(risk_id * 10), "ResponsePlan": "Escalate"}],
+            "embeddings": {"Title": vector(), "Status": shared[status], "Likelihood": shared[likelihood]},
+        })
+    return documents
+
+
+def write(path, chunks):
+    with open(path, "wb") as output:
+        for chunk in chunks:
+            output.write(chunk)
+    return os.path.getsize(path)
+
+
+def main(sizes):
+    print(f"{'risks':>7} {'format':>15} {'json MB':>8} {'vectors MB':>11} {'read s':>7} {'min cosine':>11}")
+    for n_risks in sizes:
+        documents = synthetic_documents(n_risks)
+        with tempfile.TemporaryDirectory() as directory:
+            for label, indent in [("inline indent=2", 2), ("inline compact", None)]:
+                json_path = os.path.join(directory, "inline.json")
+                size = write(json_path, iter_json_array(documents, indent))
+                start = time.perf_counter()
+                with open(json_path, "rb") as json_file:
+                    loaded = json.loads(json_file.read())
+                matrix = np.array([document["embeddings"]["Title"] for document in loaded], dtype=np.float32)
+                seconds = time.perf_counter() - start
+                print(f"{n_risks:>7} {label:>15} {size / 1e6:>8.1f} {'-':>11} {seconds:>7.2f} {'-':>11}")
+
+            original = np.array([document["embeddings"]["Title"] for document in documents], dtype=np.float32)
+            for dtype in SUPPORTED_DTYPES:
+                packed = copy.deepcopy(documents)
+                sidecar = pack_embeddings(packed, dtype)
+                json_path = os.path.join(directory, f"{dtype}.json")
+                npy_path, index_path = os.path.join(directory, f"{dtype}.npy"), os.path.join(directory, f"{dtype}.index.json")
+                size = write(json_path, iter_json_array(packed))
+                sidecar.save(npy_path, index_path)
+                vectors_size = os.path.getsize(npy_path) + os.path.getsize(index_path)
+
+                start = time.perf_counter()
+                with open(json_path, "rb") as json_file:
+                    loaded = json.loads(json_file.read())
+                mapped = load_sidecar(npy_path, index_path)
+                rows = [document["embeddings"]["Title"] for document in loaded]
+                matrix = mapped.matrix()[rows]
+                seconds = time.perf_counter() - start
+                cosine = (matrix * original).sum(axis=1) / np.linalg.norm(matrix, axis=1)
+                print(f"{n_risks:>7} {dtype:>15} {size / 1e6:>8.1f} {vectors_size / 1e6:>11.1f} {seconds:>7.2f} "
+                      f"{cosine.min():>11.5f}")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [2000, 10000])
@@ -0,0 +1,77 @@
+"""
+Benchmark of merge_lists on the hash join engine against the previous sort-merge implementation, on
+register items in id order (where both must agree) and shuffled (where the sort-merge drops mitigations).
+
+Run from the repository root:
+    python benchmarks/bench_merge_engine.py [number of risks ...]
+"""
+import os
+import sys
+import random
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from merge_engine import JoinSpec, SecondaryJoin, hash_join
+
+
+def merge_lists_previous(rr_data, rm_data):
+    """merge_lists before the merge engine: sort-merge that needs the register in id order."""
+    sorted_rm_data = sorted(rm_data, key=lambda x: int(x["RiskId"]))
+    merged_data = []
+    rm_index = 0
+    for rr_item in rr_data:
+        rr_id = int(rr_item.get("id"))
+        rr_item = {**rr_item, "Mitigations": []}
+        while rm_index < len(sorted_rm_data) and int(sorted_rm_data[rm_index].get("RiskId")) == rr_id:
+            rr_item["Mitigations"].append(sorted_rm_data[rm_index])
+            rm_index += 1
+        merged_data.append(rr_item)
+    return merged_data
+
+
+RISK_MITIGATIONS_JOIN = JoinSpec(primary_key="id", secondaries=[SecondaryJoin("Mitigations", key="RiskId")])
+
+
+def merge_lists(rr_data, rm_data):
+    return list(hash_join(RISK_MITIGATIONS_JOIN, rr_data, {"Mitigations": rm_data}))
+
+
+def synthetic_lists(n_risks, seed=13):
+    rng = random.Random(seed)
+    risks = [{"id": risk_id, "Title": f"Risk {risk_id}", "Status": "Open"} for risk_id in range(1, n_risks + 1)]
+    mitigations = [{"id": n_risks + index, "RiskId": rng.randint(1, n_risks), "ResponsePlan": "Escalate"}
+                   for index in range(n_risks * 2)]
+    return risks, mitigations
+
+
+def attached(merged):
+    return sum(len(item["Mitigations"]) for item in merged)
+
+
+def best_of(func, *args, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(sizes):
+    print(f"{'risks':>8} {'order':>9} {'sort-merge (s)':>15} {'hash join (s)':>14} {'attached before':>16} {'attached now':>13}")
+    for n_risks in sizes:
+        risks, mitigations = synthetic_lists(n_risks)
+        shuffled = random.Random(1).sample(risks, len(risks))
+        for order, register in [("by id", risks), ("shuffled", shuffled)]:
+            previous = merge_lists_previous(register, mitigations)
+            merged = merge_lists(register, mitigations)
+            if order == "by id":
+                assert previous == merged
+            assert attached(merged) == len(mitigations)
+            print(f"{n_risks:>8} {order:>9} {best_of(merge_lists_previous, register, mitigations):>15.4f} "
+                  f"{best_of(merge_lists, register, mitigations):>14.4f} {attached(previous):>16} {attached(merged):>13}")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [10000, 100000])
@@ -0,0 +1,87 @@
+"""
+Benchmark of a delta sync of the merged register: merging the patched cleaned lists again and serializing
+every document (previous merge_stored_lists) against patching a MergedDocumentStore, which rebuilds and
+re-encodes only the risks touched by the changes. Both must produce the same bytes.
+
+Run from the repository root:
+    python benchmarks/bench_merge_store.py [number of risks ...]
+"""
+import os
+import sys
+import random
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blob_stream import iter_json_array
+from data_cleaning_anurag import RISK_MITIGATIONS_JOIN, merge_lists
+from delta_sync_funcs import apply_changes
+from merge_store import MergedDocumentStore
+
+
+def synthetic_lists(n_risks, seed=21):
+    """Cleaned register and mitigation items, about two mitigations per risk."""
+    rng = random.Random(seed)
+    risks = [
+        {"id": risk_id, "Title": f"Risk {risk_id} supplier delay", "Status": rng.choice(["Open", "Closed"]),
+         "FinancialImpact": round(rng.random() * 1e6, 2), "Modified": "2025-03-17 10:41:16"}
+        for risk_id in range(1, n_risks + 1)
+    ]
+    mitigations = [
+        {"id": n_risks + index, "RiskId": rng.randint(1, n_risks), "ResponsePlan": "Escalate and review weekly",
+         "ResponseDate": "2025-03-17 10:41:16"}
+        for index in range(n_risks * 2)
+    ]
+    return risks, mitigations
+
+
+def synthetic_delta(risks, mitigations, n_changes, seed=5):
+    """A delta sync result per list: edited, moved, added and removed items, ids removed as strings like Graph."""
+    rng = random.Random(seed)
+    changed_risks = [{**risk, "Status": "Closed"} for risk in rng.sample(risks, n_changes)]
+    changed_risks.append({"id": len(risks) + len(mitigations) + 1, "Title": "New risk", "Status": "Open"})
+    removed_risks = {str(risk["id"]) for risk in rng.sample(risks, 2)} - {str(r["id"]) for r in changed_risks}
+    changed_mitigations = [{**mitigation, "RiskId": rng.randint(1, len(risks))}
+                           for mitigation in rng.sample(mitigations, n_changes)]
+    changed_mitigations.append({"id": len(risks) + len(mitigations) + 2, "RiskId": changed_risks[-1]["id"],
+                                "ResponsePlan": "New plan"})
+    removed_mitigations = ({str(m["id"]) for m in rng.sample(mitigations, 2)}
+                           - {str(m["id"]) for m in changed_mitigations})
+    return (changed_risks, removed_risks), (changed_mitigations, removed_mitigations)
+
+
+def full_merge(risks, mitigations, risk_changes, mitigation_changes):
+    patched_risks = apply_changes(risks, *risk_changes)
+    patched_mitigations = apply_changes(mitigations, *mitigation_changes)
+    return b"".join(iter_json_array(merge_lists(patched_risks, patched_mitigations)))
+
+
+def incremental_merge(store, risk_changes, mitigation_changes):
+    store.apply_changes(risk_changes, {"Mitigations": mitigation_changes})
+    return b"".join(store.iter_json())
+
+
+def main(sizes, n_changes=20):
+    print(f"{'risks':>8} {'changes':>8} {'full merge (s)':>15} {'store (s)':>10} {'speedup':>8}")
+    for n_risks in sizes:
+        risks, mitigations = synthetic_lists(n_risks)
+        risk_changes, mitigation_changes = synthetic_delta(risks, mitigations, n_changes)
+
+        start = time.perf_counter()
+        expected = full_merge(risks, mitigations, risk_changes, mitigation_changes)
+        full_seconds = time.perf_counter() - start
+
+        store = MergedDocumentStore(RISK_MITIGATIONS_JOIN).load(risks, {"Mitigations": mitigations})
+        # the store was written once by the previous sync, so its documents are already encoded
+        assert b"".join(store.iter_json()) == b"".join(iter_json_array(merge_lists(risks, mitigations)))
+        start = time.perf_counter()
+        patched = incremental_merge(store, risk_changes, mitigation_changes)
+        store_seconds = time.perf_counter() - start
+
+        assert patched == expected
+        print(f"{n_risks:>8} {n_changes:>8} {full_seconds:>15.4f} {store_seconds:>10.4f} "
+              f"{full_seconds / store_seconds:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [10000, 100000])
@@ -0,0 +1,153 @@
+"""
+Benchmark of the fused single pass cleaning (clean_merged_data) against the three pass
+remove_unwanted_fields -> clean_data -> convert_numeric used by get_merged_json before, both with the
+previous clean_data (list elements cleaned twice) and the current one. All outputs must be identical.
+
+Run from the repository root:
+    python benchmarks/bench_merged_cleaning.py [number of risks ...]
+"""
+import os
+import sys
+import json
+import random
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from merged_cleaning import UNWANTED_KEYS, clean_merged_data, convert_numeric_value
+
+
+# ------------------------------
+# Three pass cleaning (previous implementation, the baseline)
+# ------------------------------
+def remove_unwanted_fields(data, unwanted_keys=UNWANTED_KEYS):
+    """Recursively removes unwanted keys from the JSON data."""
+    if isinstance(data, dict):
+        return {k: remove_unwanted_fields(v, unwanted_keys) for k, v in data.items() if k not in unwanted_keys}
+    elif isinstance(data, list):
+        return [remove_unwanted_fields(item, unwanted_keys) for item in data]
+    else:
+        return data
+
+
+def clean_data(data):
+    """Recursively cleans the data by removing unwanted values and characters."""
+    if isinstance(data, dict):
+        cleaned_dict = {}
+        for key, value in data.items():
+            cleaned_value = clean_data(value)
+            if cleaned_value is not None and cleaned_value != "":
+                cleaned_dict[key] = cleaned_value
+        return cleaned_dict
+    elif isinstance(data, list):
+        cleaned_list = []
+        for item in data:
+            cleaned_item = clean_data(item)
+            if cleaned_item not in (None, ""):
+                cleaned_list.append(cleaned_item)
+        return cleaned_list
+    elif isinstance(data, str):
+        data = data.replace(";", "")
+        data = data.replace("#Name?", "Name")
+        return data
+    else:
+        return data
+
+
+def convert_numeric(data):
+    """Recursively converts numeric strings to numbers and converts 'no' to 0."""
+    if isinstance(data, dict):
+        return {k: convert_numeric(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [convert_numeric(item) for item in data]
+    elif isinstance(data, str):
+        return convert_numeric_value(data)
+    else:
+        return data
+
+
+def synthetic_merged_list(n_risks, mitigations_per_risk=3, seed=7):
+    """Merged register items shaped like merge_multiple_lists output."""
+    rng = random.Random(seed)
+    statuses = ["Open", "Closed", "Cancelled", ""]
+    merged = []
+    for risk_id in range(1, n_risks + 1):
+        item = {
+            "@odata.etag": f'"{risk_id},3"',
+            "id": str(risk_id),
+            "Title": f"Risk {risk_id}; supplier delay #Name?",
+            "Status": rng.choice(statuses),
+            "Likelihood": rng.choice(["Rare", "Likely", "no"]),
+            "FinancialImpact": f"{rng.random() * 1e6:.2f}",
+            "ImpactScore": str(rng.randint(1, 5)),
+            "Owners": "owner@example.com;",
+            "Countries": ["DE", "", "FR", None],
+            "RiskIssueOwner": [{"LookupId": str(rng.randint(1, 99)), "LookupValue": "Owner", "Email": "o@example.com"}],
+            "Calculated_TargetDate": None,
+            "webUrl": "https://example.sharepoint.com/item",
+        }
+        item["mitigations"] = [
+            {
+                "id": str(risk_id * 10 + m),
+                "RiskId": f"{risk_id}.0",
+                "ResponsePlan": "Escalate; review weekly",
+                "ResponseDate": "2025-03-17T10:41:16Z",
+                "Attachments": False,
+                "ItemChildCount": "0",
+            }
+            for m in range(mitigations_per_risk)
+        ]
+        merged.append(item)
+    return merged
+
+
+def clean_data_previous(data):
+    """clean_data as it was before: every list element is cleaned twice, once for the filter."""
+    if isinstance(data, dict):
+        cleaned_dict = {}
+        for key, value in data.items():
+            cleaned_value = clean_data_previous(value)
+            if cleaned_value is not None and cleaned_value != "":
+                cleaned_dict[key] = cleaned_value
+        return cleaned_dict
+    elif isinstance(data, list):
+        return [clean_data_previous(item) for item in data if clean_data_previous(item) not in (None, "")]
+    elif isinstance(data, str):
+        return data.replace(";", "").replace("#Name?", "Name")
+    else:
+        return data
+
+
+def three_pass_previous(data):
+    return convert_numeric(clean_data_previous(remove_unwanted_fields(data)))
+
+
+def three_pass(data):
+    return convert_numeric(clean_data(remove_unwanted_fields(data)))
+
+
+def best_of(func, data, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(data)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(sizes):
+    print(f"{'risks':>8} {'previous (s)':>13} {'three pass (s)':>15} {'fused (s)':>10} {'speedup':>8}")
+    for n_risks in sizes:
+        data = synthetic_merged_list(n_risks)
+        expected = json.dumps(three_pass_previous(data), indent=2)
+        assert expected == json.dumps(three_pass(data), indent=2)
+        assert expected == json.dumps(clean_merged_data(data), indent=2)
+        previous_seconds = best_of(three_pass_previous, data)
+        three_pass_seconds = best_of(three_pass, data)
+        fused_seconds = best_of(clean_merged_data, data)
+        print(f"{n_risks:>8} {previous_seconds:>13.4f} {three_pass_seconds:>15.4f} {fused_seconds:>10.4f} "
+              f"{previous_seconds / fused_seconds:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [1000, 10000, 50000])
@@ -0,0 +1,84 @@
+"""
+Benchmark of the in-memory full sync pipeline (items stay python objects, serialized once per blob with
+json_codec) against the previous string pipeline, where every step returned json.dumps output that the
+next step parsed again. Reports run time and peak traced memory; both must upload the same json.
+
+Run from the repository root:
+    python benchmarks/bench_object_pipeline.py [number of risks ...]
+"""
+import os
+import sys
+import json
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json_codec
+from bench_columnar_cleaning import synthetic_items
+from data_cleaning_anurag import clean_and_format_data, merge_lists
+
+LISTS = ["Risk Register", "Risk Mitigations"]
+
+
+def mitigations_for(risk_items, per_risk=2):
+    items = synthetic_items("Risk Mitigations", len(risk_items) * per_risk)
+    for index, item in enumerate(items):
+        item["fields"]["RiskId"] = risk_items[index // per_risk]["id"]
+    return items
+
+
+def string_pipeline(raw_lists):
+    """Previous flow: get_list_details -> json string, cleaning -> json string, merge -> json string."""
+    blobs = {}
+    cleaned = {}
+    for list_name, raw_items in raw_lists.items():
+        raw_json = json.dumps(raw_items)
+        blobs[f"uncleaned/{list_name}"] = raw_json
+        cleaned_json = json.dumps(clean_and_format_data(json.loads(raw_json), list_name))
+        blobs[f"cleaned/{list_name}"] = cleaned_json
+        cleaned[list_name] = cleaned_json
+    merged = json.dumps(merge_lists(json.loads(cleaned[LISTS[0]]), json.loads(cleaned[LISTS[1]])))
+    blobs["merged"] = merged
+    return blobs
+
+
+def object_pipeline(raw_lists):
+    """Current flow: objects end to end, json_codec.dumps only for the uploads."""
+    blobs = {}
+    cleaned = {}
+    for list_name, raw_items in raw_lists.items():
+        blobs[f"uncleaned/{list_name}"] = json_codec.dumps(raw_items)
+        cleaned[list_name] = clean_and_format_data(raw_items, list_name)
+        blobs[f"cleaned/{list_name}"] = json_codec.dumps(cleaned[list_name])
+    blobs["merged"] = json_codec.dumps(merge_lists(cleaned[LISTS[0]], cleaned[LISTS[1]]))
+    return blobs
+
+
+def measure(func, raw_lists):
+    """Timed without tracing, tracemalloc slows allocation heavy code down a lot."""
+    start = time.perf_counter()
+    blobs = func(raw_lists)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    func(raw_lists)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return blobs, seconds, peak / 2 ** 20
+
+
+def main(sizes):
+    print(f"encoder: {'orjson' if json_codec.use_orjson() else 'json'}")
+    print(f"{'risks':>8} {'strings (s)':>12} {'objects (s)':>12} {'strings (MiB)':>14} {'objects (MiB)':>14}")
+    for n_risks in sizes:
+        risks = synthetic_items("Risk Register", n_risks)
+        raw_lists = {LISTS[0]: risks, LISTS[1]: mitigations_for(risks)}
+        string_blobs, string_seconds, string_peak = measure(string_pipeline, raw_lists)
+        object_blobs, object_seconds, object_peak = measure(object_pipeline, raw_lists)
+        assert {name: json.loads(blob) for name, blob in string_blobs.items()} == \
+               {name: json_codec.loads(blob) for name, blob in object_blobs.items()}
+        print(f"{n_risks:>8} {string_seconds:>12.3f} {object_seconds:>12.3f} {string_peak:>14.1f} {object_peak:>14.1f}")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [2000, 10000])
@@ -0,0 +1,53 @@
+"""
+Benchmark of the chunked process pool cleaning (parallel_cleaning) against single process cleaning,
+for clean_and_format_data and for the merged register cleaning. Results must be identical and in order.
+
+Run from the repository root:
+    python benchmarks/bench_parallel_cleaning.py [number of items ...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_columnar_cleaning import synthetic_items
+from bench_merged_cleaning import synthetic_merged_list
+from data_cleaning_anurag import clean_and_format_data
+from merged_cleaning import clean_merged_data
+from parallel_cleaning import CLEANING_CHUNK_SIZE, clean_list_items, get_cleaning_pool, iter_clean_merged_items
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main(sizes):
+    worker_counts = sorted({2, os.cpu_count() or 1})
+    for workers in worker_counts:
+        # start the workers outside the timings, warm invocations reuse them
+        get_cleaning_pool(workers).submit(int).result()
+    print(f"chunk size {CLEANING_CHUNK_SIZE}, {os.cpu_count()} cpus")
+    print(f"{'input':>28} {'items':>8} {'workers':>8} {'single (s)':>11} {'parallel (s)':>13} {'speedup':>8}")
+    for n_items in sizes:
+        items = synthetic_items("Risk Register", n_items)
+        expected, single_seconds = timed(clean_and_format_data, items, "Risk Register")
+        for workers in worker_counts:
+            cleaned, seconds = timed(lambda: clean_list_items(items, "Risk Register", max_workers=workers, min_items=0))
+            assert cleaned == expected
+            print(f"{'clean_and_format_data':>28} {n_items:>8} {workers:>8} {single_seconds:>11.3f} {seconds:>13.3f} "
+                  f"{single_seconds / seconds:>7.2f}x")
+
+        merged = synthetic_merged_list(n_items)
+        expected, single_seconds = timed(lambda: [clean_merged_data(item) for item in merged])
+        for workers in worker_counts:
+            cleaned, seconds = timed(lambda: list(iter_clean_merged_items(merged, max_workers=workers, min_items=0)))
+            assert cleaned == expected
+            print(f"{'clean_merged_data':>28} {n_items:>8} {workers:>8} {single_seconds:>11.3f} {seconds:>13.3f} "
+                  f"{single_seconds / seconds:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [20000, 100000])
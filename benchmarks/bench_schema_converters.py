@@ -0,0 +1,119 @@
+"""
+Benchmark of the compiled converter tables (convert_item / format_value) against the previous
+format_value, which resolved the expected type of every key through an if/elif chain on each row.
+Both must produce identical output.
+
+Run from the repository root:
+    python benchmarks/bench_schema_converters.py [number of rows ...]
+"""
+import os
+import sys
+import ast
+import json
+import random
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dateutil.parser import parse as date_parse
+from data_cleaning_anurag import column_schema, compiled_column_schema, convert_item
+
+
+def synthetic_rows(list_type, n_rows, seed=11):
+    """Cleaned SharePoint items (after key formatting and column selection) for a list type."""
+    rng = random.Random(seed)
+    values = {
+        "date": lambda: f"2025-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}T10:{rng.randint(10, 59)}:16Z",
+        int: lambda: rng.choice([str(rng.randint(1, 9999)), rng.randint(1, 9999), "No", None]),
+        float: lambda: f"{rng.random() * 1e6:.2f}",
+        bool: lambda: rng.choice([True, False, "Yes", "no", 1, 0, None]),
+        str: lambda: rng.choice(["  Supplier delay on phase 2 ", "Open", "owner@example.com", "42"]),
+        list: lambda: [{"LookupId": rng.randint(1, 99), "LookupValue": "Owner", "Email": "o@example.com"}],
+    }
+    columns = column_schema[list_type]
+    return [{key: values[expected_type]() for key, expected_type in columns.items()} for _ in range(n_rows)]
+
+
+def format_value_previous(data, column_types):
+    """format_value before the converter tables were compiled."""
+    if isinstance(data, dict):
+        new_data = {}
+        for key, value in data.items():
+            if isinstance(value, dict):
+                value = format_value_previous(value, column_types)
+            else:
+                if isinstance(value, list):
+                    value = [format_value_previous(item, column_types) if isinstance(item, dict) else item for item in value]
+            if key in column_types:
+                expected_type = column_types[key]
+                if expected_type == "date":
+                    try:
+                        new_value = date_parse(value).strftime("%Y-%m-%d %H:%M:%S")
+                    except Exception:
+                        new_value = None
+                elif expected_type == int:
+                    try:
+                        new_value = 0 if value == "No" else int(value)
+                    except Exception:
+                        new_value = None
+                elif expected_type == float:
+                    try:
+                        new_value = float(value)
+                    except Exception:
+                        new_value = None
+                elif expected_type == bool:
+                    if isinstance(value, str):
+                        new_value = value.lower().strip() in ["yes", "1", "true"]
+                    elif isinstance(value, (int, float)):
+                        new_value = value == 1
+                    else:
+                        new_value = False
+                elif expected_type == str:
+                    try:
+                        eval_value = ast.literal_eval(value)
+                        if isinstance(eval_value, (list, dict)):
+                            value = eval_value
+                    except (ValueError, SyntaxError):
+                        pass
+                    if isinstance(value, str):
+                        new_value = str(value).strip()
+                else:
+                    new_value = value
+            else:
+                new_value = value
+            new_data[key] = new_value
+        return new_data
+    elif isinstance(data, list):
+        return [format_value_previous(item, column_types) if isinstance(item, dict) else item for item in data]
+    return data
+
+
+def compiled(rows, converters):
+    return [convert_item(row, converters) for row in rows]
+
+
+def best_of(func, *args, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(sizes):
+    print(f"{'list':>18} {'rows':>8} {'previous (s)':>13} {'compiled (s)':>13} {'speedup':>8}")
+    for list_type, column_types in column_schema.items():
+        converters = compiled_column_schema[list_type]
+        for n_rows in sizes:
+            rows = synthetic_rows(list_type, n_rows)
+            expected = json.dumps(format_value_previous(rows, column_types))
+            assert expected == json.dumps(compiled(rows, converters))
+            previous_seconds = best_of(format_value_previous, rows, column_types)
+            compiled_seconds = best_of(compiled, rows, converters)
+            print(f"{list_type:>18} {n_rows:>8} {previous_seconds:>13.4f} {compiled_seconds:>13.4f} "
+                  f"{previous_seconds / compiled_seconds:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [100000])
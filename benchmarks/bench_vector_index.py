@@ -0,0 +1,82 @@
+"""
+Query latency of the VectorIndex over a memory mapped sidecar of synthetic clustered embeddings
+(1536 dimensions, like text-embedding-ada-002), in brute and ivf mode, plus the recall@10 of ivf
+against the exact brute force results. The first brute query reads the memory map from disk, it is
+reported separately as the cold query.
+
+Run from the repository root:
+    python benchmarks/bench_vector_index.py [number of risks ...]
+"""
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_store import EmbeddingSidecar, load_sidecar
+from vector_index import VectorIndex
+
+DIMENSIONS = 1536
+CLUSTERS = 200
+QUERIES = 50
+K = 10
+
+
+def synthetic_sidecar(n_risks, directory, seed=5):
+    """Rows scattered around CLUSTERS topics, saved as float32 and opened memory mapped."""
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((CLUSTERS, DIMENSIONS)).astype(np.float32)
+    vectors = np.empty((n_risks, DIMENSIONS), dtype=np.float32)
+    for start in range(0, n_risks, 10000):
+        end = min(start + 10000, n_risks)
+        vectors[start:end] = (topics[rng.integers(0, CLUSTERS, end - start)]
+                              + 0.8 * rng.standard_normal((end - start, DIMENSIONS)).astype(np.float32))
+    index = {str(row): {"Title": row} for row in range(n_risks)}
+    npy_path = os.path.join(directory, f"risks-{n_risks}.npy")
+    index_path = os.path.join(directory, f"risks-{n_risks}.index.json")
+    EmbeddingSidecar(vectors, index, "float32").save(npy_path, index_path)
+    queries = topics[rng.integers(0, CLUSTERS, QUERIES)] + 0.8 * rng.standard_normal((QUERIES, DIMENSIONS))
+    return load_sidecar(npy_path, index_path), queries.astype(np.float32)
+
+
+def timed_queries(index, queries):
+    results = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(index.search(query, K))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, np.array(latencies)
+
+
+def main(sizes):
+    print(f"{'risks':>8} {'mode':>6} {'build s':>8} {'cold ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'recall@10':>10}")
+    for n_risks in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            sidecar, queries = synthetic_sidecar(n_risks, directory)
+
+            start = time.perf_counter()
+            brute = VectorIndex(sidecar, mode="brute")
+            brute_build = time.perf_counter() - start
+            start = time.perf_counter()
+            brute.search(queries[0], K)
+            cold_ms = (time.perf_counter() - start) * 1000
+            exact, brute_latencies = timed_queries(brute, queries)
+            print(f"{n_risks:>8} {'brute':>6} {brute_build:>8.2f} {cold_ms:>8.1f} "
+                  f"{np.percentile(brute_latencies, 50):>8.1f} {np.percentile(brute_latencies, 95):>8.1f} {1.0:>10.3f}")
+
+            start = time.perf_counter()
+            ivf = VectorIndex(sidecar, mode="ivf")
+            ivf_build = time.perf_counter() - start
+            approximate, ivf_latencies = timed_queries(ivf, queries)
+            recall = np.mean([len({document_id for document_id, _ in found} & {document_id for document_id, _ in truth}) / K
+                              for found, truth in zip(approximate, exact)])
+            print(f"{n_risks:>8} {'ivf':>6} {ivf_build:>8.2f} {'':>8} "
+                  f"{np.percentile(ivf_latencies, 50):>8.1f} {np.percentile(ivf_latencies, 95):>8.1f} {recall:>10.3f}")
+            del brute, ivf, sidecar
+
+
+if __name__ == "__main__":
+    main([int(n) for n in sys.argv[1:]] or [10000, 50000, 100000])
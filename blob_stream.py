@@ -0,0 +1,141 @@
+import os
+import uuid
+import base64
+import logging
+from dotenv import load_dotenv
+from azure.storage.blob import BlobBlock
+import json_codec
+load_dotenv()
+logger = logging.getLogger("tt_sharepoint_logger")
+
+# Size of each staged block. Only about one block of output is buffered at a time.
+BLOB_BLOCK_SIZE = int(os.getenv("BLOB_BLOCK_SIZE", str(4 * 1024 * 1024)))
+# Pretty print json blobs and responses (indent=2). Compact output is smaller and faster to write.
+JSON_PRETTY = os.getenv("JSON_PRETTY", "false").lower() == "true"
+
+
+def json_indent(pretty=None):
+    """Returns the indent for json_codec.dumps, JSON_PRETTY decides when pretty is None."""
+    if pretty is None:
+        pretty = JSON_PRETTY
+    return 2 if pretty else None
+
+
+def encode_json(data, indent=None):
+    encoded = json_codec.dumps(data, indent=indent)
+    return encoded.encode("utf-8") if isinstance(encoded, str) else encoded
+
+
+def encode_json_element(item, indent=None):
+    """Encodes one element of a json array as it appears inside the array, indented one level when indent is set."""
+    encoded = encode_json(item, indent)
+    if indent:
+        encoded = b"  " + encoded.replace(b"\n", b"\n  ")
+    return encoded
+
+
+def frame_json_array(encoded_items, indent=None):
+    """
+    Yield the chunks of a json array from elements already encoded with encode_json_element,
+    so callers that keep encoded elements around only encode the ones that changed.
+    """
+    separator = b",\n" if indent else b","
+    first = True
+    for encoded in encoded_items:
+        if first:
+            yield (b"[\n" if indent else b"[") + encoded
+            first = False
+        else:
+            yield separator + encoded
+    if first:
+        yield b"[]"
+    else:
+        yield b"\n]" if indent else b"]"
+
+
+def iter_json_array(items, indent=None):
+    """
+    Yield a json array as utf-8 chunks, one chunk per element, without holding the whole array or its text.
+    With indent=2 the output is the same as json.dumps(list(items), indent=2).
+
+    Params:
+    items -> any iterable of json serializable elements, e.g. a generator
+    indent -> None for compact output or 2
+    """
+    return frame_json_array((encode_json_element(item, indent) for item in items), indent)
+
+
+class BlockBlobWriter:
+    """
+    Writes byte chunks to a block blob with stage_block/commit_block_list. Chunks are buffered until
+    block_size bytes are collected, so memory stays at about one block whatever the blob size.
+    The blob is replaced only when commit() is called.
+    """
+
+    def __init__(self, blob_client, block_size=BLOB_BLOCK_SIZE):
+        self.blob_client = blob_client
+        self.block_size = block_size
+        # block ids of one blob must all have the same length
+        self._prefix = uuid.uuid4().hex
+        self._block_list = []
+        self._buffer = bytearray()
+        self.total = 0
+
+    def _stage(self, data):
+        block_id = base64.b64encode(f"{self._prefix}-{len(self._block_list):08d}".encode()).decode()
+        self.blob_client.stage_block(block_id=block_id, data=bytes(data))
+        self._block_list.append(BlobBlock(block_id=block_id))
+
+    def write(self, chunk):
+        self._buffer += chunk
+        self.total += len(chunk)
+        if len(self._buffer) >= self.block_size:
+            self._stage(self._buffer)
+            self._buffer = bytearray()
+
+    def commit(self):
+        """Commit the staged blocks. Returns the etag of the committed blob, the version this upload wrote."""
+        if self._buffer or not self._block_list:
+            self._stage(self._buffer)
+            self._buffer = bytearray()
+        committed = self.blob_client.commit_block_list(self._block_list)
+        logger.info(f"Uploaded {self.total} bytes to {self.blob_client.blob_name} in {len(self._block_list)} blocks")
+        return committed["etag"]
+
+
+def upload_json_stream(blob_client, chunks, block_size=BLOB_BLOCK_SIZE):
+    """
+    Write byte chunks to a block blob through a BlockBlobWriter, about one block is buffered at a time.
+
+    Returns the etag of the committed blob, the version this upload wrote.
+    """
+    writer = BlockBlobWriter(blob_client, block_size)
+    for chunk in chunks:
+        writer.write(chunk)
+    return writer.commit()
+
+
+def tee_json_array(items, writer: BlockBlobWriter, indent=None):
+    """
+    Yield items unchanged while writing them to writer as a json array, so a stream that is consumed
+    by something else is uploaded on the way without being kept. The array is complete once items are
+    exhausted, writer.commit() is left to the caller.
+    """
+    passed = []
+
+    def elements():
+        for item in items:
+            passed.append(item)
+            yield encode_json_element(item, indent)
+
+    for chunk in frame_json_array(elements(), indent):
+        writer.write(chunk)
+        yield from passed
+        passed.clear()
+
+
+def upload_json_array(blob_client, items, pretty=None, block_size=BLOB_BLOCK_SIZE):
+    """
+    Stream items to a block blob as a json array. Compact unless pretty (or JSON_PRETTY) is set.
+    """
+    return upload_json_stream(blob_client, iter_json_array(items, json_indent(pretty)), block_size)
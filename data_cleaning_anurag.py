@@ -6,11 +6,35 @@ from dateutil import parser
 import json
 import os
 import logging
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+from operator import itemgetter
 from typing import Any
+from merge_engine import JoinSpec, SecondaryJoin, hash_join
+try:
+    import numpy as np
+except ImportError: # numpy only speeds up the columnar mode
+    np = None
 
 
 logger = logging.getLogger("tt_sharepoint_logger")
 
+# Number of distinct timestamp strings remembered by normalize_date. Items share many Created/Modified values.
+DATE_CACHE_SIZE = int(os.getenv("DATE_CACHE_SIZE", "8192"))
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Strict ISO-8601 as returned by Graph, e.g. 2025-03-17T10:41:16Z. Fractions and the offset are dropped
+# exactly like date_parse(...).strftime(DATE_FORMAT) drops them.
+ISO_DATETIME_PATTERN = re.compile(
+    r"([1-9]\d{3})-(\d{2})-(\d{2})(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.\d+)?)?(?:Z|[+-]\d{2}:?\d{2})?)?"
+)
+# Number of distinct list/dict strings remembered by decode_structured.
+STRUCTURED_CACHE_SIZE = int(os.getenv("STRUCTURED_CACHE_SIZE", "4096"))
+# "columnar" cleans pages of items column by column, "rows" cleans item by item. Both give the same output.
+CLEANING_MODE = os.getenv("CLEANING_MODE", "columnar")
+# Number of items turned into columns at once in the columnar mode.
+COLUMNAR_PAGE_SIZE = int(os.getenv("COLUMNAR_PAGE_SIZE", "5000"))
+
 
 rm_columns = {
   "id":int,
@@ -188,6 +212,12 @@ allowed_columns = {
     "Follow up": include_keys_follow_up
 }
 
+@lru_cache(maxsize=None)
+def normalize_key(key: str):
+    """Remove special characters,whitespace and do not format "_". Keys repeat on every item, so they are cached."""
+    return re.sub(r"\s+|[^a-zA-Z0-9_]", "", key)
+
+
 def format_columns(item):
     """
     Parameters:
@@ -199,8 +229,7 @@ def format_columns(item):
     if isinstance(item, dict):
         cleaned_column_dict = {}
         for key, value in item.items():
-            # Remove special characters,whitespace and do not format "_"
-            formatted_key = re.sub(r"\s+|[^a-zA-Z0-9_]", "", key)
+            formatted_key = normalize_key(key)
             # Process the value based on its type.
             if isinstance(value, dict):
                 formatted_value = format_columns(value)
@@ -216,8 +245,163 @@ def format_columns(item):
         return item
 
 # ------------------------------
-# Helper: Recursive conversion & formatting 
+# Helper: Compiled column converters
 # ------------------------------
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def normalize_date(value: str):
+    """
+    Returns the timestamp string as "YYYY-MM-DD HH:MM:SS", or None when it is not a date.
+
+    Strict ISO-8601 values are read with a precompiled pattern, anything else goes through dateutil.
+    """
+    match = ISO_DATETIME_PATTERN.fullmatch(value)
+    if match:
+        year, month, day, hour, minute, second = (int(part) if part else 0 for part in match.groups())
+        try:
+            return datetime(year, month, day, hour, minute, second).strftime(DATE_FORMAT)
+        except ValueError:
+            pass # e.g. 24:00:00, left to dateutil
+    try:
+        return date_parse(value).strftime(DATE_FORMAT)
+    except Exception:
+        return None
+
+
+def to_date(value):
+    if isinstance(value, str):
+        return normalize_date(value)
+    try:
+        return date_parse(value).strftime(DATE_FORMAT)
+    except Exception:
+        return None
+
+
+def to_int(value):
+    try:
+        if value == "No":
+            return 0
+        return int(value)
+    except Exception:
+        return None
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except Exception:
+        return None
+
+
+def to_bool(value):
+    if isinstance(value, str):
+        return value.lower().strip() in ("yes", "1", "true")
+    if isinstance(value, (int, float)):
+        # bool is an int, so True/False land here as well
+        return value == 1
+    return False
+
+
+@lru_cache(maxsize=STRUCTURED_CACHE_SIZE)
+def _decode_structured(value: str):
+    try:
+        decoded = json.loads(value)
+    except ValueError:
+        # python style literals, e.g. single quoted strings
+        try:
+            decoded = ast.literal_eval(value)
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            return None
+    return decoded if isinstance(decoded, (list, dict)) else None
+
+
+def decode_structured(value: str):
+    """
+    Returns the list or dict a string holds, or None for any other string.
+
+    Only values starting with '[' or '{' are parsed (JSON first, then Python literal syntax), so free text
+    never pays the parser cost. Decoded values are cached and a copy is returned.
+    """
+    if value.lstrip()[:1] not in ("[", "{"):
+        return None
+    decoded = _decode_structured(value)
+    return copy_structure(decoded) if decoded is not None else None
+
+
+def copy_structure(value):
+    # cheaper than copy.deepcopy for the plain lists and dicts decoded from strings
+    if isinstance(value, dict):
+        return {key: copy_structure(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_structure(item) for item in value]
+    return value
+
+
+def to_text(value):
+    # columns known to hold plain text (see schema_discovery) are only stripped, never parsed
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+def to_str(value):
+    if not isinstance(value, str):
+        return value
+    # Handle nested list/dict represented as string.
+    decoded = decode_structured(value)
+    if decoded is not None:
+        return decoded
+    # remove unnecessary whitespaces
+    return value.strip()
+
+
+# converter per expected type; list, dict and unknown types keep the (already recursed) value
+type_converters = {
+    "date": to_date,
+    int: to_int,
+    float: to_float,
+    bool: to_bool,
+    str: to_str,
+    "text": to_text,
+}
+
+
+def compile_schema(column_types: dict):
+    """
+    Turn a column schema into a converter table.
+
+    Params:
+    column_types -> dict mapping keys to expected types (int, float, str, "text", bool, "date", list, dict)
+
+    Returns {key: converter} holding only the keys whose values are converted.
+    """
+    converters = {}
+    for key, expected_type in column_types.items():
+        converter = type_converters.get(expected_type)
+        if converter is not None:
+            converters[key] = converter
+    return converters
+
+
+# built once at import, indexed by list type like column_schema
+compiled_column_schema = {list_type: compile_schema(column_types) for list_type, column_types in column_schema.items()}
+
+
+def convert_item(item: dict, converters: dict):
+    """
+    Convert one item with a compiled converter table. Nested dicts, also inside lists, are converted
+    with the same table.
+    """
+    new_item = {}
+    for key, value in item.items():
+        if isinstance(value, dict):
+            value = convert_item(value, converters)
+        elif isinstance(value, list):
+            value = [convert_item(sub_item, converters) if isinstance(sub_item, dict) else sub_item for sub_item in value]
+        converter = converters.get(key)
+        new_item[key] = converter(value) if converter is not None else value
+    return new_item
+
+
 def format_value(data, column_types):
     """
     Parameters:
@@ -226,103 +410,233 @@ def format_value(data, column_types):
     Returns:
       Data with values converted based on column_types.
     """
+    converters = next((compiled_column_schema[list_type] for list_type, schema in column_schema.items()
+                       if schema is column_types), None)
+    if converters is None:
+        converters = compile_schema(column_types)
     if isinstance(data, dict):
-        new_data = {}
-        for key, value in data.items():
-            # Recursively process nested structures.
-            if isinstance(value, dict):
-                value = format_value(value, column_types)
-            else:
-                if isinstance(value, list):
-                    value = [format_value(item, column_types) if isinstance(item, dict) else item for item in value]
-            if key in column_types:
-                expected_type = column_types[key]
-                if expected_type == "date":
-                    try:
-                        parsed_date = date_parse(value)   
-                        new_value = parsed_date.strftime("%Y-%m-%d %H:%M:%S")
-                    except Exception as e:
-                        new_value = None
-                elif expected_type == int:
-                    try:
-                        if value =="No":
-                            new_value=0
-                        else:
-                            new_value = int(value)
-                    except Exception:
-                        new_value = None
-                elif expected_type == float:
-                    try:
-                        new_value = float(value)
-                    except Exception:
-                        new_value = None
-                elif expected_type == bool:
-                    if isinstance(value, str):
-                        lower_val = value.lower().strip()
-                        if lower_val in ["yes", "1", "true"]:
-                            new_value = True
-                        elif lower_val in ["no", "0", "false"]:
-                            new_value = False
-                        else:
-                            new_value = False
-                    elif isinstance(value,int):
-                        if value == 1:
-                            new_value = True
-                        elif value == 0:
-                            new_value = False
-                        else:
-                            new_value = False
-                    elif isinstance(value,float):
-                        if value == 1.0:
-                            new_value = True
-                        elif value == 0.0:
-                            new_value = False
-                        else:
-                            new_value = False
-                    elif isinstance(value,bool):
-                        new_value = value
-                    else:
-                        new_value = False
-                elif expected_type == str:
-                    # Handle nested list/dict represented as string.
-                    try:
-                        #check if list or dictionary is passed as a string
-                        eval_value = ast.literal_eval(value)
-                        if isinstance(eval_value, (list, dict)):
-                            value = eval_value
-                    except (ValueError, SyntaxError):
-                        pass
-                    if isinstance(value, str):
-                        # remove unnecessary whitespaces
-                        new_value = str(value).strip()
-                elif isinstance(expected_type, list):
-                    
-                    if isinstance(value, list):
-                        new_value = [format_value(item, column_types) if isinstance(item, dict) else item for item in value]
-                    else:
-                        new_value = value
-                elif isinstance(expected_type, dict):
-                    if isinstance(value, dict):
-                        new_value = format_value(value, column_types)
-                    else:
-                        new_value = value
-                else:
-                    new_value = value
-            else:
-                new_value = value
-            new_data[key] = new_value
-        return new_data
-
+        return convert_item(data, converters)
     elif isinstance(data, list):
-        return [format_value(item, column_types) if isinstance(item, dict) else item for item in data]
+        return [convert_item(item, converters) if isinstance(item, dict) else item for item in data]
     else:
-
         return data
     
+# ------------------------------
+# Columnar cleaning
+# ------------------------------
+def select_columns(item, included_keys: list, included: frozenset):
+    """
+    Same selection as the row-wise path of clean_and_format_data, but only the selected values have their
+    nested keys formatted.
+    """
+    item = {normalize_key(key): value for key, value in item.items()}
+    selected = {}
+    for key in included_keys:
+        if key in item:
+            value = item[key]
+            selected[key] = format_columns(value) if isinstance(value, (dict, list)) else value
+    fields = item.get("fields")
+    if isinstance(fields, dict):
+        fields = {normalize_key(key): value for key, value in fields.items()}
+        for field_key, field_val in fields.items():
+            if field_key in included:
+                selected[field_key] = format_columns(field_val) if isinstance(field_val, (dict, list)) else field_val
+            if field_key == "Owners" and isinstance(field_val, str): # The email in Owners key has a ';' after the email.
+                selected[field_key] = field_val.replace(";", "")
+    return selected
+
+
+def tuple_getter(keys: list):
+    """itemgetter that always returns a tuple, also for zero or one key."""
+    if not keys:
+        return lambda mapping: ()
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda mapping: (mapping[key],)
+    return itemgetter(*keys)
+
+
+class SelectionPlan:
+    """
+    The column selection of select_columns worked out once for a layout of raw keys, so items with that
+    layout are selected with itemgetters and without normalizing their keys again.
+
+    Params:
+    top_keys -> raw keys of the item
+    fields_key -> raw key holding the fields dict, None when the item has no fields dict
+    field_keys -> raw keys of the fields dict, None when the item has no fields dict
+    included_keys -> columns kept for the list
+    """
+
+    def __init__(self, top_keys, fields_key, field_keys, included_keys: list, included: frozenset):
+        top = {}
+        for key in top_keys:
+            top[normalize_key(key)] = key # the last raw key wins like in format_columns
+        sources = {}
+        for key in included_keys:
+            if key in top:
+                sources[key] = (False, top[key])
+        self.fields_key = fields_key
+        self.owners_from_fields = False
+        # False when the selected columns also depend on the values and select_columns has to be used
+        self.exact = True
+        if field_keys is not None:
+            fields = {}
+            for key in field_keys:
+                fields[normalize_key(key)] = key
+            for field_key, raw_key in fields.items():
+                if field_key in included:
+                    sources[field_key] = (True, raw_key)
+                    self.owners_from_fields = self.owners_from_fields or field_key == "Owners"
+                elif field_key == "Owners":
+                    self.exact = False # only kept when it holds a string
+
+        self.layout = tuple(sources)
+        top_raw = [raw_key for from_fields, raw_key in sources.values() if not from_fields]
+        field_raw = [raw_key for from_fields, raw_key in sources.values() if from_fields]
+        positions = []
+        next_top, next_field = 0, len(top_raw)
+        for from_fields, _ in sources.values():
+            if from_fields:
+                positions.append(next_field)
+                next_field += 1
+            else:
+                positions.append(next_top)
+                next_top += 1
+        self.get_top = tuple_getter(top_raw)
+        self.get_fields = tuple_getter(field_raw)
+        self.reorder = tuple_getter(positions) if positions != sorted(positions) else None
+
+    def select(self, item, fields):
+        """Returns the raw values of the layout columns, nested keys are formatted later per column."""
+        values = self.get_top(item) + self.get_fields(fields)
+        return self.reorder(values) if self.reorder else values
+
+
+def convert_nested(value, converters: dict):
+    if isinstance(value, dict):
+        return convert_item(value, converters)
+    if isinstance(value, list):
+        return [convert_item(sub_item, converters) if isinstance(sub_item, dict) else sub_item for sub_item in value]
+    return value
+
+
+def convert_column(values, converter, converters: dict):
+    """
+    Convert all values of one column. Nested dicts are converted with the whole table like convert_item
+    does; numeric float and bool columns are vectorized with numpy when it is installed.
+    """
+    value_types = set(map(type, values))
+    if any(issubclass(value_type, (dict, list)) for value_type in value_types):
+        values = [convert_nested(value, converters) for value in values]
+        value_types = set(map(type, values))
+    if converter is None:
+        return values
+    # the converters return these unchanged
+    if (converter is to_int and value_types == {int}) or (converter is to_bool and value_types == {bool}):
+        return values
+    # bool is left out on purpose, float(True) is fine but the converters treat it differently from int
+    if np is not None and converter in (to_float, to_bool) and value_types <= {int, float}:
+        try:
+            column = np.asarray(values, dtype=np.float64)
+        except OverflowError:
+            pass # ints beyond the float range, left to the converter
+        else:
+            return column.tolist() if converter is to_float else (column == 1).tolist()
+    if converter is not to_str and value_types <= {str, type(None)}:
+        # these converters return immutable values, so each distinct string is converted once
+        converted = {value: converter(value) for value in set(values)}
+        return list(map(converted.__getitem__, values))
+    return list(map(converter, values))
+
+
+def format_column(values: list, key, owners_from_fields: bool):
+    # the key formatting and Owners clean up select_columns does per item
+    value_types = set(map(type, values))
+    if any(issubclass(value_type, (dict, list)) for value_type in value_types):
+        values = list(map(format_columns, values))
+    if owners_from_fields and key == "Owners" and any(issubclass(value_type, str) for value_type in value_types):
+        values = [value.replace(";", "") if isinstance(value, str) else value for value in values]
+    return values
+
+
+def clean_page_columnar(items, included_keys: list, converters):
+    """
+    Clean a page of items column by column. A SelectionPlan is made once per distinct layout of raw keys,
+    items are grouped by their selected columns (normally one group for the whole page), each column of a
+    group is formatted and converted in bulk and the items are rebuilt in their original order.
+    """
+    included = frozenset(included_keys)
+    fields_keys = {}
+    plans = {}
+    groups = {}
+    order = []
+    for item in items:
+        top_keys = tuple(item)
+        if top_keys not in fields_keys:
+            fields_keys[top_keys] = {normalize_key(key): key for key in top_keys}.get("fields")
+        fields_key = fields_keys[top_keys]
+        fields = item[fields_key] if fields_key is not None else None
+        if not isinstance(fields, dict):
+            fields_key = fields = None
+        plan_key = (top_keys, tuple(fields) if fields is not None else None)
+        plan = plans.get(plan_key)
+        if plan is None:
+            plan = plans[plan_key] = SelectionPlan(top_keys, fields_key, plan_key[1], included_keys, included)
+
+        if plan.exact:
+            group_key, layout, owners_from_fields = plan, plan.layout, plan.owners_from_fields
+            values = plan.select(item, fields)
+        else:
+            selected = select_columns(item, included_keys, included)
+            # select_columns already formatted the values
+            group_key = layout = tuple(selected)
+            owners_from_fields = False
+            values = tuple(selected.values())
+        group = groups.get(group_key)
+        if group is None:
+            group = groups[group_key] = (len(groups), layout, owners_from_fields, [])
+        group[3].append(values)
+        order.append(group[0])
+
+    cleaned_groups = []
+    for _, layout, owners_from_fields, rows in groups.values():
+        if not layout:
+            cleaned_groups.append(iter([{} for _ in rows]))
+            continue
+        columns = [format_column(list(values), key, owners_from_fields) for key, values in zip(layout, zip(*rows))]
+        if converters is not None: # lists without a schema are not formatted
+            columns = [convert_column(values, converters.get(key), converters) for key, values in zip(layout, columns)]
+        cleaned_groups.append(iter([dict(zip(layout, values)) for values in zip(*columns)]))
+    if len(cleaned_groups) == 1:
+        return list(cleaned_groups[0])
+    return [next(cleaned_groups[index]) for index in order]
+
+
 # ------------------------------
 # Merged Data Cleaning Function
 # ------------------------------
-def clean_and_format_data(data, list_type)->Any:
+def clean_item(item, included_keys: list, included: frozenset, converters):
+    """Row-wise cleaning of a single item."""
+    item = format_columns(item)
+    cleaned_item = {}
+    
+    for key in included_keys:
+        if key in item:
+
+            cleaned_item[key] = item[key]
+    if "fields" in item and isinstance(item["fields"], dict):
+        for field_key, field_val in item["fields"].items():
+            if field_key in included:
+                cleaned_item[field_key] = item["fields"][field_key]
+            if field_key == "Owners" and isinstance(item["fields"]["Owners"],str): # The email in Owners key has a ';' after the email. 
+                cleaned_item[field_key] = item["fields"]["Owners"].replace(";","")
+    if converters is not None: # lists without a schema are not formatted
+        cleaned_item = convert_item(cleaned_item, converters)
+    return cleaned_item
+
+
+def clean_and_format_data(data, list_type, mode=CLEANING_MODE, schema=None)->Any:
     """
     Clean and format data received from SharePoint.
     For both risk register and risk mitigation items:
@@ -330,88 +644,67 @@ def clean_and_format_data(data, list_type)->Any:
       - Within "fields", exclude unwanted keys.
     
     Parameters:
-      - data: Json array of sharepoint list.
+      - data: Iterable of sharepoint list items. Items are consumed one at a time, so a generator
+        that yields items page by page can be passed directly.
       - data_type: Either "Risk Register" or "Risk Mitigations" to select appropriate exclusion keys.
+      - mode: "columnar" cleans COLUMNAR_PAGE_SIZE items at a time column by column, "rows" item by item.
+      - schema: (included keys, compiled converters) for lists outside allowed_columns, see
+        schema_discovery.discover_list_schema.
     
     Returns a list of cleaned items.
     """
     column_schema_present = False
     allowed_columns_present = False
 
-    cleaned_column_data = format_columns(data)
-
     for key,value in allowed_columns.items():
         if key == list_type:
             allowed_columns_present = True # check if the values have to be formatted. Useful when we dont have the schema for a list.
             included_keys = value
             break
 
-    if allowed_columns_present == False:
+    if allowed_columns_present:
+        converters = compiled_column_schema.get(list_type)
+    elif schema is not None:
+        included_keys, converters = schema
+    else:
         return None
-    
-        
+    included = frozenset(included_keys)
+
     #Extract only necessary fields
     cleaned_data = []
-    for item in cleaned_column_data:
-        cleaned_item = {}
-        
-        for key in included_keys:
-            if key in item:
-
-                cleaned_item[key] = item[key]
-        if "fields" in item and isinstance(item["fields"], dict):
-            for field_key, field_val in item["fields"].items():
-                if field_key in included_keys:
-                    cleaned_item[field_key] = item["fields"][field_key]
-                if field_key == "Owners" and isinstance(item["fields"]["Owners"],str): # The email in Owners key has a ';' after the email. 
-                    cleaned_item[field_key] = item["fields"]["Owners"].replace(";","")
-        cleaned_data.append(cleaned_item)
-
-    
-
-    for key,value in column_schema.items():
-        if key == list_type:
-            allowed_columns_present = True # check if the values have to be formatted. Useful when we dont have the schema for a list.
-            key_types = value
-            cleaned_value_and_column_data = format_value(cleaned_data,key_types)
-            break
+    if mode == "columnar":
+        items = iter(data)
+        while True:
+            page = list(islice(items, COLUMNAR_PAGE_SIZE))
+            if not page:
+                break
+            cleaned_data.extend(clean_page_columnar(page, included_keys, converters))
+    else:
+        for item in data:
+            cleaned_data.append(clean_item(item, included_keys, included, converters))
 
-    if allowed_columns_present == False:
-        return json.dumps(cleaned_data)
-    
-    return json.dumps(cleaned_value_and_column_data)
+    return cleaned_data
         
 
 # ------------------------------
 # Merge Function: Merge risk register and mitigation data
 # ------------------------------
+# cleaned risk register items get their cleaned mitigations under "Mitigations", also when there are none
+RISK_MITIGATIONS_JOIN = JoinSpec(
+    primary_key="id",
+    secondaries=[SecondaryJoin("Mitigations", key="RiskId")],
+)
+
+
 def merge_lists(rr_data, rm_data):
     """
     Merge risk mitigation data into risk register data.
     For each risk register item, attach a list of corresponding mitigations under the key "Mitigations".
-    Assumes that the risk register's "id" (converted to int) corresponds to the mitigation's "RiskId" in its "fields".
-    """
+    The risk register's "id" is matched with the mitigation's "RiskId" as integers (see merge_engine.normalize_id),
+    in any input order.
+    Both arguments can be any iterable of items; rr_data is consumed as a stream.
+    The items of rr_data are not modified, each merged item is a shallow copy.
 
-    try:
-        sorted_rm_data = sorted(rm_data, key=lambda x: int(x["RiskId"])) 
-    except Exception as e:
-        print("Error sorting risk mitigation data:", e)
-        return rr_data
-
-    merged_data = []
-    rm_index = 0
-    num_rm = len(sorted_rm_data)
-    
-    for rr_item in rr_data:
-        rr_id = int(rr_item.get("id"))
-        rr_item["Mitigations"] = []
-        while rm_index < num_rm:
-            
-            rm_risk_id = int(sorted_rm_data[rm_index].get("RiskId"))
-            if rm_risk_id == rr_id:
-                rr_item["Mitigations"].append(sorted_rm_data[rm_index])
-                rm_index += 1
-            else:
-                break
-        merged_data.append(rr_item)
-    return json.dumps(merged_data)
+    Returns the merged list.
+    """
+    return list(hash_join(RISK_MITIGATIONS_JOIN, rr_data, {"Mitigations": rm_data}))
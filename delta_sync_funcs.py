@@ -0,0 +1,154 @@
+import json
+import os
+import json_codec
+import logging
+from azure.storage.blob import BlobServiceClient
+from azure.core.exceptions import ResourceNotFoundError
+from dotenv import load_dotenv
+from graph_funcs import GRAPH_BASE_URL, batch_get, list_select_query, raise_for_batch_status
+from graph_transport import graph_transport
+load_dotenv()
+logger = logging.getLogger("tt_sharepoint_logger")
+
+CONNECTION_STRING = os.getenv("Azure_CONNECTION_STRING")
+# Delta links are kept next to cleaned_lists/ and uncleaned_lists/ in the same container.
+DELTA_TOKEN_FOLDER = "delta_tokens"
+
+
+class DeltaResyncRequired(Exception):
+    """Raised when Graph rejects a stored delta link (expired or reset) and the list must be fully synced again."""
+
+
+# ------------------------------
+# Delta token store
+# ------------------------------
+def delta_token_blob_name(list_name: str):
+    return f"{DELTA_TOKEN_FOLDER}/{list_name.replace(' ', '_')}.json"
+
+
+def download_json_blob(container_name: str, blob_filename: str):
+    """
+    Download and parse a json blob. Returns None if the blob does not exist.
+    """
+    blob_service_client = BlobServiceClient.from_connection_string(CONNECTION_STRING)
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_filename)
+    try:
+        return json_codec.loads(blob_client.download_blob().readall())
+    except ResourceNotFoundError:
+        return None
+
+
+def load_delta_link(container_name: str, list_name: str):
+    """
+    Returns the delta link stored for a list or None if the list has never been synced.
+    """
+    token_data = download_json_blob(container_name, delta_token_blob_name(list_name))
+    if not token_data:
+        return None
+    return token_data.get("deltaLink")
+
+
+def save_delta_link(container_name: str, list_name: str, delta_link: str):
+    """
+    Store the delta link of a list so the next run only fetches the changes made after it.
+    """
+    blob_service_client = BlobServiceClient.from_connection_string(CONNECTION_STRING)
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=delta_token_blob_name(list_name))
+    blob_client.upload_blob(data=json.dumps({"list": list_name, "deltaLink": delta_link}), overwrite=True)
+
+
+# ------------------------------
+# Graph delta queries
+# ------------------------------
+def list_delta_url(site_id, list_name):
+    """Delta url of a list, requesting the same columns as the full sync."""
+    return f"{GRAPH_BASE_URL}/sites/{site_id}/lists/{list_name}/items/delta?{list_select_query(list_name, select_columns=True, extra_properties=['deleted'])}"
+
+
+def get_latest_delta_link(ACCESS_TOKEN, site_id, list_name):
+    """
+    Returns a delta link that points at the current state of the list without enumerating its items.
+    Request it before a full sync so changes made while the full sync runs are picked up next time.
+    The query options of the request are carried in the link, so later delta pages expand the same fields.
+    """
+    url = f"{list_delta_url(site_id, list_name)}&token=latest"
+    headers = {"Authorization": f"Bearer {ACCESS_TOKEN}"}
+    response = graph_transport.get(url, headers=headers)
+    response.raise_for_status()
+    delta_link = response.json().get("@odata.deltaLink")
+    if not delta_link:
+        raise Exception(f"No delta link returned for list '{list_name}'.")
+    return delta_link
+
+
+def is_removed(item):
+    """Deleted items are reported with an "@removed" annotation or a "deleted" facet."""
+    return "@removed" in item or "deleted" in item
+
+
+def collect_delta_page(page, changed: dict, removed: set):
+    """Fold one page of a delta response into the changed items (by id) and removed ids seen so far."""
+    for item in page.get("value", []):
+        item_id = str(item.get("id"))
+        if is_removed(item):
+            changed.pop(item_id, None)
+            removed.add(item_id)
+        else:
+            removed.discard(item_id)
+            changed[item_id] = item
+
+
+def fetch_deltas_batched(ACCESS_TOKEN, delta_links: dict):
+    """
+    Follow the delta links of several lists together, one $batch call per round of pages.
+
+    Params:
+    ACCESS_TOKEN -> Required to access sharepoint site
+    delta_links -> {list_name: delta link stored by the previous run}
+
+    Returns {list_name: (changed_items, removed_ids, new_delta_link)}. Lists whose delta link has
+    expired map to a DeltaResyncRequired instance instead.
+    """
+    collected = {list_name: ({}, set()) for list_name in delta_links}
+    results = {}
+    next_urls = dict(delta_links)
+    while next_urls:
+        round_names = list(next_urls)
+        round_urls = [next_urls[list_name] for list_name in round_names]
+        next_urls = {}
+        for list_name, url, (status, page) in zip(round_names, round_urls, batch_get(ACCESS_TOKEN, round_urls)):
+            if status == 410:
+                results[list_name] = DeltaResyncRequired(f"Delta link of '{list_name}' expired")
+                continue
+            raise_for_batch_status(url, status, page)
+            changed, removed = collected[list_name]
+            collect_delta_page(page, changed, removed)
+            if "@odata.nextLink" in page:
+                next_urls[list_name] = page["@odata.nextLink"]
+            elif page.get("@odata.deltaLink"):
+                results[list_name] = (list(changed.values()), removed, page["@odata.deltaLink"])
+            else:
+                raise Exception(f"Delta query of '{list_name}' ended without a delta link.")
+    return results
+
+
+# ------------------------------
+# Patching stored lists
+# ------------------------------
+def apply_changes(items: list, changed_items: list, removed_ids: set):
+    """
+    Returns `items` patched with the changed and removed items, matched on "id".
+    Existing items keep their position, new items are appended in the order received.
+    """
+    changed_by_id = {str(item.get("id")): item for item in changed_items}
+    patched = []
+    for item in items:
+        item_id = str(item.get("id"))
+        if item_id in removed_ids:
+            continue
+        if item_id in changed_by_id:
+            patched.append(changed_by_id.pop(item_id))
+        else:
+            patched.append(item)
+    patched.extend(changed_by_id.values())
+    return patched
@@ -1,11 +1,22 @@
 import logging
-import json
 import os
-import requests
-import msal
+from functools import lru_cache
 from azure.storage.blob import BlobServiceClient
 from azure.core.exceptions import ResourceExistsError
 from dotenv import load_dotenv
+from access_token import get_access_token
+from blob_stream import upload_json_array
+from parallel_cleaning import iter_clean_merged_items
+from graph_funcs import iter_list_items, resolve_site_id, DEFAULT_PAGE_SIZE
+from merge_engine import JoinSpec, SecondaryJoin, hash_join
+from embedding_cache import EMBEDDING_CACHE_BLOB, normalize_text, open_embedding_cache
+from embedding_scheduler import EMBEDDING_MAX_CONCURRENCY, EmbeddingScheduler, RateLimiter
+from embedding_store import pack_embeddings
+from graph_transport import GraphTransport
+try:
+    import tiktoken
+except ImportError: # token counts are estimated from the text length without it
+    tiktoken = None
 load_dotenv()
 # Azure OpenAI API details
 AZURE_OPENAI_KEY = os.getenv("AZURE_OPENAI_KEY") 
@@ -25,108 +36,125 @@ SITE_PATH = os.getenv("SITE_PATH")
 CONNECTION_STRING = os.getenv("Azure_CONNECTION_STRING")
 CONTAINER_NAME = os.getenv("CONTAINER_NAME")
 
+MERGED_BLOB_NAME = "Risk_Register_Merged.json"
+# The vectors of the merged documents, see embedding_store. The documents only keep their row numbers.
+EMBEDDINGS_BLOB_NAME = "Risk_Register_Merged.embeddings.npy"
+EMBEDDINGS_INDEX_BLOB_NAME = "Risk_Register_Merged.embeddings.index.json"
+
+# Limits of one embeddings request: number of inputs, tokens over all inputs and tokens of a single input.
+EMBEDDING_MAX_INPUTS = int(os.getenv("EMBEDDING_MAX_INPUTS", "2048"))
+EMBEDDING_MAX_TOKENS = int(os.getenv("EMBEDDING_MAX_TOKENS", "300000"))
+EMBEDDING_MAX_INPUT_TOKENS = int(os.getenv("EMBEDDING_MAX_INPUT_TOKENS", "8191"))
+EMBEDDING_ENCODING = os.getenv("EMBEDDING_ENCODING", "cl100k_base")
+# Text fields of a risk that get an embedding.
+EMBEDDING_FIELDS = ["Title", "Status", "Likelihood"]
+# pooled connections to the Azure OpenAI endpoint, retries are left to the EmbeddingScheduler
+embedding_transport = GraphTransport(max_concurrency_per_host=EMBEDDING_MAX_CONCURRENCY, max_retries=0)
+
+@lru_cache(maxsize=None)
+def get_token_encoding(name=EMBEDDING_ENCODING):
+    return tiktoken.get_encoding(name)
+
+def count_tokens(text: str):
+    """
+    Tokens of a text with tiktoken when it is installed. Otherwise estimated from its utf-8 length:
+    English text averages about 4 bytes per token, 3 leaves headroom.
+    """
+    if tiktoken is not None:
+        return len(get_token_encoding().encode(text))
+    return len(text.encode("utf-8")) // 3 + 1
+
+def pack_batches(texts: list, max_inputs=EMBEDDING_MAX_INPUTS, max_tokens=EMBEDDING_MAX_TOKENS,
+                 max_input_tokens=EMBEDDING_MAX_INPUT_TOKENS):
+    """
+    Groups texts into requests that respect the input and token limits, in order.
+
+    Returns (batches, too_long): lists of indexes into texts; too_long holds the texts over
+    max_input_tokens, which no request would accept.
+    """
+    batches = []
+    too_long = []
+    batch = []
+    batch_tokens = 0
+    for index, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if tokens > max_input_tokens:
+            too_long.append(index)
+            continue
+        if batch and (len(batch) >= max_inputs or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(index)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches, too_long
+
 # Initialize the OpenAI client for Azure
 class AzureOpenAI:
-    def __init__(self, api_key, api_version, azure_endpoint):
+    def __init__(self, api_key, api_version, azure_endpoint, cache=None, limiter=None):
         self.api_key = api_key
         self.api_version = api_version
         self.azure_endpoint = azure_endpoint
+        # optional embedding_cache.EmbeddingCache, only texts it does not hold are sent to the API
+        self.cache = cache
+        # quota of the deployment, shared by every request of this client
+        self.limiter = limiter or RateLimiter()
 
     def generate_embedding(self, text):
-        """Generates an embedding using Azure OpenAI's text-embedding-ada-002 model."""
-        try:
-            # Construct the URL for the embedding request
-            url = f"{self.azure_endpoint}/openai/deployments/{MODEL_NAME}/embeddings?api-version={self.api_version}"
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            data = {"input": [text]}
-            
-
-            response = requests.post(url, headers=headers, json=data)
-            response.raise_for_status() 
-
-            embedding = response.json()['data'][0]['embedding']
-            return embedding
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Error generating embedding for text: {text} - {str(e)}")
-            return []  
-
-# MSAL Authentication for Microsoft Graph
-def get_access_token():
-    """Acquires an app-only access token using MSAL."""
-    app = msal.ConfidentialClientApplication(
-        CLIENT_ID, authority=AUTHORITY, client_credential=CLIENT_SECRET
-    )
-    token_response = app.acquire_token_for_client(scopes=SCOPE)
-    if "access_token" in token_response:
-        logging.info("Access token acquired.")
-        return token_response["access_token"]
-    else:
-        raise Exception("Access token could not be obtained")
+        """Generates an embedding using Azure OpenAI's text-embedding-ada-002 model, None if it failed."""
+        vectors, _ = self.generate_embeddings([text])
+        return vectors[0]
+
+    def post_embeddings(self, texts: list):
+        """Sends one embeddings request for all texts and returns the response, retries are left to the scheduler."""
+        # Construct the URL for the embedding request
+        url = f"{self.azure_endpoint}/openai/deployments/{MODEL_NAME}/embeddings?api-version={self.api_version}"
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        return embedding_transport.post(url, headers=headers, json={"input": texts})
+
+    def generate_embeddings(self, texts: list):
+        """
+        Embeddings of many texts with as few requests as the limits allow, sent concurrently within the
+        deployment quota by an EmbeddingScheduler. Texts are normalized (embedding_cache.normalize_text),
+        identical texts are sent once and texts found in the cache are not sent at all.
+
+        Returns (vectors, errors), one entry per text in order: the embedding or None, and the reason
+        it could not be generated or None. Empty texts have neither.
+        """
+        inputs = [normalize_text(text if isinstance(text, str) else str(text)) if text is not None else ""
+                  for text in texts]
+        unique_texts = list(dict.fromkeys(text for text in inputs if text))
+        embeddings = self.cache.get_many(MODEL_NAME, unique_texts) if self.cache is not None else {}
+        new_texts = [text for text in unique_texts if text not in embeddings]
+        scheduler = EmbeddingScheduler(self.post_embeddings, count_tokens, self.limiter, transport=embedding_transport)
+        # a request over the burst of the token quota would be throttled however long it waits
+        batches, too_long = pack_batches(new_texts, max_tokens=min(EMBEDDING_MAX_TOKENS, scheduler.limiter.tokens.capacity))
+        failures = {new_texts[index]: f"over {EMBEDDING_MAX_INPUT_TOKENS} tokens" for index in too_long}
+
+        results = scheduler.run([[new_texts[index] for index in batch] for batch in batches])
+        if self.cache is not None:
+            self.cache.put_many(MODEL_NAME, results.embeddings)
+        embeddings.update(results.embeddings)
+        failures.update(results.failures)
+        logging.info(f"Embeddings for {len(unique_texts)} distinct texts: {len(unique_texts) - len(new_texts)} "
+                     f"from the cache, {len(results.embeddings)} generated in {len(batches)} batches, "
+                     f"{len(failures)} failed, {scheduler.limiter.waited:.1f}s waited on the quota")
+        return [embeddings.get(text) for text in inputs], [failures.get(text) for text in inputs]
 
 # SharePoint API calls
 def get_site_id(access_token):
     """Retrieves the SharePoint site ID from Microsoft Graph."""
-    url = f"https://graph.microsoft.com/v1.0/sites/{SITE_HOSTNAME}:{SITE_PATH}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    site_info = response.json()
-    return site_info["id"]
-
-def get_list_details(listname, access_token):
-    """Retrieves items from a specified SharePoint list (with expanded fields)."""
+    return resolve_site_id(access_token, SITE_HOSTNAME, SITE_PATH)
+
+def get_list_details(listname, access_token, page_size=DEFAULT_PAGE_SIZE):
+    """Yields items from a specified SharePoint list (with expanded fields), page by page."""
     site_id = get_site_id(access_token)
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists/{listname}/items?expand=fields"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    return response.json()
-
-# Data cleaning and transformation functions
-def clean_data(data):
-    """Cleans data by removing empty values."""
-    if isinstance(data, dict):
-        cleaned_dict = {}
-        for key, value in data.items():
-            cleaned_value = clean_data(value)
-            if cleaned_value is not None and cleaned_value != "":
-                cleaned_dict[key] = cleaned_value
-        return cleaned_dict
-    elif isinstance(data, list):
-        return [clean_data(item) for item in data if clean_data(item) not in (None, "")]
-    elif isinstance(data, str):
-        data = data.replace(";", "").replace("#Name?", "Name")
-        return data
-    else:
-        return data
-
-def convert_numeric(data):
-    """Converts numeric strings to actual numbers where applicable."""
-    if isinstance(data, dict):
-        return {k: convert_numeric(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [convert_numeric(item) for item in data]
-    elif isinstance(data, str):
-        if data.strip().lower() == "no":
-            return 0
-        try:
-            int_val = int(data)
-            if str(int_val) == data:
-                return int_val
-        except ValueError:
-            pass
-        try:
-            float_val = float(data)
-            if "." in data or "e" in data.lower():
-                return float_val
-        except ValueError:
-            pass
-        return data
-    else:
-        return data
+    yield from iter_list_items(access_token, site_id, listname, page_size)
 
 # Blob Storage functions
 def create_blob_container(blob_service_client, container_name):
@@ -137,17 +165,26 @@ def create_blob_container(blob_service_client, container_name):
     except ResourceExistsError:
         logging.info(f"A container with the name '{container_name}' already exists.")
 
-def upload_merged_data(blob_service_client, container_name, merged_data):
-    """Uploads merged data into the Blob Storage."""
-    merged_data = clean_data(merged_data)
-    converted_data = convert_numeric(merged_data)
-    blob_data = json.dumps(converted_data, indent=2)
-    blob_file_name = "Risk_Register_Merged.json"
-    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_file_name)
-    blob_client.upload_blob(data=blob_data, overwrite=True)
+def upload_merged_data(blob_service_client, container_name, merged_data, pretty=None):
+    """Streams merged data into the Blob Storage, cleaning one item at a time."""
+    converted_data = iter_clean_merged_items(merged_data, unwanted_keys=())
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=MERGED_BLOB_NAME)
+    upload_json_array(blob_client, converted_data, pretty)
     logging.info("Merged data uploaded successfully.")
     return "Merged data uploaded successfully."
 
+def upload_embeddings(blob_service_client, container_name, merged_data):
+    """
+    Moves the vectors of the merged documents into a binary sidecar and uploads it, the documents keep
+    the row of each field under "embeddings". Upload the documents with upload_merged_data afterwards.
+    """
+    sidecar = pack_embeddings(merged_data)
+    sidecar.upload(
+        blob_service_client.get_blob_client(container=container_name, blob=EMBEDDINGS_BLOB_NAME),
+        blob_service_client.get_blob_client(container=container_name, blob=EMBEDDINGS_INDEX_BLOB_NAME),
+    )
+    return sidecar
+
 # Merging risk data with mitigation data
 def filter_risk_register_fields(risk_fields):
     """Filters out unnecessary fields from the risk register data."""
@@ -170,45 +207,52 @@ def filter_mitigation_fields(mitigation_fields):
     ]
     return {k: mitigation_fields[k] for k in allowed_keys if k in mitigation_fields}
 
+def build_risk_document(risk, matches):
+    """Risk register document with its mitigations, add_embeddings fills in its "embeddings"."""
+    reg_id = risk.get("id")
+    if "fields" not in risk:
+        return {"id": reg_id, "mitigations": matches["mitigations"]}
+    filtered_fields = filter_risk_register_fields(risk["fields"])
+    filtered_fields["mitigations"] = matches["mitigations"]
+    filtered_fields["id"] = reg_id
+    filtered_fields["embeddings"] = {}
+    return filtered_fields
+
+def add_embeddings(documents: list, azure_openai_client, embedding_fields=EMBEDDING_FIELDS):
+    """
+    Store the embeddings of the text fields of every document under "embeddings", generated with
+    batched requests for all documents together instead of one request per field.
+    Fields whose embedding could not be generated are left out of "embeddings" and listed with the
+    reason under "embedding_errors", so a later run can find and retry them.
+
+    Returns the documents and the number of failed fields.
+    """
+    targets = [(document, field) for document in documents if "embeddings" in document
+               for field in embedding_fields if field in document]
+    vectors, errors = azure_openai_client.generate_embeddings([document[field] for document, field in targets])
+    failed = 0
+    for (document, field), vector, error in zip(targets, vectors, errors):
+        if vector is not None:
+            document["embeddings"][field] = vector
+        elif error is not None:
+            document.setdefault("embedding_errors", {})[field] = error
+            failed += 1
+    return documents, failed
+
+# mitigations are matched to risks by fields.RiskId
+MITIGATIONS_JOIN = SecondaryJoin(
+    "mitigations", key="fields.RiskId",
+    project=lambda mit: filter_mitigation_fields(mit.get("fields") or {}),
+)
+
 def merge_risk_data(risk_register_data, risk_mitigation_data, azure_openai_client):
-    """Merges risk data and mitigation data, adding embeddings for multiple fields."""
-    reg_list = risk_register_data.get("value", [])
-    mit_list = risk_mitigation_data.get("value", [])
-    mitigation_index = {}
-
-    # Map mitigations to their corresponding risk ID
-    for mit in mit_list:
-        fields = mit.get("fields", {})
-        risk_id = fields.get("RiskId")
-        if risk_id is not None:
-            mitigation_index.setdefault(str(risk_id), []).append(filter_mitigation_fields(fields))
-
-    new_reg_list = []
-    for risk in reg_list:
-        reg_id = risk.get("id")
-        if "fields" in risk:
-            filtered_fields = filter_risk_register_fields(risk["fields"])
-            if reg_id:
-                filtered_fields["mitigations"] = mitigation_index.get(str(reg_id), [])
-            else:
-                filtered_fields["mitigations"] = []
-            filtered_fields["id"] = reg_id
-
-            # Add embeddings for multiple fields
-            embedding_fields = ["Title", "Status", "Likelihood"]
-            embeddings = {}
-            for field in embedding_fields:
-                if field in filtered_fields:
-                    embeddings[field] = azure_openai_client.generate_embedding(filtered_fields[field])
-
-            # Store the embeddings in the fields
-            filtered_fields["embeddings"] = embeddings
-
-            new_reg_list.append(filtered_fields)
-        else:
-            new_reg_list.append({"id": reg_id, "mitigations": mitigation_index.get(str(reg_id), [])})
-
-    return new_reg_list
+    """Merges risk data and mitigation data, adding embeddings for multiple fields. Both inputs are item streams."""
+    spec = JoinSpec(primary_key="id", secondaries=[MITIGATIONS_JOIN], build=build_risk_document)
+    documents = list(hash_join(spec, risk_register_data, {"mitigations": risk_mitigation_data}))
+    documents, failed = add_embeddings(documents, azure_openai_client)
+    if failed:
+        logging.error(f"{failed} risk fields have no embedding, see their embedding_errors")
+    return documents
 
 # Main function to run the process
 def main():
@@ -217,8 +261,14 @@ def main():
     blob_service_client = BlobServiceClient.from_connection_string(CONNECTION_STRING)
     create_blob_container(blob_service_client, CONTAINER_NAME)
 
+    # Embeddings of texts seen by earlier runs are reused, the cache file survives cold starts in blob storage
+    cache_blob_client = None
+    if EMBEDDING_CACHE_BLOB:
+        cache_blob_client = blob_service_client.get_blob_client(container=CONTAINER_NAME, blob=EMBEDDING_CACHE_BLOB)
+    embedding_cache = open_embedding_cache(cache_blob_client)
+
     # Initialize Azure OpenAI client
-    azure_openai_client = AzureOpenAI(AZURE_OPENAI_KEY, API_VERSION, AZURE_OPENAI_ENDPOINT)
+    azure_openai_client = AzureOpenAI(AZURE_OPENAI_KEY, API_VERSION, AZURE_OPENAI_ENDPOINT, cache=embedding_cache)
 
     # Fetch risk and mitigation data
     risk_register_data = get_list_details("Risk Register", access_token)
@@ -227,9 +277,16 @@ def main():
     # Merge data with client (AzureOpenAI instance)
     merged_data = merge_risk_data(risk_register_data, risk_mitigation_data, azure_openai_client)
 
-    # Upload the merged data to Blob Storage
+    # Upload the vectors to their sidecar, then the merged data that references them to Blob Storage
+    upload_embeddings(blob_service_client, CONTAINER_NAME, merged_data)
     result = upload_merged_data(blob_service_client, CONTAINER_NAME, merged_data)
     logging.info(result)
 
+    if embedding_cache is not None:
+        embedding_cache.log_stats()
+        if cache_blob_client is not None:
+            embedding_cache.save_to_blob(cache_blob_client)
+        embedding_cache.close()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,170 @@
+import os
+import re
+import time
+import array
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+import unicodedata
+from dotenv import load_dotenv
+load_dotenv()
+logger = logging.getLogger("tt_sharepoint_logger")
+
+# Local SQLite file of the cache, "" disables it.
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(tempfile.gettempdir(), "embedding_cache.sqlite"))
+# Least recently used entries are evicted above this many (about 12 KB per 1536 dimension vector).
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "20000"))
+# Optional blob the cache file is restored from on a cold start and saved to after a run,
+# e.g. embedding_cache/embeddings.sqlite in CONTAINER_NAME.
+EMBEDDING_CACHE_BLOB = os.getenv("EMBEDDING_CACHE_BLOB")
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_text(text: str):
+    """Text as it is embedded and cached: NFC normalized, whitespace collapsed to single spaces and stripped."""
+    return WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def text_key(model: str, text: str):
+    """Cache key of an already normalized text, the model is part of it so deployments never share vectors."""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Content addressed embedding cache in a local SQLite file, keyed by model and text hash.
+
+    Vectors are stored as float64 so cached embeddings are the exact values the API returned.
+    Entries not read for the longest time are evicted once the cache holds more than max_entries.
+
+    Params:
+    path -> SQLite file, created when missing
+    max_entries -> entries kept after each put_many
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self.connection.commit()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def get_many(self, model: str, texts: list):
+        """
+        Returns {text: embedding} for the normalized texts found in the cache and marks them as used.
+        """
+        keys = {text_key(model, text): text for text in texts}
+        found = {}
+        with self._lock:
+            key_list = list(keys)
+            # stay below SQLite's limit of bound parameters per statement
+            for start in range(0, len(key_list), 500):
+                chunk = key_list[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk).fetchall()
+                for key, vector in rows:
+                    found[keys[key]] = array.array("d", vector).tolist()
+                if rows:
+                    self.connection.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                                [(time.time(), key) for key, _ in rows])
+            self.connection.commit()
+            self.stats["hits"] += len(found)
+            self.stats["misses"] += len(keys) - len(found)
+        return found
+
+    def put_many(self, model: str, embeddings: dict):
+        """Store {normalized text: embedding}, empty embeddings (failed requests) are not cached."""
+        now = time.time()
+        rows = [(text_key(model, text), model, array.array("d", vector).tobytes(), now)
+                for text, vector in embeddings.items() if vector]
+        if not rows:
+            return
+        with self._lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)", rows)
+            self.stats["stores"] += len(rows)
+            self._evict()
+            self.connection.commit()
+
+    def _evict(self):
+        excess = self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self.connection.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,))
+            self.stats["evictions"] += excess
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def hit_rate(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def log_stats(self):
+        stats = dict(self.stats)
+        logger.info(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses "
+                    f"({self.hit_rate():.0%} hit rate), {stats['stores']} stored, {stats['evictions']} evicted")
+        return stats
+
+    def save_to_blob(self, blob_client):
+        """Upload a consistent copy of the cache file, taken with the SQLite backup API."""
+        with tempfile.TemporaryDirectory() as directory:
+            copy_path = os.path.join(directory, "embedding_cache.sqlite")
+            copy = sqlite3.connect(copy_path)
+            try:
+                with self._lock:
+                    self.connection.backup(copy)
+            finally:
+                copy.close()
+            with open(copy_path, "rb") as copy_file:
+                blob_client.upload_blob(copy_file, overwrite=True)
+        logger.info(f"Embedding cache saved to {blob_client.blob_name}")
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+def restore_from_blob(blob_client, path=EMBEDDING_CACHE_PATH):
+    """
+    Download the blob copy of the cache to path when there is no local file yet (cold start).
+    Returns True if a copy was restored.
+    """
+    if os.path.exists(path):
+        return False
+    try:
+        data = blob_client.download_blob().readall()
+    except Exception as e:
+        logger.info(f"No embedding cache restored from {blob_client.blob_name}: {e}")
+        return False
+    with open(path, "wb") as cache_file:
+        cache_file.write(data)
+    logger.info(f"Embedding cache restored from {blob_client.blob_name}")
+    return True
+
+
+def open_embedding_cache(blob_client=None, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+    """
+    Returns the EmbeddingCache at path, restored from blob_client first if given, or None when
+    the cache is disabled or cannot be opened (embeddings are then generated without it).
+    """
+    if not path:
+        return None
+    try:
+        if blob_client is not None:
+            restore_from_blob(blob_client, path)
+        return EmbeddingCache(path, max_entries)
+    except Exception as e:
+        logger.warning(f"Embedding cache {path} could not be opened, continuing without it: {e}")
+        return None
@@ -0,0 +1,185 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from dotenv import load_dotenv
+from graph_transport import GraphTransport
+load_dotenv()
+logger = logging.getLogger("tt_sharepoint_logger")
+
+# Quota of the embedding deployment. Azure OpenAI enforces it over 10 second windows, so a sixth of
+# the per minute quota is allowed in a burst.
+EMBEDDING_TPM = int(os.getenv("EMBEDDING_TPM", "120000"))
+EMBEDDING_RPM = int(os.getenv("EMBEDDING_RPM", "720"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+
+# 429 is the quota, the others are transient service failures.
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# A request rejected with one of these is split in two and retried, it is most likely over a limit.
+SPLIT_STATUS_CODES = {400, 413}
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at per_minute / 60 per second, holding at most capacity.
+
+    reserve() takes the tokens right away and returns how long the caller has to wait until the bucket
+    would have held them, so callers queue up fairly without holding the lock while they sleep.
+    """
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or max(per_minute / 6.0, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+            return max(-self.tokens / self.rate, 0.0)
+
+    def pause(self, seconds):
+        """Empty the bucket for `seconds`, e.g. after the service answered 429 with a Retry-After."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+class RateLimiter:
+    """Requests per minute and tokens per minute quota of one deployment."""
+
+    def __init__(self, tokens_per_minute=EMBEDDING_TPM, requests_per_minute=EMBEDDING_RPM):
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.requests = TokenBucket(requests_per_minute)
+        self.waited = 0.0
+
+    def acquire(self, tokens):
+        delay = max(self.tokens.reserve(tokens), self.requests.reserve(1))
+        if delay:
+            self.waited += delay
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        self.tokens.pause(seconds)
+        self.requests.pause(seconds)
+
+
+class EmbeddingResults:
+    """
+    Outcome of a scheduler run.
+
+    embeddings -> {text: embedding} of the texts that were embedded
+    failures -> {text: reason} of the texts that could not be embedded, they are not stored anywhere as vectors
+    """
+
+    def __init__(self):
+        self.embeddings = {}
+        self.failures = {}
+        self._lock = threading.Lock()
+
+    def succeeded(self, texts, vectors):
+        with self._lock:
+            self.embeddings.update(zip(texts, vectors))
+
+    def failed(self, texts, reason):
+        with self._lock:
+            for text in texts:
+                self.failures[text] = reason
+
+
+class EmbeddingScheduler:
+    """
+    Sends embedding batches concurrently within the quota of the deployment.
+
+    - every request first takes its tokens and one request from the RateLimiter
+    - at most max_concurrency requests are in flight
+    - 429, transient failures and request errors are retried, honouring Retry-After; a 429 pauses all workers
+    - batches rejected as too large are split in two
+    - texts that still fail, or whose response cannot be read, are returned in EmbeddingResults.failures
+
+    Params:
+    send -> callable(texts) returning the requests.Response of one embeddings request
+    count_tokens -> callable(text) giving the tokens a text is charged
+    """
+
+    def __init__(self, send, count_tokens, limiter=None, max_concurrency=EMBEDDING_MAX_CONCURRENCY,
+                 max_retries=EMBEDDING_MAX_RETRIES, transport=None):
+        self.send = send
+        self.count_tokens = count_tokens
+        self.limiter = limiter or RateLimiter()
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        # the transport requests are sent with, only its backoff and retry accounting are used here
+        self.transport = transport or GraphTransport(pool_size=1)
+        self.throttled = 0
+
+    def run(self, batches: list):
+        """Embed the batches (lists of texts), returns EmbeddingResults."""
+        results = EmbeddingResults()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for future in [executor.submit(self.embed_batch, batch, results) for batch in batches]:
+                future.result()
+        if results.failures:
+            logger.error(f"{len(results.failures)} texts could not be embedded")
+        return results
+
+    def embed_batch(self, texts: list, results: EmbeddingResults):
+        tokens = sum(self.count_tokens(text) for text in texts)
+        attempt = 0
+        while True:
+            self.limiter.acquire(tokens)
+            try:
+                response = self.send(texts)
+            except requests.exceptions.RequestException as e:
+                if attempt >= self.max_retries:
+                    results.failed(texts, str(e))
+                    return
+                delay = self.transport.backoff_delay(attempt)
+                logger.warning(f"Embedding request failed ({e}). Retrying in {delay:.1f}s")
+                self.transport.wait_before_retry(delay)
+                attempt += 1
+                continue
+
+            status = response.status_code
+            if status == 200:
+                try:
+                    # the results carry the index of their input
+                    data = sorted(response.json()["data"], key=lambda result: result["index"])
+                    vectors = [result["embedding"] for result in data]
+                except (ValueError, KeyError, TypeError) as e:
+                    results.failed(texts, f"Malformed embeddings response: {e!r}")
+                    return
+                if len(vectors) != len(texts):
+                    results.failed(texts, f"{len(vectors)} embeddings returned for {len(texts)} texts")
+                    return
+                results.succeeded(texts, vectors)
+                return
+            if status in SPLIT_STATUS_CODES and len(texts) > 1:
+                middle = len(texts) // 2
+                logger.warning(f"Embedding batch of {len(texts)} rejected ({status}), splitting it in two")
+                self.embed_batch(texts[:middle], results)
+                self.embed_batch(texts[middle:], results)
+                return
+            if status in RETRY_STATUS_CODES and attempt < self.max_retries:
+                delay = self.transport.backoff_delay(attempt, response.headers.get("Retry-After"))
+                logger.warning(f"Embedding request returned {status}. Retrying in {delay:.1f}s")
+                if status == 429:
+                    # the quota is shared, so every worker holds off and the next acquire waits it out
+                    self.limiter.pause(delay)
+                    self.throttled += 1
+                else:
+                    self.transport.wait_before_retry(delay)
+                attempt += 1
+                continue
+            results.failed(texts, f"{status}: {response.text[:200]}")
+            return
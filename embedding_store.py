@@ -0,0 +1,179 @@
+import io
+import os
+import logging
+import numpy as np
+from dotenv import load_dotenv
+import json_codec
+from blob_stream import encode_json, upload_json_stream
+load_dotenv()
+logger = logging.getLogger("tt_sharepoint_logger")
+
+# Storage type of the vectors: "float32", "float16" (half the size) or "int8" (a quarter, quantized per row).
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float32").lower()
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+# Rows written per chunk when a matrix is streamed to a blob.
+NPY_ROWS_PER_CHUNK = 4096
+
+
+class SidecarVersionMismatch(Exception):
+    """Raised when the .npy blob is not the version the index blob was written for, e.g. during an upload."""
+
+
+def quantize(matrix, dtype: str):
+    """
+    Returns (stored matrix, scales). int8 rows are scaled symmetrically by their largest absolute value,
+    scales is None for the float types.
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype '{dtype}', use one of {SUPPORTED_DTYPES}")
+    if dtype != "int8":
+        return matrix.astype(dtype), None
+    scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0, dtype=np.float32)
+    scales[scales == 0] = 1.0
+    stored = np.rint(matrix / scales[:, None]).astype(np.int8)
+    return stored, scales.astype(np.float32)
+
+
+class EmbeddingSidecar:
+    """
+    The embeddings of a set of documents as one contiguous matrix, stored next to the json documents
+    as a .npy file plus a small json index.
+
+    Params:
+    vectors -> (rows, dimensions) array in the stored dtype, may be a read only memory map
+    index -> {document id: {field: row}}, the row ids the documents reference
+    dtype -> one of SUPPORTED_DTYPES
+    scales -> per row scales of int8 vectors, None otherwise
+    npy_etag -> etag of the .npy blob the index belongs to, set by upload
+    """
+
+    def __init__(self, vectors, index: dict, dtype: str, scales=None, npy_etag=None):
+        self.vectors = vectors
+        self.index = index
+        self.dtype = dtype
+        self.scales = scales
+        self.npy_etag = npy_etag
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def dimensions(self):
+        return self.vectors.shape[1] if self.vectors.ndim == 2 else 0
+
+    def vector(self, row: int):
+        """Row as float32, int8 rows are scaled back."""
+        vector = np.asarray(self.vectors[row], dtype=np.float32)
+        return vector * self.scales[row] if self.scales is not None else vector
+
+    def matrix(self):
+        """All rows as one float32 array (a copy, also when the sidecar is memory mapped)."""
+        matrix = np.asarray(self.vectors, dtype=np.float32)
+        return matrix * self.scales[:, None] if self.scales is not None else matrix
+
+    def document_vector(self, document_id, field: str):
+        """Vector of a document field, None if it has none."""
+        row = self.index.get(str(document_id), {}).get(field)
+        return None if row is None else self.vector(row)
+
+    def index_data(self):
+        data = {"dtype": self.dtype, "rows": len(self), "dimensions": self.dimensions, "index": self.index}
+        if self.scales is not None:
+            data["scales"] = self.scales.tolist()
+        if self.npy_etag is not None:
+            data["npy_etag"] = self.npy_etag
+        return data
+
+    def iter_npy_chunks(self, rows_per_chunk=NPY_ROWS_PER_CHUNK):
+        """Yield the matrix as a .npy file: the header, then the rows a chunk at a time."""
+        vectors = np.ascontiguousarray(self.vectors)
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, np.lib.format.header_data_from_array_1_0(vectors))
+        yield header.getvalue()
+        for start in range(0, len(vectors), rows_per_chunk):
+            yield vectors[start:start + rows_per_chunk].tobytes()
+
+    def save(self, npy_path: str, index_path: str):
+        with open(npy_path, "wb") as npy_file:
+            for chunk in self.iter_npy_chunks():
+                npy_file.write(chunk)
+        with open(index_path, "wb") as index_file:
+            index_file.write(encode_json(self.index_data()))
+
+    def upload(self, npy_blob_client, index_blob_client):
+        """
+        Stream the matrix into staged blocks of its blob, then upload the index with the etag of the matrix,
+        so a reader can tell a matrix from an index of another version apart.
+        """
+        self.npy_etag = upload_json_stream(npy_blob_client, self.iter_npy_chunks())
+        index_blob_client.upload_blob(encode_json(self.index_data()), overwrite=True)
+        logger.info(f"Uploaded {len(self)} {self.dtype} embeddings of {self.dimensions} dimensions "
+                    f"to {npy_blob_client.blob_name}")
+
+
+def pack_embeddings(documents: list, dtype=EMBEDDING_DTYPE, id_key="id"):
+    """
+    Move the vectors under "embeddings" of every document into an EmbeddingSidecar. Each document keeps
+    only the row of each field, e.g. "embeddings": {"Title": 17}. A vector shared by several fields
+    (identical texts get the same vector object from generate_embeddings) is stored once.
+
+    Returns the EmbeddingSidecar; the documents are changed in place.
+    """
+    rows = {}
+    vectors = []
+    index = {}
+    for document in documents:
+        embeddings = document.get("embeddings")
+        if not embeddings:
+            continue
+        references = {}
+        for field, vector in embeddings.items():
+            if not isinstance(vector, list) or not vector:
+                continue
+            row = rows.get(id(vector))
+            if row is None:
+                row = rows[id(vector)] = len(vectors)
+                vectors.append(vector)
+            references[field] = row
+        document["embeddings"] = references
+        index[str(document.get(id_key))] = references
+
+    if vectors and any(len(vector) != len(vectors[0]) for vector in vectors):
+        raise ValueError("Embeddings of different dimensions cannot share a sidecar")
+    matrix = np.array(vectors, dtype=np.float32) if vectors else np.zeros((0, 0), dtype=np.float32)
+    stored, scales = quantize(matrix, dtype)
+    return EmbeddingSidecar(stored, index, dtype, scales)
+
+
+def load_sidecar(npy_path: str, index_path: str, mmap=True):
+    """
+    Open a sidecar saved with EmbeddingSidecar.save or downloaded from blob storage. With mmap the
+    matrix is memory mapped read only, so only the rows that are read are loaded.
+    """
+    with open(index_path, "rb") as index_file:
+        data = json_codec.loads(index_file.read())
+    # an empty matrix cannot be memory mapped
+    vectors = np.load(npy_path, mmap_mode="r" if mmap and data["rows"] else None)
+    scales = np.asarray(data["scales"], dtype=np.float32) if "scales" in data else None
+    return EmbeddingSidecar(vectors, data["index"], data["dtype"], scales, data.get("npy_etag"))
+
+
+def download_sidecar(npy_blob_client, index_blob_client, directory: str, mmap=True):
+    """
+    Download a sidecar into directory and open it with load_sidecar.
+
+    Raises SidecarVersionMismatch when the .npy blob is not the one the index was written for: the matrix
+    is uploaded first, so a download between the two uploads sees a new matrix next to the old index.
+    """
+    npy_path = os.path.join(directory, os.path.basename(npy_blob_client.blob_name))
+    index_path = os.path.join(directory, os.path.basename(index_blob_client.blob_name))
+    with open(index_path, "wb") as index_file:
+        index_blob_client.download_blob().readinto(index_file)
+    with open(npy_path, "wb") as npy_file:
+        downloader = npy_blob_client.download_blob()
+        downloader.readinto(npy_file)
+    sidecar = load_sidecar(npy_path, index_path, mmap)
+    # sidecars uploaded before the etag was recorded cannot be checked
+    if sidecar.npy_etag is not None and sidecar.npy_etag != downloader.properties.etag:
+        raise SidecarVersionMismatch(f"{npy_blob_client.blob_name} does not match {index_blob_client.blob_name}")
+    return sidecar
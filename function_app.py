@@ -5,7 +5,6 @@ import logging
 import os
 import time
 import csv
-import msal
 import requests
 from azure.cosmos import CosmosClient
 from dotenv import load_dotenv
@@ -20,6 +19,16 @@ from access_token import get_access_token
 from read_clean_upload_pptx import pptx_to_json
 from model_repsonse_anurag import get_ai_response
 from collections import defaultdict
+from itertools import chain
+from merged_cleaning import clean_merged_data
+from blob_stream import encode_json, iter_json_array, json_indent, upload_json_stream
+from parallel_cleaning import iter_clean_merged_items
+from merge_engine import JoinSpec, SecondaryJoin, hash_join
+from vector_index import VECTOR_INDEX_MODE, get_vector_index
+from embedding_store import SidecarVersionMismatch
+from embedding_cache import open_embedding_cache
+import embedding
+from graph_funcs import iter_list_items, iter_lists_pages_batched, resolve_list, resolve_site_id, DEFAULT_PAGE_SIZE
 load_dotenv()
 
 COSMOSDB_ENDPOINT = os.getenv("cosmoendpoint")
@@ -54,89 +63,20 @@ SITE_PATH = os.getenv("SITE_PATH")
 
 
 
-def get_access_token():
-    """Acquires an app-only access token using MSAL."""
-    app_msal = msal.ConfidentialClientApplication(
-        CLIENT_ID, authority=AUTHORITY, client_credential=CLIENT_SECRET
-    )
-    token_response = app_msal.acquire_token_for_client(scopes=SCOPE)
-    if "access_token" in token_response:
-        logging.info("Access token acquired.")
-        return token_response["access_token"]
-    else:
-        raise Exception("Access token could not be obtained")
-
 def get_site_id(access_token):
     """Retrieves the SharePoint site ID from Microsoft Graph."""
-    url = f"https://graph.microsoft.com/v1.0/sites/{SITE_HOSTNAME}:{SITE_PATH}"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    logging.info(f"get_site_id() URL: {url}")
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    site_info = response.json()
-    if not site_info.get("id"):
-        raise Exception("Site ID not found in response.")
-    return site_info["id"]
-
-def get_list_details(listname, access_token):
-    
+    return resolve_site_id(access_token, SITE_HOSTNAME, SITE_PATH)
+
+def get_list_details(listname, access_token, page_size=DEFAULT_PAGE_SIZE):
+    """Yields the items of a SharePoint list page by page, following @odata.nextLink."""
     site_id = get_site_id(access_token)
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists/{listname}/items?expand=fields"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    logging.info(f"Retrieving list '{listname}' from URL: {url}")
-    response = requests.get(url, headers=headers)
+    logging.info(f"Retrieving list '{listname}' from site '{site_id}' ({page_size} items per page)")
     try:
-        response.raise_for_status()
-    except requests.exceptions.HTTPError:
-        if response.status_code == 404:
+        yield from iter_list_items(access_token, site_id, listname, page_size)
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code == 404:
             raise Exception(f"List '{listname}' not found. Please check the list name.")
-    data = response.json()
-    if data is None:
-        raise Exception(f"No data returned for list '{listname}'.")
-    return data
-
-def clean_data(data):
-    """Recursively cleans the data by removing unwanted values and characters."""
-    if isinstance(data, dict):
-        cleaned_dict = {}
-        for key, value in data.items():
-            cleaned_value = clean_data(value)
-            if cleaned_value is not None and cleaned_value != "":
-                cleaned_dict[key] = cleaned_value
-        return cleaned_dict
-    elif isinstance(data, list):
-        return [clean_data(item) for item in data if clean_data(item) not in (None, "")]
-    elif isinstance(data, str):
-        data = data.replace(";", "")
-        data = data.replace("#Name?", "Name")
-        return data
-    else:
-        return data
-
-def convert_numeric(data):
-    """Recursively converts numeric strings to numbers and converts 'no' to 0."""
-    if isinstance(data, dict):
-        return {k: convert_numeric(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [convert_numeric(item) for item in data]
-    elif isinstance(data, str):
-        if data.strip().lower() == "no":
-            return 0
-        try:
-            int_val = int(data)
-            if str(int_val) == data:
-                return int_val
-        except ValueError:
-            pass
-        try:
-            float_val = float(data)
-            if "." in data or "e" in data.lower():
-                return float_val
-        except ValueError:
-            pass
-        return data
-    else:
-        return data
+        raise
 
 def create_blob_container(blob_service_client, container_name):
     """Creates an Azure Blob Storage container if it does not already exist."""
@@ -146,21 +86,23 @@ def create_blob_container(blob_service_client, container_name):
     except ResourceExistsError:
         logging.info(f"Container '{container_name}' already exists.")
 
-def remove_unwanted_fields(data, unwanted_keys=["@odata.context", "@odata.etag", "eTag", "webUrl", "fields@odata.context"]):
-    """Recursively removes unwanted keys from the JSON data."""
-    if isinstance(data, dict):
-        return {k: remove_unwanted_fields(v, unwanted_keys) for k, v in data.items() if k not in unwanted_keys}
-    elif isinstance(data, list):
-        return [remove_unwanted_fields(item, unwanted_keys) for item in data]
+def get_merged_json(merged_data, pretty=None):
+    """
+    Cleans merged data in a single pass and yields it as utf-8 JSON chunks, one per item.
+    Large inputs are cleaned in chunks on the worker processes of parallel_cleaning.
+    Compact unless pretty (or JSON_PRETTY) is set.
+    """
+    indent = json_indent(pretty)
+    if isinstance(merged_data, dict):
+        yield encode_json(clean_merged_data(merged_data), indent)
     else:
-        return data
+        yield from iter_json_array(iter_clean_merged_items(merged_data), indent)
 
-def get_merged_json(merged_data):
-    """Cleans merged data and returns it as a formatted JSON string."""
-    merged_data = remove_unwanted_fields(merged_data)
-    cleaned_data = clean_data(merged_data)
-    converted_data = convert_numeric(cleaned_data)
-    return json.dumps(converted_data, indent=2)
+def record_chunks(chunks, recorded: list):
+    """Pass chunks through while keeping them, used when the response body is also needed."""
+    for chunk in chunks:
+        recorded.append(chunk)
+        yield chunk
 
 def filter_mitigation_fields(mitigation_fields):
    
@@ -172,57 +114,49 @@ def filter_mitigation_fields(mitigation_fields):
     ]
     return {k: mitigation_fields[k] for k in allowed_keys if k in mitigation_fields}
 
-def merge_multiple_lists(primary_data, secondary_list_names, access_token):
-   
-    reg_list = primary_data.get("value", [])
-    aggregated_sec_index = {}
-    for sec_name in secondary_list_names:
-        sec_data = get_list_details(sec_name, access_token)
-        for record in sec_data.get("value", []):
-            fields = record.get("fields", {})
-            risk_id = fields.get("RiskId")
-            if risk_id is not None:
-                try:
-                    risk_id_str = str(int(float(risk_id)))
-                except Exception:
-                    risk_id_str = str(risk_id)
-                aggregated_sec_index.setdefault(risk_id_str, []).append(filter_mitigation_fields(fields))
-    
-    new_list = []
-    for record in reg_list:
-        reg_id = record.get("id")
-        if "fields" in record:
-            primary_fields = record["fields"].copy()
-            primary_fields["id"] = reg_id
-        else:
-            primary_fields = {"id": reg_id}
-# Only add "mitigations" if matching secondary records are found.
-        if reg_id and aggregated_sec_index.get(str(reg_id)):
-            primary_fields["mitigations"] = aggregated_sec_index.get(str(reg_id))
-        new_list.append(primary_fields)
-    
-    return new_list
+def build_merged_record(record, matches):
+    """Flattens a primary item to its fields and id, "mitigations" is only added when there are matches."""
+    reg_id = record.get("id")
+    if "fields" in record:
+        primary_fields = {**record["fields"], "id": reg_id}
+    else:
+        primary_fields = {"id": reg_id}
+    if matches["mitigations"]:
+        primary_fields["mitigations"] = matches["mitigations"]
+    return primary_fields
+
+# primary list items get the records of every secondary list whose fields.RiskId is their id
+SECONDARY_LISTS_JOIN = JoinSpec(
+    primary_key="id",
+    secondaries=[SecondaryJoin(
+        "mitigations", key="fields.RiskId",
+        project=lambda record: filter_mitigation_fields(record.get("fields") or {}),
+    )],
+    build=build_merged_record,
+)
+
+def merge_multiple_lists(primary_items, secondary_list_names, access_token):
+    """
+    Attaches matching secondary list records to each primary item and yields the merged items.
+    Both sides are consumed as streams.
+    """
+    # all secondary lists are paged together, one $batch round trip per page
+    site_id = get_site_id(access_token)
+    secondary_records = (record for _, page in iter_lists_pages_batched(access_token, site_id, secondary_list_names)
+                         for record in page)
+    yield from hash_join(SECONDARY_LISTS_JOIN, primary_items, {"mitigations": secondary_records})
 
 def find_matching_list_name(sharepoint_list_name, access_token):
-    """Retrieve all SharePoint lists and return the correctly-cased name matching the given name (ignores spaces and case)."""
+    """Return the correctly-cased name matching the given name (ignores spaces and case), using the cached list index of the site."""
     site_id = get_site_id(access_token)
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
-    
-    normalized_input_name = sharepoint_list_name.replace(" ", "").lower()
-    
-    all_lists = response.json().get("value", [])
-    for lst in all_lists:
-        normalized_list_name = lst["name"].replace(" ", "").lower()
-        if normalized_list_name == normalized_input_name:
-            return lst["name"]  
-    
-    raise Exception(f"List '{sharepoint_list_name}' not found.")
+    return resolve_list(access_token, site_id, sharepoint_list_name)["name"]
 
 
-def upload(container_name, sharepoint_list_name, upload_to_blob=True):
+def upload(container_name, sharepoint_list_name, upload_to_blob=True, return_response=True, pretty=None):
+    """
+    Merge a list with SECONDARY_LISTS, clean it and stream the JSON into the blob block by block.
+    Returns the JSON as bytes when return_response is set, otherwise None.
+    """
     access_token = get_access_token()
 
     correct_list_name = find_matching_list_name(sharepoint_list_name, access_token)
@@ -230,14 +164,18 @@ def upload(container_name, sharepoint_list_name, upload_to_blob=True):
     blob_service_client = BlobServiceClient.from_connection_string(CONNECTION_STRING)
     create_blob_container(blob_service_client, container_name)
 
-    primary_data = get_list_details(correct_list_name, access_token)
+    primary_items = get_list_details(correct_list_name, access_token)
+    first_item = next(primary_items, None)
 
-    if primary_data.get("value"):
-        merged_data = merge_multiple_lists(primary_data, SECONDARY_LISTS, access_token)
+    if first_item is not None:
+        merged_data = merge_multiple_lists(chain([first_item], primary_items), SECONDARY_LISTS, access_token)
     else:
-        merged_data = primary_data
+        merged_data = {"value": []}
 
-    merged_json = get_merged_json(merged_data)
+    chunks = get_merged_json(merged_data, pretty)
+    response_chunks = []
+    if return_response:
+        chunks = record_chunks(chunks, response_chunks)
 
     if upload_to_blob:
         change_list_name = correct_list_name.replace(" ", "_")
@@ -245,10 +183,12 @@ def upload(container_name, sharepoint_list_name, upload_to_blob=True):
             container=container_name,
             blob=f"{change_list_name}_lists_merged.json"
         )
-        blob_client.upload_blob(merged_json, overwrite=True)
+        upload_json_stream(blob_client, chunks)
         logging.info(f"Uploaded data to Azure Blob Storage as {change_list_name}_lists_merged.json.")
+    else:
+        response_chunks = list(chunks)
 
-    return merged_json
+    return b"".join(response_chunks) if return_response else None
 
 app = func.FunctionApp()
 #Vishnu endpoint
@@ -259,6 +199,8 @@ def get_sharepoint_data(req: HttpRequest) -> HttpResponse:
     sharepoint_list_name = req.params.get("sharepoint_list_name")
     upload_to_blob = req.params.get("upload_to_blob", "true").lower() == "true"
     return_response = req.params.get("return_response", "true").lower() == "true"
+    pretty = req.params.get("pretty")
+    pretty = pretty.lower() == "true" if pretty is not None else None
 
     if not sharepoint_list_name:
         return func.HttpResponse(
@@ -267,7 +209,8 @@ def get_sharepoint_data(req: HttpRequest) -> HttpResponse:
         )
 
     try:
-        result = upload(CONTAINER_NAME, sharepoint_list_name, upload_to_blob=upload_to_blob)
+        result = upload(CONTAINER_NAME, sharepoint_list_name, upload_to_blob=upload_to_blob,
+                        return_response=return_response, pretty=pretty)
 
         if return_response:
             return func.HttpResponse(result, status_code=200, mimetype="application/json")
@@ -748,6 +691,80 @@ def chat_completion_http_trigger_as(req: func.HttpRequest) -> func.HttpResponse:
                 return func.HttpResponse(response, status_code=200, mimetype="application/json")
         else:
             return func.HttpResponse("Query and model name must be present", status_code=400)
+# client embedding the search queries, created on the first search of a worker
+_risk_search_client = None
+
+def get_risk_search_client():
+    """Embedding client of the risk search, same deployment as the stored risk embeddings (see embedding.py)."""
+    global _risk_search_client
+    if _risk_search_client is None:
+        _risk_search_client = embedding.AzureOpenAI(embedding.AZURE_OPENAI_KEY, embedding.API_VERSION,
+                                                    embedding.AZURE_OPENAI_ENDPOINT, cache=open_embedding_cache())
+    return _risk_search_client
+
+def get_risk_search_index(field, mode=VECTOR_INDEX_MODE):
+    """Vector index over the risk embeddings uploaded by embedding.py, kept loaded between warm invocations."""
+    blob_service_client = BlobServiceClient.from_connection_string(CONNECTION_STRING)
+    return get_vector_index(
+        blob_service_client.get_blob_client(container=embedding.CONTAINER_NAME, blob=embedding.EMBEDDINGS_BLOB_NAME),
+        blob_service_client.get_blob_client(container=embedding.CONTAINER_NAME, blob=embedding.EMBEDDINGS_INDEX_BLOB_NAME),
+        field, mode,
+    )
+
+@app.route(route="risk_search", methods=["GET", "POST"])
+def risk_search(req: HttpRequest) -> HttpResponse:
+    """
+    Returns the risks most similar to a query text by cosine similarity of their embeddings.
+    Parameters, in the query string or the json body: query (required), k (default 10),
+    field (embedding field searched, default Title) and mode (brute, ivf or auto).
+    """
+    logging.info("Processing risk_search request.")
+    try:
+        body = req.get_json() if req.method == "POST" else {}
+    except ValueError:
+        body = {}
+    if not isinstance(body, dict):
+        return func.HttpResponse("The request body must be a json object.", status_code=400)
+    query = req.params.get("query") or body.get("query")
+    field = req.params.get("field") or body.get("field") or "Title"
+    mode = req.params.get("mode") or body.get("mode") or VECTOR_INDEX_MODE
+    if not all(isinstance(value, str) for value in (query or "", field, mode)):
+        return func.HttpResponse("'query', 'field' and 'mode' must be strings.", status_code=400)
+    mode = mode.lower()
+    try:
+        k = int(req.params.get("k") or body.get("k") or 10)
+    except (TypeError, ValueError):
+        return func.HttpResponse("'k' must be a number.", status_code=400)
+    if not query or not query.strip():
+        return func.HttpResponse("Please pass a 'query' in the query string or in the request body.", status_code=400)
+
+    try:
+        index = get_risk_search_index(field, mode)
+        query_vector = get_risk_search_client().generate_embedding(query)
+        if query_vector is None:
+            return func.HttpResponse("Failed to embed the query. Please try again", status_code=502)
+        start = time.perf_counter()
+        results = index.search(query_vector, k)
+        search_ms = (time.perf_counter() - start) * 1000
+    except ValueError as e:
+        return func.HttpResponse(f"Error: {str(e)}", status_code=400)
+    except SidecarVersionMismatch as e:
+        # the embeddings are being uploaded
+        return func.HttpResponse(f"Error: {str(e)}. Please try again", status_code=503)
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        return func.HttpResponse(f"Error: {str(e)}", status_code=500)
+
+    response = {
+        "query": query,
+        "field": field,
+        "mode": index.mode,
+        "index_size": len(index),
+        "search_ms": round(search_ms, 3),
+        "results": [{"id": document_id, "score": score} for document_id, score in results],
+    }
+    return func.HttpResponse(json.dumps(response), status_code=200, mimetype="application/json")
+
 @app.timer_trigger(schedule="0 0 * * * *", arg_name="myTimer", run_on_startup=False,
               use_monitor=False) 
 def sharepoint_timer_trigger(myTimer: func.TimerRequest) -> None:
@@ -0,0 +1,115 @@
+import json
+import os
+import time
+import logging
+import tempfile
+import threading
+from dotenv import load_dotenv
+load_dotenv()
+logger = logging.getLogger("tt_sharepoint_logger")
+
+# Site, drive and list ids rarely change, so they are kept for an hour by default.
+RESOLVER_CACHE_TTL = int(os.getenv("GRAPH_RESOLVER_CACHE_TTL", "3600"))
+# Optional file the cache is saved to, e.g. /tmp/graph_resolver_cache.json. Lets a restarted
+# worker skip the lookups while the saved entries are still valid.
+RESOLVER_CACHE_PATH = os.getenv("GRAPH_RESOLVER_CACHE_PATH")
+
+
+class ResolverCache:
+    """
+    Thread safe key/value cache with a time to live, kept in worker memory and optionally saved to a json file.
+    Keys are tuples of strings, values must be json serializable.
+    """
+
+    def __init__(self, ttl=RESOLVER_CACHE_TTL, path=None):
+        self.ttl = ttl
+        self.path = path
+        self._entries = {}
+        self._lock = threading.Lock()
+        # saves run one at a time, so the last one written holds the latest entries
+        self._save_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path:
+            self._load()
+
+    @staticmethod
+    def _encode_key(key):
+        return "|".join(key)
+
+    def get(self, key):
+        """Returns the cached value or None if the key is missing or expired."""
+        encoded_key = self._encode_key(key)
+        with self._lock:
+            entry = self._entries.get(encoded_key)
+            if entry is None or entry[1] < time.time():
+                self._entries.pop(encoded_key, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, values: dict):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            for key, value in values.items():
+                self._entries[self._encode_key(key)] = (value, expires_at)
+        self._save()
+
+    def get_or_resolve(self, key, resolver):
+        """
+        Returns the cached value for key, calling resolver() and caching its result on a miss.
+        """
+        value = self.get(key)
+        if value is None:
+            value = resolver()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key=None):
+        """Drop one key, or every key when no key is given."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(self._encode_key(key), None)
+        self._save()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as cache_file:
+                saved_entries = json.load(cache_file)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable resolver cache {self.path}: {e}")
+            return
+        now = time.time()
+        self._entries = {k: (v[0], v[1]) for k, v in saved_entries.items() if v[1] >= now}
+
+    def _save(self):
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                entries = dict(self._entries)
+            tmp_path = None
+            try:
+                # a temp file of its own, other worker processes may save the same path
+                with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(os.path.abspath(self.path)),
+                                                 prefix=os.path.basename(self.path), suffix=".tmp",
+                                                 delete=False) as cache_file:
+                    tmp_path = cache_file.name
+                    json.dump(entries, cache_file)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                logger.warning(f"Failed to save resolver cache to {self.path}: {e}")
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+
+# shared by every module of the worker process
+resolver_cache = ResolverCache(RESOLVER_CACHE_TTL, RESOLVER_CACHE_PATH)
@@ -0,0 +1,324 @@
+import os
+import queue
+import logging
+import threading
+from dotenv import load_dotenv
+from graph_cache import resolver_cache
+from graph_transport import graph_transport, RETRY_STATUS_CODES, THROTTLE_STATUS_CODES
+from data_cleaning_anurag import allowed_columns
+load_dotenv()
+logger = logging.getLogger("tt_sharepoint_logger")
+
+GRAPH_BASE_URL = "https://graph.microsoft.com/v1.0"
+# Number of list items requested per page ($top). Graph pages list items on its own, so every
+# fetch has to follow @odata.nextLink regardless of this value.
+DEFAULT_PAGE_SIZE = int(os.getenv("GRAPH_PAGE_SIZE", "999"))
+GRAPH_BATCH_URL = f"{GRAPH_BASE_URL}/$batch"
+# Graph accepts at most 20 requests per $batch call.
+MAX_BATCH_SIZE = 20
+# Pages of a list fetched ahead of its consumer by BatchedListPages.
+BATCH_PAGES_AHEAD = int(os.getenv("GRAPH_BATCH_PAGES_AHEAD", "2"))
+# Set to "true" to only download the columns the cleaning schema keeps. The timer archives the items it
+# fetched to uncleaned_lists/, so with the projection those blobs hold the kept columns only, not every
+# SharePoint column. Off by default so the uncleaned archive stays complete.
+SELECT_COLUMNS = os.getenv("GRAPH_SELECT_COLUMNS", "false").lower() == "true"
+# Properties of the list item itself, everything else in allowed_columns is a column under "fields".
+ITEM_PROPERTIES = ["id", "createdDateTime", "lastModifiedDateTime"]
+
+
+def list_select_query(list_name, select_columns=False, extra_properties=()):
+    """
+    Returns the expand/select query options for the items of a list.
+
+    With select_columns, lists registered in data_cleaning_anurag.allowed_columns only request the
+    columns that clean_and_format_data keeps (expand=fields($select=...)); other lists get every field.
+    extra_properties are added to the item level $select, e.g. the "deleted" facet for delta queries.
+    """
+    if not (select_columns and SELECT_COLUMNS) or list_name not in allowed_columns:
+        return "expand=fields"
+    item_only_properties = {p.lower() for p in ITEM_PROPERTIES if p != "id"}
+    field_names = [c for c in allowed_columns[list_name] if c.lower() not in item_only_properties]
+    item_properties = ITEM_PROPERTIES + list(extra_properties)
+    return f"$select={','.join(item_properties)}&expand=fields($select={','.join(field_names)})"
+
+
+def list_items_url(site_id, list_name, page_size=DEFAULT_PAGE_SIZE, select_columns=False):
+    """
+    Returns the url of the first page of items of a sharepoint list.
+
+    Params:
+    site_id -> site that holds the list
+    list_name -> name or id of the list
+    page_size -> number of items per page ($top)
+    select_columns -> only request the columns kept by the cleaning schema of the list
+    """
+    return f"{GRAPH_BASE_URL}/sites/{site_id}/lists/{list_name}/items?{list_select_query(list_name, select_columns)}&$top={page_size}"
+
+
+def iter_list_pages(ACCESS_TOKEN, site_id, list_name, page_size=DEFAULT_PAGE_SIZE, select_columns=False):
+    """
+    Yield the items of a sharepoint list one page at a time, following @odata.nextLink until
+    the list is exhausted. Only one page is held in memory at a time.
+
+    Params:
+    ACCESS_TOKEN -> Required to access sharepoint site
+    site_id -> site that holds the list
+    list_name -> name or id of the list
+    page_size -> number of items per page ($top)
+    select_columns -> only request the columns kept by the cleaning schema of the list
+    """
+    url = list_items_url(site_id, list_name, page_size, select_columns)
+    headers = {"Authorization": f"Bearer {ACCESS_TOKEN}"}
+    page_no = 0
+    while url:
+        response = graph_transport.get(url, headers=headers)
+        response.raise_for_status()
+        page = response.json()
+        page_no += 1
+        items = page.get("value", [])
+        logger.debug(f"Fetched page {page_no} of '{list_name}' ({len(items)} items)")
+        yield items
+        url = page.get("@odata.nextLink")
+
+
+def iter_list_items(ACCESS_TOKEN, site_id, list_name, page_size=DEFAULT_PAGE_SIZE, select_columns=False):
+    """
+    Yield the items of a sharepoint list one by one across all pages.
+
+    Params:
+    ACCESS_TOKEN -> Required to access sharepoint site
+    site_id -> site that holds the list
+    list_name -> name or id of the list
+    page_size -> number of items per page ($top)
+    select_columns -> only request the columns kept by the cleaning schema of the list
+    """
+    for items in iter_list_pages(ACCESS_TOKEN, site_id, list_name, page_size, select_columns):
+        yield from items
+
+
+# ------------------------------
+# JSON $batch
+# ------------------------------
+def relative_graph_url(url):
+    """$batch sub-requests take urls relative to the api version, nextLinks and deltaLinks are absolute."""
+    if url.startswith(GRAPH_BASE_URL):
+        return url[len(GRAPH_BASE_URL):]
+    return url
+
+
+def batch_get(ACCESS_TOKEN, urls):
+    """
+    GET several Graph urls through the JSON $batch endpoint, up to 20 per HTTP call.
+
+    Params:
+    ACCESS_TOKEN -> Required to access sharepoint site
+    urls -> absolute or version-relative Graph urls
+
+    Returns a (status, body) tuple per url, in the order of urls. Throttled or transiently failing
+    sub-requests are retried in a following batch; other failures are returned to the caller.
+    """
+    headers = {"Authorization": f"Bearer {ACCESS_TOKEN}", "Content-Type": "application/json"}
+    results = [None] * len(urls)
+    pending = list(range(len(urls)))
+    attempt = 0
+    while pending:
+        retry = []
+        retry_after = None
+        throttled = False
+        for start in range(0, len(pending), MAX_BATCH_SIZE):
+            chunk = pending[start:start + MAX_BATCH_SIZE]
+            body = {"requests": [{"id": str(i), "method": "GET", "url": relative_graph_url(urls[i])} for i in chunk]}
+            response = graph_transport.post(GRAPH_BATCH_URL, headers=headers, json=body)
+            response.raise_for_status()
+            for sub_response in response.json().get("responses", []):
+                index = int(sub_response["id"])
+                status = sub_response.get("status", 500)
+                if status in RETRY_STATUS_CODES and attempt < graph_transport.max_retries:
+                    retry.append(index)
+                    throttled = throttled or status in THROTTLE_STATUS_CODES
+                    sub_headers = {k.lower(): v for k, v in (sub_response.get("headers") or {}).items()}
+                    # Retry-After may be seconds or an HTTP date, backoff_delay reads both
+                    retry_after = max(retry_after or 0, graph_transport.backoff_delay(attempt, sub_headers.get("retry-after")))
+                else:
+                    results[index] = (status, sub_response.get("body"))
+        if retry:
+            delay = graph_transport.backoff_delay(attempt, retry_after)
+            logger.warning(f"{len(retry)} batched requests throttled or failed. Retrying in {delay:.1f}s")
+            graph_transport.wait_before_retry(delay, throttled)
+            attempt += 1
+        pending = sorted(retry)
+    return results
+
+
+def raise_for_batch_status(url, status, body):
+    if status >= 400:
+        error = (body or {}).get("error", {}) if isinstance(body, dict) else {}
+        raise Exception(f"Batched request {url} failed with status {status}: {error.get('message', body)}")
+
+
+def iter_lists_pages_batched(ACCESS_TOKEN, site_id, list_names, page_size=DEFAULT_PAGE_SIZE, select_columns=False):
+    """
+    Yield (list_name, items) for every page of several lists. Each round fetches the next page of
+    every list that is not exhausted yet in a single $batch call, so N lists cost one round trip per
+    page instead of N.
+
+    Params:
+    ACCESS_TOKEN -> Required to access sharepoint site
+    site_id -> site that holds the lists
+    list_names -> names or ids of the lists
+    page_size -> number of items per page ($top)
+    select_columns -> only request the columns kept by the cleaning schema of each list
+    """
+    next_urls = {list_name: list_items_url(site_id, list_name, page_size, select_columns) for list_name in dict.fromkeys(list_names)}
+    while next_urls:
+        round_names = list(next_urls)
+        round_urls = [next_urls[list_name] for list_name in round_names]
+        next_urls = {}
+        for list_name, url, (status, page) in zip(round_names, round_urls, batch_get(ACCESS_TOKEN, round_urls)):
+            raise_for_batch_status(url, status, page)
+            if page.get("@odata.nextLink"):
+                next_urls[list_name] = page["@odata.nextLink"]
+            yield list_name, page.get("value", [])
+
+
+class BatchedListPages:
+    """
+    Pages several lists together with iter_lists_pages_batched on a background thread and hands each
+    list's items to its own consumer, at most pages_ahead pages ahead of it. Unlike collecting the lists
+    first, only a few pages per list are held in memory.
+
+    Every list has to be consumed with iter_items (or given up with close) concurrently: the fetch moves
+    at the pace of the slowest consumer.
+    """
+
+    _END = object()
+
+    def __init__(self, ACCESS_TOKEN, site_id, list_names, page_size=DEFAULT_PAGE_SIZE, select_columns=False,
+                 pages_ahead=BATCH_PAGES_AHEAD):
+        self.list_names = list(dict.fromkeys(list_names))
+        self._queues = {list_name: queue.Queue(maxsize=pages_ahead) for list_name in self.list_names}
+        self._closed = set()
+        self._thread = threading.Thread(
+            target=self._fetch, args=(ACCESS_TOKEN, site_id, page_size, select_columns), daemon=True)
+        self._thread.start()
+
+    def __contains__(self, list_name):
+        return list_name in self._queues
+
+    def _put(self, list_name, value):
+        """Queue a page for a list, dropped once its consumer has closed it."""
+        pages = self._queues[list_name]
+        while list_name not in self._closed:
+            try:
+                pages.put(value, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _fetch(self, ACCESS_TOKEN, site_id, page_size, select_columns):
+        try:
+            for list_name, items in iter_lists_pages_batched(ACCESS_TOKEN, site_id, self.list_names, page_size, select_columns):
+                self._put(list_name, items)
+        except Exception as e:
+            logger.error(f"Batched fetch of {self.list_names} failed: {e}")
+            end = e
+        else:
+            end = self._END
+        for list_name in self.list_names:
+            self._put(list_name, end)
+
+    def iter_items(self, list_name):
+        """Yield the items of a list as its pages arrive. Raises the error of the fetch if it failed."""
+        pages = self._queues[list_name]
+        try:
+            while True:
+                page = pages.get()
+                if page is self._END:
+                    return
+                if isinstance(page, Exception):
+                    raise page
+                yield from page
+        finally:
+            self.close(list_name)
+
+    def close(self, list_name):
+        """Stop queueing pages of a list, e.g. when its consumer failed."""
+        self._closed.add(list_name)
+
+
+# ------------------------------
+# Cached site, drive and list resolution
+# ------------------------------
+def normalize_list_name(list_name: str):
+    """List names are matched ignoring spaces and case."""
+    return list_name.replace(" ", "").lower()
+
+
+def resolve_site_id(ACCESS_TOKEN, hostname, sitepath):
+    """
+    Returns the full site id ("<hostname>,<site guid>,<web guid>") of a sharepoint site.
+    The id is cached process wide, so only the first call per hostname/path reaches Graph.
+    """
+    def fetch_site_id():
+        url = f"{GRAPH_BASE_URL}/sites/{hostname}:{sitepath}"
+        headers = {"Authorization": f"Bearer {ACCESS_TOKEN}"}
+        response = graph_transport.get(url, headers=headers)
+        response.raise_for_status()
+        site_info = response.json()
+        if not site_info.get("id"):
+            raise Exception("Site ID not found in response.")
+        return site_info["id"]
+
+    return resolver_cache.get_or_resolve(("site", hostname, sitepath), fetch_site_id)
+
+
+def resolve_drive_id(ACCESS_TOKEN, site_id, drive_name="Documents"):
+    """
+    Returns the id of a document library of the site, cached process wide.
+    """
+    def fetch_drive_id():
+        url = f"{GRAPH_BASE_URL}/sites/{site_id}/drives"
+        headers = {"Authorization": f"Bearer {ACCESS_TOKEN}"}
+        response = graph_transport.get(url, headers=headers)
+        response.raise_for_status()
+        for drive in response.json().get("value", []):
+            if drive.get("name") == drive_name:
+                return drive["id"]
+        raise Exception("Drive not found")
+
+    return resolver_cache.get_or_resolve(("drive", site_id, drive_name), fetch_drive_id)
+
+
+def refresh_site_lists(ACCESS_TOKEN, site_id):
+    """
+    Fetch every list of the site and cache its canonical name and id under the normalized name.
+    One request fills the cache for all lists of the site.
+    """
+    url = f"{GRAPH_BASE_URL}/sites/{site_id}/lists"
+    headers = {"Authorization": f"Bearer {ACCESS_TOKEN}"}
+    resolved_lists = {}
+    while url:
+        response = graph_transport.get(url, headers=headers)
+        response.raise_for_status()
+        page = response.json()
+        for lst in page.get("value", []):
+            resolved_lists[("list", site_id, normalize_list_name(lst["name"]))] = {"name": lst["name"], "id": lst["id"]}
+            if lst.get("displayName"):
+                resolved_lists.setdefault(("list", site_id, normalize_list_name(lst["displayName"])), {"name": lst["name"], "id": lst["id"]})
+        url = page.get("@odata.nextLink")
+    resolver_cache.set_many(resolved_lists)
+    return resolved_lists
+
+
+def resolve_list(ACCESS_TOKEN, site_id, list_name):
+    """
+    Returns {"name": <canonical name>, "id": <list id>} for a list name, ignoring spaces and case.
+    The site's lists are fetched again once on a miss, in case the list was created or renamed.
+    """
+    key = ("list", site_id, normalize_list_name(list_name))
+    resolved = resolver_cache.get(key)
+    if resolved is None:
+        resolved = refresh_site_lists(ACCESS_TOKEN, site_id).get(key)
+    if resolved is None:
+        raise Exception(f"List '{list_name}' not found.")
+    return resolved
@@ -0,0 +1,144 @@
+import os
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+load_dotenv()
+logger = logging.getLogger("tt_sharepoint_logger")
+
+# Size of the keep-alive connection pool kept per host.
+POOL_SIZE = int(os.getenv("GRAPH_POOL_SIZE", "16"))
+# Maximum number of requests in flight against a single host.
+MAX_CONCURRENCY_PER_HOST = int(os.getenv("GRAPH_MAX_CONCURRENCY_PER_HOST", "8"))
+MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES", "5"))
+BACKOFF_BASE = float(os.getenv("GRAPH_BACKOFF_BASE", "1"))
+BACKOFF_MAX = float(os.getenv("GRAPH_BACKOFF_MAX", "60"))
+REQUEST_TIMEOUT = float(os.getenv("GRAPH_REQUEST_TIMEOUT", "60"))
+
+# 429 and 503 are Graph's throttling responses, 502/504 are transient gateway failures.
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+THROTTLE_STATUS_CODES = {429, 503}
+
+
+class GraphTransport:
+    """
+    Shared HTTP transport for Microsoft Graph calls.
+
+    - keeps a pooled keep-alive session instead of opening a connection per request
+    - retries throttled and transient failures with exponential backoff, honouring Retry-After
+    - limits the number of concurrent requests per host
+    - counts requests, retries and time spent waiting on throttling
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, max_concurrency_per_host=MAX_CONCURRENCY_PER_HOST,
+                 max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX,
+                 timeout=REQUEST_TIMEOUT):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.max_concurrency_per_host = max_concurrency_per_host
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self._host_limits = {}
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "throttle_seconds": 0.0, "failures": 0}
+
+    def _host_limit(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.max_concurrency_per_host)
+            return self._host_limits[host]
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """Seconds to wait before the next attempt. Retry-After wins over the computed backoff."""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+            try:
+                # Retry-After can also be an HTTP date
+                seconds = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                return min(max(seconds, 0.0), self.backoff_max)
+            except (TypeError, ValueError):
+                pass
+        delay = min(self.backoff_base * (2 ** attempt), self.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+
+    def wait_before_retry(self, delay, throttled=False):
+        """Sleep before a retry and count it. Also used for sub-requests retried by $batch callers."""
+        if throttled:
+            self._count("throttled")
+            self._count("throttle_seconds", delay)
+        self._count("retries")
+        time.sleep(delay)
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request, retrying throttled (429/503) and transient (502/504, connection error) failures.
+        The last response is returned once the retries are used up, so callers keep using raise_for_status().
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        host_limit = self._host_limit(url)
+        attempt = 0
+        while True:
+            self._count("requests")
+            try:
+                with host_limit:
+                    response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                delay = self.backoff_delay(attempt)
+                throttled = False
+                logger.warning(f"{method} {url} failed ({e}). Retrying in {delay:.1f}s")
+            else:
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    # without retries of its own the caller retries, e.g. the EmbeddingScheduler
+                    log = logger.error if self.max_retries else logger.debug
+                    log(f"{method} {url} still failing with {response.status_code} after {attempt} retries")
+                    return response
+                delay = self.backoff_delay(attempt, response.headers.get("Retry-After"))
+                throttled = response.status_code in THROTTLE_STATUS_CODES
+                logger.warning(f"{method} {url} returned {response.status_code}. Retrying in {delay:.1f}s")
+            self.wait_before_retry(delay, throttled)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+
+# one pool for the whole worker process
+graph_transport = GraphTransport()
+
+
+def log_transport_stats():
+    stats = graph_transport.get_stats()
+    logger.info(f"Graph transport: {stats['requests']} requests, {stats['retries']} retries, "
+                f"{stats['throttled']} throttled, {stats['throttle_seconds']:.1f}s waiting on throttling, "
+                f"{stats['failures']} failures")
+    return stats
@@ -0,0 +1,47 @@
+import os
+import json
+import logging
+from dotenv import load_dotenv
+try:
+    import orjson
+except ImportError: # orjson is optional, the standard library encoder is used without it
+    orjson = None
+load_dotenv()
+logger = logging.getLogger("tt_sharepoint_logger")
+
+# "auto" uses orjson when it is installed, "json" always uses the standard library.
+JSON_ENCODER = os.getenv("JSON_ENCODER", "auto").lower()
+
+
+def use_orjson():
+    return orjson is not None and JSON_ENCODER != "json"
+
+
+def dumps(data, indent=None):
+    """
+    Serialize data for a blob or HTTP response. Returns bytes when orjson is used, otherwise str;
+    both can be passed to upload_blob and func.HttpResponse. orjson writes NaN and Infinity as null,
+    json as NaN and Infinity.
+
+    Params:
+    data -> json serializable object
+    indent -> None for compact output or 2 for pretty printing
+    """
+    if use_orjson() and indent in (None, 2):
+        try:
+            return orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0)
+        except TypeError as e:
+            # e.g. integers above 64 bit, the standard library handles them
+            logger.warning(f"orjson could not serialize the data ({e}), using json instead")
+    return json.dumps(data, indent=indent)
+
+
+def loads(data):
+    """Parse json from str or bytes."""
+    if use_orjson():
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # blobs written with json.dumps may hold NaN and Infinity, which orjson rejects
+            pass
+    return json.loads(data)
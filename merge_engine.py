@@ -0,0 +1,128 @@
+import logging
+
+logger = logging.getLogger("tt_sharepoint_logger")
+
+
+def normalize_id(value):
+    """
+    Default key normalization: ids and lookup ids compare as integers whatever form they come in
+    (12, "12", 12.0, "12.0"), other values as stripped strings. None and "" mean no key.
+    """
+    if type(value) is int:
+        return value
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        value = str(value).strip()
+        return value or None
+
+
+def get_field(item, path):
+    """
+    Returns the value at a dotted path ("fields.RiskId") of an item, None if any part is missing.
+    A callable path is called with the item instead.
+    """
+    if callable(path):
+        return path(item)
+    value = item
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def field_getter(path):
+    """Compiles a dotted path (or callable) into a function returning the value of an item, like get_field."""
+    if callable(path):
+        return path
+    parts = path.split(".")
+    if len(parts) == 1:
+        key = parts[0]
+        return lambda item: item.get(key) if isinstance(item, dict) else None
+    return lambda item: get_field(item, path)
+
+
+def attach_all(primary_item, matches: dict):
+    """Default build: shallow copy of the primary item with every secondary attached, also when empty."""
+    return {**primary_item, **matches}
+
+
+class SecondaryJoin:
+    """
+    One secondary list of a join.
+
+    Params:
+    name -> key the matching items are attached under
+    key -> dotted field path or callable giving the join key of a secondary item
+    project -> optional callable applied to each secondary item before it is attached
+    """
+
+    def __init__(self, name, key, project=None):
+        self.name = name
+        self.key = key
+        self.project = project
+
+
+class JoinSpec:
+    """
+    Declarative description of a merge of a primary list with one or more secondary lists.
+
+    Params:
+    primary_key -> dotted field path or callable giving the join key of a primary item
+    secondaries -> list of SecondaryJoin with distinct names
+    normalize -> key normalization applied to both sides
+    build -> callable(primary item, matches) returning the merged document, matches maps each secondary
+             name to the list of its matching items in input order
+    """
+
+    def __init__(self, primary_key, secondaries, normalize=normalize_id, build=attach_all):
+        self.primary_key = primary_key
+        self.secondaries = list(secondaries)
+        self.normalize = normalize
+        self.build = build
+
+
+def build_index(spec: JoinSpec, secondary_items: dict):
+    """
+    Index the secondary items by normalized key: {name: {key: [items]}}. Each iterable is read once,
+    so lists streamed page by page are indexed as the pages arrive.
+
+    secondary_items -> {secondary name: iterable of items}; items of several lists attached under the
+                       same name can be chained into one iterable
+    """
+    indexes = {}
+    for secondary in spec.secondaries:
+        index = indexes[secondary.name] = {}
+        get_key = field_getter(secondary.key)
+        skipped = 0
+        for item in secondary_items.get(secondary.name, ()):
+            key = spec.normalize(get_key(item))
+            if key is None:
+                skipped += 1
+                continue
+            index.setdefault(key, []).append(secondary.project(item) if secondary.project else item)
+        if skipped:
+            logger.info(f"{skipped} '{secondary.name}' items without a join key were not merged")
+    return indexes
+
+
+def hash_join(spec: JoinSpec, primary_items, secondary_items: dict):
+    """
+    Merge the secondary lists into the primary list with a hash join: the secondaries are indexed once,
+    then the primary items are streamed and looked up, O(n + m) whatever the input order.
+    One primary item can match any number of secondary items.
+
+    Yields the merged documents in the order of primary_items.
+    """
+    indexes = list(build_index(spec, secondary_items).items())
+    normalize, get_key, build = spec.normalize, field_getter(spec.primary_key), spec.build
+    for item in primary_items:
+        key = normalize(get_key(item))
+        yield build(item, {name: list(index.get(key, ())) for name, index in indexes})
@@ -0,0 +1,222 @@
+import logging
+from itertools import count
+from blob_stream import encode_json_element, frame_json_array
+from merge_engine import JoinSpec, field_getter
+
+logger = logging.getLogger("tt_sharepoint_logger")
+
+
+class MergedDocumentStore:
+    """
+    The merged documents of a JoinSpec kept per primary item, with a reverse index from every secondary
+    item id to the join key it is attached under. Changes to either side rebuild and re-encode only
+    the documents they touch, the other documents are reused as they are.
+
+    Documents are kept in the order the full merge of the patched lists (delta_sync_funcs.apply_changes)
+    would produce: primary items keep their position and new ones are appended, the secondary items of
+    a document stay in list order.
+
+    Params:
+    spec -> JoinSpec of the merge
+    item_id -> dotted field path of the item id on both sides, the id delta queries report removals with
+    """
+
+    def __init__(self, spec: JoinSpec, item_id="id"):
+        self.spec = spec
+        self.get_item_id = field_getter(item_id)
+        self.get_primary_key = field_getter(spec.primary_key)
+        self.secondaries = {secondary.name: secondary for secondary in spec.secondaries}
+        self.get_secondary_key = {secondary.name: field_getter(secondary.key) for secondary in spec.secondaries}
+        self.clear()
+
+    def clear(self):
+        self.primary_items = {} # primary item id -> item, in output order
+        self.primary_ids = {} # join key -> ids of the primary items with that key
+        self.matches = {name: {} for name in self.secondaries} # name -> {join key: {item id: attached item}}
+        self.reverse_index = {name: {} for name in self.secondaries} # name -> {secondary item id: join key}
+        self.positions = {name: {} for name in self.secondaries} # name -> {secondary item id: list position}
+        self.documents = {} # primary item id -> merged document
+        self._encoded = {} # primary item id -> document encoded with encode_json_element
+        self._indent = None
+        self._sequence = count()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def item_id(self, item):
+        return self.spec.normalize(self.get_item_id(item))
+
+    # ------------------------------
+    # Secondary items
+    # ------------------------------
+    def _detach_secondary(self, name, item_id):
+        """Detach a secondary item from its document, returns the join key it was attached under (None if it was not)."""
+        key = self.reverse_index[name].pop(item_id, None)
+        if key is not None:
+            bucket = self.matches[name][key]
+            del bucket[item_id]
+            if not bucket:
+                del self.matches[name][key]
+        return key
+
+    def _remove_secondary(self, name, item_id):
+        self.positions[name].pop(item_id, None)
+        return self._detach_secondary(name, item_id)
+
+    def _put_secondary(self, name, item, item_id):
+        """Attach a new or changed secondary item, returns the join keys whose documents change."""
+        old_key = self._detach_secondary(name, item_id)
+        # a changed item keeps its position in the list, new items are appended
+        positions = self.positions[name]
+        if item_id not in positions:
+            positions[item_id] = next(self._sequence)
+        key = self.spec.normalize(self.get_secondary_key[name](item))
+        if key is not None:
+            project = self.secondaries[name].project
+            self.matches[name].setdefault(key, {})[item_id] = project(item) if project else item
+            self.reverse_index[name][item_id] = key
+        return {key, old_key} - {None}
+
+    # ------------------------------
+    # Primary items
+    # ------------------------------
+    def _remove_primary(self, item_id):
+        item = self.primary_items.pop(item_id, None)
+        if item is None:
+            return
+        key = self.spec.normalize(self.get_primary_key(item))
+        ids = self.primary_ids.get(key)
+        if ids is not None:
+            ids.discard(item_id)
+            if not ids:
+                del self.primary_ids[key]
+        self.documents.pop(item_id, None)
+        self._encoded.pop(item_id, None)
+
+    def _put_primary(self, item, item_id):
+        old_item = self.primary_items.get(item_id)
+        if old_item is not None:
+            old_key = self.spec.normalize(self.get_primary_key(old_item))
+            ids = self.primary_ids.get(old_key)
+            if ids is not None:
+                ids.discard(item_id)
+                if not ids:
+                    del self.primary_ids[old_key]
+        # an existing item keeps its position in the dict
+        self.primary_items[item_id] = item
+        key = self.spec.normalize(self.get_primary_key(item))
+        if key is not None:
+            self.primary_ids.setdefault(key, set()).add(item_id)
+
+    def _build(self, item_id):
+        item = self.primary_items[item_id]
+        key = self.spec.normalize(self.get_primary_key(item))
+        matches = {}
+        for name, buckets in self.matches.items():
+            bucket = buckets.get(key)
+            if not bucket:
+                matches[name] = []
+                continue
+            positions = self.positions[name]
+            matches[name] = [bucket[i] for i in sorted(bucket, key=positions.__getitem__)]
+        self.documents[item_id] = self.spec.build(item, matches)
+        self._encoded.pop(item_id, None)
+
+    # ------------------------------
+    # Loading and patching
+    # ------------------------------
+    def load(self, primary_items, secondary_items: dict):
+        """
+        Build the store from the full lists, the same documents hash_join(spec, ...) yields.
+        Items without an id cannot be patched later and are left out.
+
+        secondary_items -> {secondary name: iterable of items}
+        """
+        self.clear()
+        skipped = 0
+        for name in self.secondaries:
+            for item in secondary_items.get(name, ()):
+                item_id = self.item_id(item)
+                if item_id is None:
+                    skipped += 1
+                    continue
+                self._put_secondary(name, item, item_id)
+        for item in primary_items:
+            item_id = self.item_id(item)
+            if item_id is None:
+                skipped += 1
+                continue
+            self._put_primary(item, item_id)
+        for item_id in self.primary_items:
+            self._build(item_id)
+        if skipped:
+            logger.info(f"{skipped} items without an id were left out of the merged documents")
+        return self
+
+    def apply_changes(self, primary_changes=None, secondary_changes=None):
+        """
+        Patch the store with the changes of a delta sync and rebuild the affected documents only.
+
+        Params:
+        primary_changes -> (changed items, removed ids) of the primary list, None if it did not change
+        secondary_changes -> {secondary name: (changed items, removed ids)} of the secondaries that changed
+
+        Returns the ids of the primary items whose documents were rebuilt or removed.
+        """
+        affected_keys = set()
+        for name, (changed_items, removed_ids) in (secondary_changes or {}).items():
+            for item_id in removed_ids:
+                key = self._remove_secondary(name, self.spec.normalize(item_id))
+                if key is not None:
+                    affected_keys.add(key)
+            for item in changed_items:
+                item_id = self.item_id(item)
+                if item_id is not None:
+                    affected_keys |= self._put_secondary(name, item, item_id)
+
+        affected_ids = set()
+        if primary_changes:
+            changed_items, removed_ids = primary_changes
+            for item_id in removed_ids:
+                item_id = self.spec.normalize(item_id)
+                if item_id in self.primary_items:
+                    self._remove_primary(item_id)
+                    affected_ids.add(item_id)
+            for item in changed_items:
+                item_id = self.item_id(item)
+                if item_id is not None:
+                    self._put_primary(item, item_id)
+                    affected_ids.add(item_id)
+        for key in affected_keys:
+            affected_ids.update(self.primary_ids.get(key, ()))
+
+        # in primary list order, so new documents are appended in the order the full merge yields them
+        for item_id in [item_id for item_id in self.primary_items if item_id in affected_ids]:
+            self._build(item_id)
+        logger.info(f"Rebuilt {len(affected_ids)} of {len(self.documents)} merged documents")
+        return affected_ids
+
+    # ------------------------------
+    # Output
+    # ------------------------------
+    def iter_documents(self):
+        return iter(self.documents.values())
+
+    def iter_json(self, indent=None):
+        """
+        Yield the documents as json array chunks (see blob_stream.iter_json_array). Encoded documents are
+        kept, so after apply_changes only the rebuilt documents are serialized again.
+        """
+        if indent != self._indent:
+            self._encoded.clear()
+            self._indent = indent
+        encoded = self._encoded
+
+        def encoded_documents():
+            for item_id, document in self.documents.items():
+                data = encoded.get(item_id)
+                if data is None:
+                    data = encoded[item_id] = encode_json_element(document, indent)
+                yield data
+
+        return frame_json_array(encoded_documents(), indent)
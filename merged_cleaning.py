@@ -0,0 +1,72 @@
+import logging
+
+logger = logging.getLogger("tt_sharepoint_logger")
+
+UNWANTED_KEYS = ["@odata.context", "@odata.etag", "eTag", "webUrl", "fields@odata.context"]
+
+# marks a value that the cleaning removes from its parent dict or list
+_DROP = object()
+
+
+def convert_numeric_value(data: str):
+    """Converts a numeric string to a number and 'no' to 0, other strings are returned unchanged."""
+    if data.strip().lower() == "no":
+        return 0
+    try:
+        int_val = int(data)
+        if str(int_val) == data:
+            return int_val
+    except ValueError:
+        pass
+    try:
+        float_val = float(data)
+        if "." in data or "e" in data.lower():
+            return float_val
+    except ValueError:
+        pass
+    return data
+
+
+# ------------------------------
+# Fused single pass cleaning
+# ------------------------------
+def _clean_value(value, unwanted_keys):
+    if isinstance(value, dict):
+        cleaned_dict = {}
+        for key, item in value.items():
+            if key in unwanted_keys:
+                continue
+            cleaned_item = _clean_value(item, unwanted_keys)
+            if cleaned_item is not _DROP:
+                cleaned_dict[key] = cleaned_item
+        return cleaned_dict
+    if isinstance(value, list):
+        cleaned_list = []
+        for item in value:
+            cleaned_item = _clean_value(item, unwanted_keys)
+            if cleaned_item is not _DROP:
+                cleaned_list.append(cleaned_item)
+        return cleaned_list
+    if isinstance(value, str):
+        value = value.replace(";", "").replace("#Name?", "Name")
+        if value == "":
+            return _DROP
+        return convert_numeric_value(value)
+    if value is None:
+        return _DROP
+    return value
+
+
+def clean_merged_data(data, unwanted_keys=UNWANTED_KEYS):
+    """
+    Single traversal equivalent of the previous remove_unwanted_fields -> clean_data -> convert_numeric
+    passes (kept as the baseline of benchmarks/bench_merged_cleaning.py).
+
+    Unwanted keys are dropped, strings are stripped of ';' and '#Name?', empty values are removed and
+    numeric strings are converted, all while walking the tree once.
+    """
+    cleaned = _clean_value(data, frozenset(unwanted_keys))
+    if cleaned is _DROP:
+        # the top level value itself is never removed, only returned cleaned
+        return "" if isinstance(data, str) else None
+    return cleaned
@@ -0,0 +1,130 @@
+import os
+import atexit
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain, islice
+from dotenv import load_dotenv
+from data_cleaning_anurag import allowed_columns, clean_and_format_data
+from merged_cleaning import UNWANTED_KEYS, clean_merged_data
+load_dotenv()
+logger = logging.getLogger("tt_sharepoint_logger")
+
+# Worker processes used for cleaning. 1 turns the process pool off.
+CLEANING_WORKERS = int(os.getenv("CLEANING_WORKERS", str(os.cpu_count() or 1)))
+# Items sent to a worker at once.
+CLEANING_CHUNK_SIZE = int(os.getenv("CLEANING_CHUNK_SIZE", "2000"))
+# Inputs with fewer items are cleaned in the calling process, where shipping them to workers costs more
+# than it saves.
+PARALLEL_CLEANING_MIN_ITEMS = int(os.getenv("PARALLEL_CLEANING_MIN_ITEMS", "10000"))
+# "spawn" keeps the workers independent of the threads of the Functions host; "fork" starts faster.
+CLEANING_START_METHOD = os.getenv("CLEANING_START_METHOD", "spawn")
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def get_cleaning_pool(max_workers=CLEANING_WORKERS):
+    """
+    Returns the worker pool shared by all cleaning calls of the process. It is created on first use and
+    kept for warm invocations, so the worker start up is paid once.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != max_workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=max_workers,
+                                        mp_context=multiprocessing.get_context(CLEANING_START_METHOD))
+            _pool_workers = max_workers
+            logger.info(f"Started a cleaning pool with {max_workers} worker processes")
+        return _pool
+
+
+@atexit.register
+def shutdown_cleaning_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def iter_chunks(items, chunk_size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def map_chunks(func, items, chunk_size=CLEANING_CHUNK_SIZE, max_workers=CLEANING_WORKERS,
+               min_items=PARALLEL_CLEANING_MIN_ITEMS):
+    """
+    Apply func (a picklable, module level function taking and returning a list) to chunks of items and
+    yield the resulting lists in the original order.
+
+    The first min_items items are read before deciding: smaller inputs, or max_workers <= 1, run in the
+    calling process. Otherwise chunks go to the process pool with at most two chunks per worker in
+    flight, so a streamed input is never read far ahead.
+
+    Params:
+    func -> function applied to each chunk
+    items -> any iterable, e.g. a generator of sharepoint items
+    chunk_size -> number of items per chunk
+    max_workers -> number of worker processes
+    min_items -> inputs with fewer items are not sent to workers
+    """
+    items = iter(items)
+    head = list(islice(items, min_items))
+    if max_workers <= 1 or len(head) < min_items:
+        # a single chunk, also for lists the chunk based cleaning does not know
+        yield func(list(chain(head, items)))
+        return
+
+    pool = get_cleaning_pool(max_workers)
+    in_flight = deque()
+    for chunk in iter_chunks(chain(head, items), chunk_size):
+        in_flight.append(pool.submit(func, chunk))
+        if len(in_flight) >= max_workers * 2:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
+
+
+def clean_list_chunk(list_type, schema, items):
+    return clean_and_format_data(items, list_type, schema=schema)
+
+
+def clean_list_items(items, list_type, schema=None, **tunables):
+    """
+    Parallel version of clean_and_format_data with the same result: the list of cleaned items,
+    or None for lists without a cleaning schema.
+
+    schema -> discovered schema for lists outside allowed_columns, see clean_and_format_data
+    tunables -> chunk_size, max_workers and min_items of map_chunks
+    """
+    if list_type not in allowed_columns and schema is None:
+        return None
+    cleaned = []
+    for cleaned_chunk in map_chunks(partial(clean_list_chunk, list_type, schema), items, **tunables):
+        cleaned.extend(cleaned_chunk)
+    return cleaned
+
+
+def clean_merged_chunk(unwanted_keys, items):
+    return [clean_merged_data(item, unwanted_keys) for item in items]
+
+
+def iter_clean_merged_items(items, unwanted_keys=UNWANTED_KEYS, **tunables):
+    """
+    Yield clean_merged_data(item) for each merged item in order, cleaning chunks in the worker pool
+    when the input is large enough.
+    """
+    for cleaned_chunk in map_chunks(partial(clean_merged_chunk, tuple(unwanted_keys)), items, **tunables):
+        yield from cleaned_chunk
@@ -0,0 +1,117 @@
+import json
+import hashlib
+import logging
+import threading
+from dotenv import load_dotenv
+from data_cleaning_anurag import compile_schema, normalize_key
+from graph_cache import resolver_cache
+from graph_funcs import GRAPH_BASE_URL, resolve_list
+from graph_transport import graph_transport
+load_dotenv()
+logger = logging.getLogger("tt_sharepoint_logger")
+
+# Properties of the list item itself, next to its fields.
+ITEM_COLUMN_TYPES = {
+    "id": int,
+    "createdDateTime": "date",
+    "lastModifiedDateTime": "date",
+}
+# Converter type per scalar SharePoint column type. "text" only strips, the values are never parsed.
+SCALAR_COLUMN_TYPES = {
+    "text": "text",
+    "choice": "text",
+    "number": float,
+    "currency": float,
+    "dateTime": "date",
+    "boolean": bool,
+}
+
+_compiled_schemas = {}
+_compiled_schemas_lock = threading.Lock()
+
+
+def fetch_list_columns(ACCESS_TOKEN, site_id, list_id):
+    """
+    Returns the column definitions of a list from Graph (/columns). They are kept in the resolver cache,
+    so they are only read again once the cache entry expires.
+    """
+    def fetch_columns():
+        url = f"{GRAPH_BASE_URL}/sites/{site_id}/lists/{list_id}/columns"
+        headers = {"Authorization": f"Bearer {ACCESS_TOKEN}"}
+        columns = []
+        while url:
+            response = graph_transport.get(url, headers=headers)
+            response.raise_for_status()
+            page = response.json()
+            columns.extend(page.get("value", []))
+            url = page.get("@odata.nextLink")
+        return columns
+
+    return resolver_cache.get_or_resolve(("columns", site_id, list_id), fetch_columns)
+
+
+def column_type(column: dict):
+    """
+    Returns (key, type) for a column definition, key being the name the value has in the item fields.
+    Columns without a converter (hyperlinks, images, managed metadata ...) get dict and are kept as they are.
+    """
+    name = normalize_key(column["name"])
+    for facet in ("lookup", "personOrGroup"):
+        if facet in column:
+            settings = column[facet] or {}
+            if settings.get("allowMultipleValues") or settings.get("allowMultipleSelection"):
+                return name, list
+            # single value lookups come as <name>LookupId next to the looked up value
+            return f"{name}LookupId", int
+    if "choice" in column and (column["choice"] or {}).get("displayAs") == "checkBoxes":
+        return name, list
+    if "number" in column and (column["number"] or {}).get("decimalPlaces") == "none":
+        return name, int
+    if "calculated" in column:
+        output_type = (column["calculated"] or {}).get("outputType")
+        return name, SCALAR_COLUMN_TYPES.get(output_type, dict)
+    for facet, expected_type in SCALAR_COLUMN_TYPES.items():
+        if facet in column:
+            return name, expected_type
+    return name, dict
+
+
+def column_types_from_definitions(columns: list):
+    """
+    Map the column definitions of a list to a column schema like rr_columns: {key: type}.
+    Hidden columns are left out.
+    """
+    column_types = dict(ITEM_COLUMN_TYPES)
+    for column in columns:
+        if column.get("hidden"):
+            continue
+        key, expected_type = column_type(column)
+        column_types[key] = expected_type
+    return column_types
+
+
+def schema_version(columns: list):
+    """Hash of the column definitions, it changes whenever a column is added, removed or retyped."""
+    definitions = sorted(json.dumps(column, sort_keys=True) for column in columns)
+    return hashlib.sha1("\n".join(definitions).encode("utf-8")).hexdigest()
+
+
+def discover_list_schema(ACCESS_TOKEN, site_id, list_name: str):
+    """
+    Returns the cleaning schema of a list read from its Graph column definitions:
+    (included keys, compiled converters), as clean_and_format_data takes it.
+
+    The compiled schema is cached by list id and schema version, so it is only compiled again when
+    the list's columns change.
+    """
+    list_id = resolve_list(ACCESS_TOKEN, site_id, list_name)["id"]
+    columns = fetch_list_columns(ACCESS_TOKEN, site_id, list_id)
+    key = (list_id, schema_version(columns))
+    with _compiled_schemas_lock:
+        schema = _compiled_schemas.get(key)
+        if schema is None:
+            column_types = column_types_from_definitions(columns)
+            schema = (list(column_types), compile_schema(column_types))
+            _compiled_schemas[key] = schema
+            logger.info(f"Compiled the schema of '{list_name}' ({len(column_types)} columns, version {key[1][:8]})")
+    return schema
@@ -1,10 +1,11 @@
-import requests
 import logging
 import os
 import io
 from azure.storage.blob import BlobServiceClient
 from azure.core.exceptions import ResourceExistsError
 from dotenv import load_dotenv
+from graph_funcs import resolve_drive_id, resolve_site_id
+from graph_transport import graph_transport
 
 hostname = os.getenv("SITE_HOSTNAME")
 sitepath = os.getenv("SITE_PATH")
@@ -17,12 +18,7 @@ def get_site_id(ACCESS_TOKEN):
     ACCESS_TOKEN -> Required to access sharepoint site
     """
     try:
-        site_id_url = f"https://graph.microsoft.com/v1.0/sites/{hostname}:{sitepath}"
-        headers = {"Authorization": f"Bearer {ACCESS_TOKEN}", "Content-Type": "application/json"}
-        response = requests.get(url=site_id_url, headers=headers)
-        response.raise_for_status()
-        site_info = response.json()
-        site_ids = site_info["id"].split(",")
+        site_ids = resolve_site_id(ACCESS_TOKEN, hostname, sitepath).split(",")
         site_id = site_ids[1]
         return site_id
     except Exception as e:
@@ -38,16 +34,7 @@ def get_drive_id(ACCESS_TOKEN,site_id):
     site_id -> Get the drive id in a specific site
     """
     try:
-        drive_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives"
-        headers = {"Authorization": f"Bearer {ACCESS_TOKEN}", "Content-Type": "application/json"}
-        response = requests.get(url=drive_url,headers=headers)
-        response.raise_for_status()
-        drive_info = response.json()
-
-        for drive in drive_info.get("value"):
-            if drive.get("name") == "Documents":
-                return drive["id"]
-        raise Exception("Drive not found")
+        return resolve_drive_id(ACCESS_TOKEN, site_id, "Documents")
     except Exception as e:
         logging.error(f"{e}")
         raise e
@@ -68,7 +55,7 @@ def download_pptx(ACCESS_TOKEN,file_path):
         drive_id = get_drive_id(ACCESS_TOKEN,site_id)
         file_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drives/{drive_id}/root:/{file_path}:/content"
         headers = {"Authorization": f"Bearer {ACCESS_TOKEN}", "Content-Type": "application/json"}
-        response = requests.get(url=file_url,headers=headers,allow_redirects=True)
+        response = graph_transport.get(file_url,headers=headers,allow_redirects=True)
         if response.status_code == 200:
             pptx_data = response.content
             pptx_file = io.BytesIO(pptx_data)
@@ -0,0 +1,143 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+load_dotenv()
+logger = logging.getLogger("tt_sharepoint_logger")
+
+# Lists are mostly waiting on Graph and blob storage, so a few threads are enough to overlap them.
+SYNC_MAX_WORKERS = int(os.getenv("SYNC_MAX_WORKERS", "4"))
+
+
+class SyncTask:
+    """
+    A unit of work of a sync run.
+
+    Params:
+    name -> unique name, also used in the timing report
+    func -> callable, receives the results of depends_on as positional arguments in that order
+    depends_on -> names of the tasks that must finish first
+    """
+
+    def __init__(self, name, func, depends_on=()):
+        self.name = name
+        self.func = func
+        self.depends_on = list(depends_on)
+
+
+def plan_list_sync(lists_to_be_uploaded: list, compatible_lists: list):
+    """
+    Work out which lists a sync has to fetch and which merged outputs it has to build.
+
+    Every list named in lists_to_be_uploaded or needed by one of their merges is fetched and cleaned
+    exactly once; each merge of compatible_lists that involves an uploaded list is built once from
+    those cleaned results.
+
+    Returns {"lists": [list names in fetch order], "merges": [compatible lists to merge]}.
+    """
+    merges = []
+    for compatible_list in compatible_lists:
+        if any(list_name in compatible_list for list_name in lists_to_be_uploaded) and compatible_list not in merges:
+            merges.append(compatible_list)
+    lists = list(dict.fromkeys(lists_to_be_uploaded))
+    for compatible_list in merges:
+        for list_name in compatible_list:
+            if list_name not in lists:
+                lists.append(list_name)
+    return {"lists": lists, "merges": merges}
+
+
+def critical_path(tasks: dict, timings: dict):
+    """
+    Returns (task names, seconds) of the longest chain of dependent task durations.
+    """
+    finish = {}
+    previous = {}
+
+    def chain_finish(name):
+        if name not in finish:
+            deps = [d for d in tasks[name].depends_on if d in timings]
+            slowest = max(deps, key=chain_finish, default=None)
+            previous[name] = slowest
+            finish[name] = timings[name]["seconds"] + (chain_finish(slowest) if slowest else 0.0)
+        return finish[name]
+
+    if not timings:
+        return [], 0.0
+    last = max(timings, key=chain_finish)
+    path = []
+    name = last
+    while name:
+        path.append(name)
+        name = previous[name]
+    return list(reversed(path)), finish[last]
+
+
+def log_timings(tasks: dict, timings: dict, total_seconds: float):
+    for name, timing in sorted(timings.items(), key=lambda t: t[1]["start"]):
+        logger.info(f"[sync] {name}: started at +{timing['start']:.2f}s, took {timing['seconds']:.2f}s ({timing['status']})")
+    path, path_seconds = critical_path(tasks, timings)
+    logger.info(f"[sync] total {total_seconds:.2f}s, critical path {' -> '.join(path)} ({path_seconds:.2f}s)")
+
+
+def run_sync_tasks(tasks: list, max_workers=SYNC_MAX_WORKERS):
+    """
+    Run tasks on a bounded thread pool, starting each one as soon as the tasks it depends on are done.
+
+    If a task fails, the tasks depending on it are skipped, the other tasks still run and the first
+    error is raised once everything has settled.
+
+    Returns (results, timings): {name: result} and {name: {"start", "seconds", "status"}}.
+    """
+    tasks = {task.name: task for task in tasks}
+    for task in tasks.values():
+        missing = [d for d in task.depends_on if d not in tasks]
+        if missing:
+            raise ValueError(f"Task '{task.name}' depends on unknown tasks {missing}")
+
+    results = {}
+    timings = {}
+    errors = {}
+    skipped = set()
+    waiting = dict(tasks)
+    running = {}
+    run_start = time.perf_counter()
+
+    def timed(task, args):
+        start = time.perf_counter()
+        try:
+            return task.func(*args)
+        finally:
+            timings[task.name] = {"start": start - run_start, "seconds": time.perf_counter() - start}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while waiting or running:
+            for name, task in list(waiting.items()):
+                if any(d in errors or d in skipped for d in task.depends_on):
+                    skipped.add(name)
+                    del waiting[name]
+                    logger.warning(f"[sync] skipping '{name}' because a task it depends on failed")
+                elif all(d in results for d in task.depends_on):
+                    args = [results[d] for d in task.depends_on]
+                    running[executor.submit(timed, task, args)] = name
+                    del waiting[name]
+            if not running:
+                if waiting:
+                    raise ValueError(f"Dependency cycle between tasks {list(waiting)}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                    timings[name]["status"] = "ok"
+                except Exception as e:
+                    errors[name] = e
+                    timings[name]["status"] = "failed"
+                    logger.error(f"[sync] '{name}' failed: {e}")
+
+    log_timings(tasks, timings, time.perf_counter() - run_start)
+    if errors:
+        raise next(iter(errors.values()))
+    return results, timings
@@ -0,0 +1,46 @@
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from delta_sync_funcs import apply_changes
+from merge_engine import JoinSpec, SecondaryJoin, hash_join
+from merge_store import MergedDocumentStore
+
+SPEC = JoinSpec(primary_key="id", secondaries=[SecondaryJoin("Mitigations", key="RiskId")])
+
+
+def random_lists(rng, n_risks):
+    risks = [{"id": risk_id, "Status": rng.choice(["Open", "Closed"])} for risk_id in range(1, n_risks + 1)]
+    mitigations = [{"id": 1000 + index, "RiskId": rng.randint(1, n_risks + 5)} for index in range(n_risks * 2)]
+    return risks, mitigations
+
+
+def random_delta(rng, items, new_item, next_id):
+    """Edited, added and removed items like a delta sync reports them, removed ids as strings."""
+    changed = [{**item, "Status": "Edited"} for item in rng.sample(items, rng.randint(0, min(3, len(items))))]
+    for _ in range(rng.randint(0, 4)):
+        changed.append(new_item(next_id()))
+    changed_ids = {str(item["id"]) for item in changed}
+    removed = {str(item["id"]) for item in rng.sample(items, rng.randint(0, min(2, len(items))))} - changed_ids
+    return changed, removed
+
+
+def test_patched_store_matches_full_merge():
+    rng = random.Random(7)
+    ids = iter(range(10000, 100000))
+    for _ in range(300):
+        risks, mitigations = random_lists(rng, rng.randint(1, 12))
+        store = MergedDocumentStore(SPEC).load(risks, {"Mitigations": mitigations})
+        for _ in range(3):
+            risk_changes = random_delta(rng, risks, lambda item_id: {"id": item_id, "Status": "New"},
+                                        lambda: next(ids))
+            mitigation_changes = random_delta(
+                rng, mitigations,
+                lambda item_id: {"id": item_id, "RiskId": rng.choice([risk["id"] for risk in risks + risk_changes[0]] or [0])},
+                lambda: next(ids))
+            risks = apply_changes(risks, *risk_changes)
+            mitigations = apply_changes(mitigations, *mitigation_changes)
+            store.apply_changes(risk_changes, {"Mitigations": mitigation_changes})
+            assert list(store.iter_documents()) == list(hash_join(SPEC, risks, {"Mitigations": mitigations}))
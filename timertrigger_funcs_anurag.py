@@ -1,19 +1,41 @@
 
-import json
-import requests
+import json_codec
 import logging
 from azure.storage.blob import BlobServiceClient
-from azure.core.exceptions import ResourceExistsError
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
 from dotenv import load_dotenv
-from data_cleaning_anurag import merge_lists,clean_and_format_data
+from data_cleaning_anurag import allowed_columns,clean_and_format_data,RISK_MITIGATIONS_JOIN
+from graph_funcs import BatchedListPages, iter_list_items, resolve_site_id, DEFAULT_PAGE_SIZE
+from graph_transport import log_transport_stats
+from blob_stream import BlockBlobWriter, json_indent, tee_json_array, upload_json_array, upload_json_stream
+from merge_store import MergedDocumentStore
+from parallel_cleaning import clean_list_items
+from schema_discovery import discover_list_schema
+from sync_engine import SYNC_MAX_WORKERS, SyncTask, plan_list_sync, run_sync_tasks
+from delta_sync_funcs import (DeltaResyncRequired, apply_changes, download_json_blob, fetch_deltas_batched,
+                              get_latest_delta_link, load_delta_link, save_delta_link)
 from typing import Any
 import os
+import threading
 load_dotenv()
 logger = logging.getLogger("tt_sharepoint_logger")
 
 hostname = os.getenv("SITE_HOSTNAME")
 sitepath = os.getenv("SITE_PATH")
 CONNECTION_STRING= os.getenv("Azure_CONNECTION_STRING")
+# "delta" (default) or "full"
+SYNC_MODE = os.getenv("SHAREPOINT_SYNC_MODE", "delta").lower()
+
+LISTS_TO_BE_UPLOADED = ["Risk Register", "Risk Mitigations", "Follow up"]
+#define what lists are compatible for merging
+COMPATIBLE_LISTS = [
+    ["Risk Register","Risk Mitigations"]
+]
+
+# Merged documents of the last merged blob written by this worker, {(container, blob): (etag, store)}.
+# A delta sync patches them instead of merging both cleaned lists again.
+_merged_stores = {}
+_merged_stores_lock = threading.Lock()
 
 
 
@@ -27,35 +49,64 @@ def get_site_id(ACCESS_TOKEN):
     Get site ID by calling the Microsoft Graph API.
     """
     try:
-        site_id_url = f"https://graph.microsoft.com/v1.0/sites/{hostname}:{sitepath}"
-        headers = {"Authorization": f"Bearer {ACCESS_TOKEN}", "Content-Type": "application/json"}
-        response = requests.get(url=site_id_url, headers=headers)
-        response.raise_for_status()
-        site_info = response.json()
-        site_ids = site_info["id"].split(",")
+        site_ids = resolve_site_id(ACCESS_TOKEN, hostname, sitepath).split(",")
         site_id = site_ids[1]
         return site_id
     except Exception as e:
         logger.error(f"Error getting site ID: {e}")
         raise e
 
-def get_list_details(ACCESS_TOKEN,list_name: str):
+def get_list_details(ACCESS_TOKEN,list_name: str, page_size=DEFAULT_PAGE_SIZE):
     """
-    Fetch list details from SharePoint using the Microsoft Graph API.
+    Yield the items of a sharepoint list using the Microsoft Graph API.
+    Pages are requested lazily and @odata.nextLink is followed until the list is exhausted.
     """
     try:
         site_id = get_site_id(ACCESS_TOKEN)
-        url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/lists/{list_name}/items?expand=fields"
-        headers = {"Authorization": f"Bearer {ACCESS_TOKEN}"}
-        response = requests.get(url, headers=headers)
-        logger.debug(f"Response status: {response.status_code}")
-        response.raise_for_status()
-        items = response.json().get("value", [])
-        return json.dumps(items)
+        yield from iter_list_items(ACCESS_TOKEN, site_id, list_name, page_size, select_columns=True)
     except Exception as e:
         logger.error(f"Error getting list details for '{list_name}': {e}")
         raise e
 
+def get_cleaning_schema(ACCESS_TOKEN, list_name: str):
+    """
+    Returns the schema discovered from Graph for lists without a hand written one in data_cleaning_anurag,
+    None for the others or when the discovery fails (the list is then uploaded uncleaned as before).
+    """
+    if list_name in allowed_columns:
+        return None
+    try:
+        return discover_list_schema(ACCESS_TOKEN, get_site_id(ACCESS_TOKEN), list_name)
+    except Exception as e:
+        logger.warning(f"Could not discover the columns of '{list_name}', it is not cleaned: {e}")
+        return None
+
+def fetch_and_clean_list(ACCESS_TOKEN, list_name: str, prefetched=None, archive=None):
+    """
+    Stream a sharepoint list through clean_and_format_data, large lists are cleaned in chunks on the
+    worker processes of parallel_cleaning.
+    If `prefetched` (graph_funcs.BatchedListPages) fetches the list, its pages are cleaned as they arrive
+    and no request is made. With `archive` (blob_stream.BlockBlobWriter) the raw items are written to it
+    as a json array on the way, they are not kept.
+
+    Returns the cleaned items, None for lists without a cleaning schema.
+    """
+    if prefetched is not None and list_name in prefetched:
+        source = prefetched.iter_items(list_name)
+    else:
+        source = get_list_details(ACCESS_TOKEN, list_name)
+    items = tee_json_array(source, archive, json_indent()) if archive is not None else source
+    try:
+        cleaned = clean_list_items(items, list_name, schema=get_cleaning_schema(ACCESS_TOKEN, list_name))
+        # lists without a cleaning schema are not consumed by clean_and_format_data
+        for _ in items:
+            pass
+    finally:
+        if prefetched is not None:
+            # the batched fetch stops waiting on this list, also when the cleaning failed
+            prefetched.close(list_name)
+    return cleaned
+
 def create_blob_container(blob_service_client: BlobServiceClient, container_name: str):
     """
     Create a blob container or return the existing container client if it exists.
@@ -75,84 +126,265 @@ def upload_list_to_blob(data,container_name: str,blob_filename:str):
     """
     Retrieve, clean, merge data from SharePoint lists and upload the merged JSON to Azure Blob Storage.
     Cleaning should not be done for blob storage. That should be done after downloading from blob storage.
+
+    data is the list of items; it is serialized here, once, while it is streamed into staged blocks.
+    Already serialized str/bytes data is uploaded as is.
     """
     blob_service_client = BlobServiceClient.from_connection_string(CONNECTION_STRING)
     blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_filename) 
 
+    if isinstance(data, list):
+        upload_json_array(blob_client, data)
+        return
+    if not isinstance(data, (str, bytes)):
+        data = json_codec.dumps(data)
     blob_client.upload_blob(data=data,overwrite=True)
 
+def upload_list(ACCESS_TOKEN,list_name: str,container_name: str,prefetched=None):
+    """
+    Fetch a sharepoint list, upload the uncleaned and cleaned versions to blob and return the cleaned items.
+    The uncleaned items are streamed into the staged blocks of their blob while they are cleaned.
+    """
+    formatted_list_name = list_name.replace(" ","_") #Remove whitespace and replace with underscore
+    blob_service_client = BlobServiceClient.from_connection_string(CONNECTION_STRING)
+    # upload uncleaned data, only the cleaned columns when graph_funcs.SELECT_COLUMNS is on
+    archive = BlockBlobWriter(blob_service_client.get_blob_client(
+        container=container_name, blob=f"uncleaned_lists/{formatted_list_name}.json"))
+    cleaned = fetch_and_clean_list(ACCESS_TOKEN,list_name,prefetched,archive)
+    archive.commit()
+    # upload cleaned data
+    upload_list_to_blob(cleaned,container_name,f"cleaned_lists/{formatted_list_name}.json")
+    return cleaned
+
+def merged_blob_name(compatible_list):
+    item1_name = compatible_list[0].replace(" ","_")
+    item2_name = compatible_list[1].replace(" ","_")
+    return f"cleaned_lists/{item1_name}_{item2_name}_merged.json"
+
+def upload_merged_store(store: MergedDocumentStore,container_name: str,blob_filename: str):
+    """
+    Upload the documents of a merge store and keep the store for the next delta sync of this worker,
+    together with the etag of the blob it wrote.
+    """
+    blob_service_client = BlobServiceClient.from_connection_string(CONNECTION_STRING)
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_filename)
+    # the etag of the commit itself, a later read could return the version of another writer
+    etag = upload_json_stream(blob_client, store.iter_json(json_indent()))
+    with _merged_stores_lock:
+        _merged_stores[(container_name, blob_filename)] = (etag, store)
+
+def get_merged_store(container_name: str,blob_filename: str):
+    """
+    Returns the store this worker last uploaded to the blob, None if there is none or the blob was
+    written by someone else since (its etag changed).
+    """
+    with _merged_stores_lock:
+        cached = _merged_stores.get((container_name, blob_filename))
+    if cached is None:
+        return None
+    etag, store = cached
+    blob_service_client = BlobServiceClient.from_connection_string(CONNECTION_STRING)
+    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_filename)
+    try:
+        if blob_client.get_blob_properties().etag == etag:
+            return store
+    except ResourceNotFoundError:
+        pass
+    logger.info(f"{blob_filename} changed since this worker wrote it. Merging the stored lists again.")
+    with _merged_stores_lock:
+        _merged_stores.pop((container_name, blob_filename), None)
+    return None
+
+def upload_merged_blob(compatible_list,container_name,l1_cleaned,l2_cleaned):
+    """
+    Merge two cleaned lists and upload the result to cleaned_lists/<list1>_<list2>_merged.json.
+    The merged documents are kept per risk, so the following delta syncs only rebuild the changed ones.
+    """
+    store = MergedDocumentStore(RISK_MITIGATIONS_JOIN).load(l1_cleaned, {"Mitigations": l2_cleaned})
+    upload_merged_store(store,container_name,merged_blob_name(compatible_list))
+    return list(store.iter_documents())
+
 def upload_merged_data(ACCESS_TOKEN,compatible_list,container_name):
     #list1
-    l1 = get_list_details(ACCESS_TOKEN,compatible_list[0])
-    item1_name = compatible_list[0].replace(" ","_")
-    # upload uncleaned list data
-    upload_list_to_blob(l1,container_name,f"uncleaned_lists/{item1_name}.json")
-    # upload cleaned list data
-    l1_cleaned = clean_and_format_data(json.loads(l1),compatible_list[0])
-    upload_list_to_blob(l1_cleaned,container_name,f"cleaned_lists/{item1_name}.json")
-    
-    
+    l1_cleaned = upload_list(ACCESS_TOKEN,compatible_list[0],container_name)
     #list2
-    l2 = get_list_details(ACCESS_TOKEN,compatible_list[1])
-    item2_name = compatible_list[1].replace(" ","_")
-    # uncleaned list data
-    upload_list_to_blob(l2,container_name,f"uncleaned_lists/{item2_name}.json")
-    # upload cleaned list data
-    l2_cleaned = clean_and_format_data(json.loads(l2),compatible_list[1])
-    upload_list_to_blob(l2_cleaned,container_name,f"cleaned_lists/{item2_name}.json")
+    l2_cleaned = upload_list(ACCESS_TOKEN,compatible_list[1],container_name)
 
-    
-    merged_data = merge_lists(json.loads(l1_cleaned), json.loads(l2_cleaned))  
-    upload_list_to_blob(merged_data,container_name,f"cleaned_lists/{item1_name}_{item2_name}_merged.json")
+    return upload_merged_blob(compatible_list,container_name,l1_cleaned,l2_cleaned)
 
-    return merged_data
 def upload(ACCESS_TOKEN,container_name:str, list1_name: str) -> Any: 
     
-    
-    #define what lists are compatible for merging
-    compatible_lists = [
-        ["Risk Register","Risk Mitigations"]
-    ]
-    
-
     # if list can be merged then upload the merged list
-    for item in compatible_lists:
+    for item in COMPATIBLE_LISTS:
         if list1_name in item:
             upload_merged_data(ACCESS_TOKEN,item,container_name)
             return
     
     
     # upload the list if it cannot be merged
-    l1 = get_list_details(ACCESS_TOKEN,list1_name)
     logging.info(f"{list1_name} cannot be merged with any other list. Uploading {list1_name} to blob.....")
-    l1_cleaned = clean_and_format_data(json.loads(l1),list1_name)
-    formatted_list1_name = list1_name.replace(" ","_") #Remove whitespace and replace with underscore
-    # upload uncleaned data
-    upload_list_to_blob(l1,container_name,f"uncleaned_lists/{formatted_list1_name}.json")
-    # upload cleaned data
-    upload_list_to_blob(l1_cleaned,container_name,f"cleaned_lists/{formatted_list1_name}.json")
+    upload_list(ACCESS_TOKEN,list1_name,container_name)
                 
     return 
     
 
+def full_sync_sharepoint_lists(ACCESS_TOKEN,container_name,lists_to_be_uploaded):
+    """
+    Fetch, clean and upload every planned list exactly once and build each merged blob from those
+    cleaned results, so lists that take part in a merge are not downloaded a second time.
+    """
+    plan = plan_list_sync(lists_to_be_uploaded,COMPATIBLE_LISTS)
+    # all lists are paged together with $batch, each one is cleaned and uploaded as its pages arrive
+    pages = BatchedListPages(ACCESS_TOKEN,get_site_id(ACCESS_TOKEN),plan["lists"],select_columns=True)
+    tasks = []
+    for list_name in plan["lists"]:
+        tasks.append(SyncTask(
+            f"upload {list_name}",
+            lambda list_name=list_name: upload_list(ACCESS_TOKEN,list_name,container_name,pages)
+        ))
+    for compatible_list in plan["merges"]:
+        tasks.append(SyncTask(
+            f"merge {' + '.join(compatible_list)}",
+            lambda l1_cleaned, l2_cleaned, compatible_list=compatible_list: upload_merged_blob(
+                compatible_list,container_name,l1_cleaned,l2_cleaned),
+            depends_on=[f"upload {list_name}" for list_name in compatible_list]
+        ))
+    # the batched fetch waits on the slowest list, so every list is consumed at the same time
+    run_sync_tasks(tasks,max_workers=max(SYNC_MAX_WORKERS,len(plan["lists"])))
+
+# ------------------------------
+# Delta sync
+# ------------------------------
+def full_sync_list(ACCESS_TOKEN,site_id,list_name: str,container_name: str):
+    """
+    Upload the whole list and store a delta link for the following runs.
+    The delta link is requested before the items so nothing changed during the upload is lost.
+    """
+    delta_link = get_latest_delta_link(ACCESS_TOKEN,site_id,list_name)
+    upload_list(ACCESS_TOKEN,list_name,container_name)
+    save_delta_link(container_name,list_name,delta_link)
 
+def delta_sync_list(ACCESS_TOKEN,site_id,list_name: str,container_name: str,delta_result=None) -> bool:
+    """
+    Patch the uncleaned and cleaned blobs of a list with the changes since the last run.
+
+    delta_result is the list's entry from fetch_deltas_batched; None means the list has no stored delta link.
+    Falls back to a full sync when the list has no stored delta link, its blobs are missing or
+    Graph asks for a resync.
 
-def upload_sharepoint_lists(ACCESS_TOKEN,container_name):
+    Returns (cleaned changed items, removed ids) when the stored list was patched, True when it was
+    replaced by a full sync and False when nothing changed.
+    """
+    formatted_list_name = list_name.replace(" ","_")
+    raw_blob = f"uncleaned_lists/{formatted_list_name}.json"
+    cleaned_blob = f"cleaned_lists/{formatted_list_name}.json"
+
+    if delta_result is None:
+        logger.info(f"No delta link stored for '{list_name}'. Running a full sync.")
+        full_sync_list(ACCESS_TOKEN,site_id,list_name,container_name)
+        return True
+
+    if isinstance(delta_result, DeltaResyncRequired):
+        logger.warning(f"{delta_result}. Running a full sync of '{list_name}'.")
+        full_sync_list(ACCESS_TOKEN,site_id,list_name,container_name)
+        return True
+    changed_items, removed_ids, new_delta_link = delta_result
+
+    if not changed_items and not removed_ids:
+        logger.info(f"No changes in '{list_name}' since the last run.")
+        save_delta_link(container_name,list_name,new_delta_link)
+        return False
+
+    raw_items = download_json_blob(container_name,raw_blob)
+    cleaned_items = download_json_blob(container_name,cleaned_blob)
+    if raw_items is None or cleaned_items is None:
+        logger.info(f"Stored blobs for '{list_name}' are missing. Running a full sync.")
+        full_sync_list(ACCESS_TOKEN,site_id,list_name,container_name)
+        return True
+
+    logger.info(f"Patching '{list_name}': {len(changed_items)} added or changed, {len(removed_ids)} removed.")
+    cleaned_changes = clean_and_format_data(changed_items,list_name,schema=get_cleaning_schema(ACCESS_TOKEN,list_name))
+    upload_list_to_blob(apply_changes(raw_items,changed_items,removed_ids),container_name,raw_blob)
+    upload_list_to_blob(apply_changes(cleaned_items,cleaned_changes,removed_ids),container_name,cleaned_blob)
+    save_delta_link(container_name,list_name,new_delta_link)
+    return cleaned_changes, removed_ids
+
+def delta_sync_sharepoint_lists(ACCESS_TOKEN,container_name,lists_to_be_uploaded):
+    """
+    Sync the lists with Graph delta queries and rebuild merged blobs whose inputs changed.
+    The merge reads the patched cleaned blobs, so no unchanged list is fetched from sharepoint.
+    """
+    site_id = get_site_id(ACCESS_TOKEN)
+    plan = plan_list_sync(lists_to_be_uploaded,COMPATIBLE_LISTS)
+    delta_links = {}
+    for list_name in plan["lists"]:
+        delta_link = load_delta_link(container_name,list_name)
+        if delta_link:
+            delta_links[list_name] = delta_link
+
+    # the delta links of all lists are followed together with $batch, then every list is patched
+    # in parallel and each merged blob is rebuilt once the lists it depends on are done
+    tasks = [SyncTask("fetch deltas", lambda: fetch_deltas_batched(ACCESS_TOKEN,delta_links))]
+    for list_name in plan["lists"]:
+        tasks.append(SyncTask(
+            f"sync {list_name}",
+            lambda delta_results, list_name=list_name: delta_sync_list(
+                ACCESS_TOKEN,site_id,list_name,container_name,delta_results.get(list_name)),
+            depends_on=["fetch deltas"]
+        ))
+    for compatible_list in plan["merges"]:
+        tasks.append(SyncTask(
+            f"merge {' + '.join(compatible_list)}",
+            lambda *changes, compatible_list=compatible_list: any(changes) and merge_stored_lists(
+                ACCESS_TOKEN,compatible_list,container_name,changes),
+            depends_on=[f"sync {list_name}" for list_name in compatible_list]
+        ))
+    run_sync_tasks(tasks)
+
+def merge_stored_lists(ACCESS_TOKEN,compatible_list,container_name,changes=None):
+    """
+    Bring a merged blob up to date with the changes of its lists.
+
+    changes holds the delta_sync_list result of each list of compatible_list. When every list was
+    patched or unchanged and this worker still holds the merged documents it last uploaded, only the
+    risks touched by the changes are merged again. Otherwise the blob is rebuilt from the cleaned
+    blobs of its lists.
+    """
+    blob_filename = merged_blob_name(compatible_list)
+    if changes and True not in changes:
+        store = get_merged_store(container_name,blob_filename)
+        if store is not None:
+            primary_changes, secondary_changes = changes[0] or None, changes[1] or None
+            store.apply_changes(primary_changes, {"Mitigations": secondary_changes} if secondary_changes else None)
+            upload_merged_store(store,container_name,blob_filename)
+            return list(store.iter_documents())
+
+    cleaned = []
+    for list_name in compatible_list:
+        cleaned_blob = f"cleaned_lists/{list_name.replace(' ','_')}.json"
+        cleaned_items = download_json_blob(container_name,cleaned_blob)
+        if cleaned_items is None:
+            # the list is merged but not synced on its own
+            cleaned_items = upload_list(ACCESS_TOKEN,list_name,container_name)
+        cleaned.append(cleaned_items)
+    return upload_merged_blob(compatible_list,container_name,cleaned[0],cleaned[1])
+
+
+def upload_sharepoint_lists(ACCESS_TOKEN,container_name,sync_mode=SYNC_MODE):
     """
     Fetch predefined lists and upload it to blob
 
     Params:
     ACCESS_TOKEN-> required to access sharepoint list data
     container_name -> name of your blob container
+    sync_mode -> "delta" patches the stored blobs with the changes since the last run,
+                 "full" re-downloads and re-uploads every list
     """
 
-   
-    
-    lists_to_be_uploaded = ["Risk Register", "Risk Mitigations", "Follow up"]
-
-    # get data from sharepoint
-    for list_name in lists_to_be_uploaded:
-        
-        upload(ACCESS_TOKEN,container_name,list_name)
+    if sync_mode == "delta":
+        delta_sync_sharepoint_lists(ACCESS_TOKEN,container_name,LISTS_TO_BE_UPLOADED)
+    else:
+        full_sync_sharepoint_lists(ACCESS_TOKEN,container_name,LISTS_TO_BE_UPLOADED)
 
+    log_transport_stats()
     return
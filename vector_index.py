@@ -0,0 +1,253 @@
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from embedding_store import EmbeddingSidecar, SidecarVersionMismatch, download_sidecar
+load_dotenv()
+logger = logging.getLogger("tt_sharepoint_logger")
+
+# "brute" scores every vector, "ivf" only the clusters closest to the query, "auto" picks ivf from IVF_MIN_ROWS.
+VECTOR_INDEX_MODE = os.getenv("VECTOR_INDEX_MODE", "auto").lower()
+VECTOR_INDEX_MODES = ("brute", "ivf", "auto")
+IVF_MIN_ROWS = int(os.getenv("IVF_MIN_ROWS", "50000"))
+# Clusters searched per query in ivf mode, more is slower and finds more of the exact top k.
+IVF_PROBES = int(os.getenv("IVF_PROBES", "8"))
+IVF_TRAIN_ITERATIONS = int(os.getenv("IVF_TRAIN_ITERATIONS", "10"))
+IVF_TRAIN_SAMPLE_PER_LIST = 64
+# Sidecars are downloaded below this directory, one sub directory per blob version.
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join(tempfile.gettempdir(), "vector_index"))
+# A sidecar caught between the upload of its matrix and of its index is downloaded again this many times.
+SIDECAR_LOAD_ATTEMPTS = 3
+SIDECAR_RETRY_SECONDS = 2
+# Rows multiplied at a time, bounds the float32 copy of float16/int8 vectors during a brute force search.
+SEARCH_BLOCK_ROWS = 16384
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k(scores, k):
+    """Positions of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+class VectorIndex:
+    """
+    Top k cosine similarity search over one embedding field of an EmbeddingSidecar.
+
+    In brute mode the query is multiplied with the rows of the field only, copied out of the sidecar
+    once in the stored dtype (read straight from the memory map when the sidecar holds nothing else). In ivf mode the rows are clustered with spherical k-means when the index is built
+    and a query is only compared with the rows of the n_probe clusters whose centroids are closest.
+
+    Params:
+    sidecar -> EmbeddingSidecar, see embedding_store.load_sidecar
+    field -> embedding field searched, e.g. "Title"
+    mode -> "brute", "ivf" or "auto"
+    n_lists -> number of ivf clusters, about sqrt(rows) when None
+    n_probe -> clusters searched per ivf query
+    """
+
+    def __init__(self, sidecar: EmbeddingSidecar, field="Title", mode=VECTOR_INDEX_MODE, n_lists=None,
+                 n_probe=IVF_PROBES, seed=0):
+        self.sidecar = sidecar
+        self.field = field
+        references = [(document_id, fields[field]) for document_id, fields in sidecar.index.items() if field in fields]
+        self.ids = [document_id for document_id, _ in references]
+        self.rows = np.array([row for _, row in references], dtype=np.int64)
+        if mode not in VECTOR_INDEX_MODES:
+            raise ValueError(f"Unknown vector index mode '{mode}', use brute, ivf or auto")
+        if mode == "auto":
+            mode = "ivf" if len(self.rows) >= IVF_MIN_ROWS else "brute"
+        self.mode = mode
+        self.n_probe = n_probe
+        if mode == "brute":
+            self.vectors, self.scales = self._field_rows()
+            self.inverse_norms = 1.0 / np.maximum(self._row_norms(), 1e-12)
+        else:
+            self._train_ivf(n_lists or max(int(np.sqrt(len(self.rows))), 1), seed)
+        logger.info(f"Vector index over {len(self.rows)} '{field}' embeddings built in {self.mode} mode")
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _field_rows(self):
+        """The vectors and int8 scales of the field's rows, in the stored dtype and in the order of self.ids."""
+        vectors, scales = self.sidecar.vectors, self.sidecar.scales
+        if np.array_equal(self.rows, np.arange(len(vectors))):
+            return vectors, scales
+        return vectors[self.rows], scales[self.rows] if scales is not None else None
+
+    def _blocks(self):
+        """Yield (start, float32 block) of the field's rows, int8 rows scaled back."""
+        vectors, scales = self.vectors, self.scales
+        for start in range(0, len(vectors), SEARCH_BLOCK_ROWS):
+            block = vectors[start:start + SEARCH_BLOCK_ROWS]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)
+            if scales is not None:
+                block = block * scales[start:start + SEARCH_BLOCK_ROWS, None]
+            yield start, block
+
+    def _row_norms(self):
+        norms = np.empty(len(self.vectors), dtype=np.float32)
+        for start, block in self._blocks():
+            norms[start:start + len(block)] = np.linalg.norm(block, axis=1)
+        return norms
+
+    def _assign(self, matrix, centroids):
+        return np.concatenate([np.argmax(matrix[start:start + SEARCH_BLOCK_ROWS] @ centroids.T, axis=1)
+                               for start in range(0, len(matrix), SEARCH_BLOCK_ROWS)] or [np.zeros(0, np.int64)])
+
+    def _train_ivf(self, n_lists, seed):
+        vectors, scales = self._field_rows()
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if scales is not None:
+            matrix = matrix * scales[:, None]
+        matrix = normalize_rows(matrix)
+        n_lists = min(n_lists, max(len(matrix), 1))
+        rng = np.random.default_rng(seed)
+        # spherical k-means on a sample, IVF_TRAIN_SAMPLE_PER_LIST rows per cluster are plenty
+        sample = matrix[rng.choice(len(matrix), min(len(matrix), n_lists * IVF_TRAIN_SAMPLE_PER_LIST), replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)] if len(sample) else sample
+        for _ in range(IVF_TRAIN_ITERATIONS if len(sample) else 0):
+            assignment = self._assign(sample, centroids)
+            counts = np.bincount(assignment, minlength=n_lists)
+            order = np.argsort(assignment, kind="stable")
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            filled = counts > 0
+            # empty clusters keep their previous centroid
+            sums = centroids.copy()
+            sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+            centroids = normalize_rows(sums)
+
+        # rows of each cluster are stored next to each other, so a probe reads one slice
+        assignment = self._assign(matrix, centroids)
+        order = np.argsort(assignment, kind="stable")
+        self.centroids = centroids
+        self.list_vectors = matrix[order]
+        self.list_positions = order
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=len(centroids)))])
+
+    def search(self, query, k=10):
+        """
+        Returns the k most similar documents as [(document id, cosine similarity)], most similar first.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if query.ndim != 1 or query.shape[0] != self.sidecar.dimensions:
+            raise ValueError(f"Query has {query.shape[-1] if query.ndim else 0} dimensions, "
+                             f"the index {self.sidecar.dimensions}")
+        norm = np.linalg.norm(query)
+        if norm == 0 or not len(self.rows):
+            return []
+        query = query / norm
+        if self.mode == "brute":
+            scores = np.empty(len(self.rows), dtype=np.float32)
+            for start, block in self._blocks():
+                scores[start:start + len(block)] = block @ query
+            scores *= self.inverse_norms
+            best = top_k(scores, k)
+            return [(self.ids[position], float(scores[position])) for position in best]
+
+        probes = top_k(self.centroids @ query, self.n_probe)
+        slices = [(self.list_offsets[probe], self.list_offsets[probe + 1]) for probe in probes]
+        candidates = np.concatenate([np.arange(start, end) for start, end in slices])
+        scores = np.concatenate([self.list_vectors[start:end] @ query for start, end in slices])
+        best = top_k(scores, k)
+        return [(self.ids[self.list_positions[candidates[position]]], float(scores[position])) for position in best]
+
+
+# Sidecars and indexes of this worker, they stay loaded across warm invocations and are replaced when the
+# sidecar blob changes. A sidecar is downloaded once per blob version and shared by the indexes of its fields.
+# {(container, index blob): (etag, directory, EmbeddingSidecar, fields)}
+_sidecars = {}
+# {(container, index blob, field, mode): (etag, VectorIndex)}
+_indexes = {}
+_indexes_lock = threading.Lock()
+# one lock per sidecar or index key, so a download or an ivf training only blocks the callers waiting for it
+_key_locks = {}
+
+
+def _key_lock(key):
+    with _indexes_lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def get_sidecar(npy_blob_client, index_blob_client, etag, directory=VECTOR_INDEX_DIR):
+    """
+    Returns (EmbeddingSidecar, set of its fields) of the blob version etag, downloading it only when this
+    worker does not hold that version yet.
+    """
+    key = (index_blob_client.container_name, index_blob_client.blob_name)
+    with _key_lock(key):
+        cached = _sidecars.get(key)
+        if cached and cached[0] == etag:
+            return cached[2], cached[3]
+        # a new version goes into its own directory, the files of the old one may still be memory mapped
+        name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+        version = etag.strip('"')
+        version_directory = os.path.join(directory, f"{name}-{version}")
+        os.makedirs(version_directory, exist_ok=True)
+        try:
+            sidecar = download_sidecar(npy_blob_client, index_blob_client, version_directory)
+        except SidecarVersionMismatch:
+            shutil.rmtree(version_directory, ignore_errors=True)
+            raise
+        fields = {field for references in sidecar.index.values() for field in references}
+        with _indexes_lock:
+            _sidecars[key] = (etag, version_directory, sidecar, fields)
+            # the indexes of the old version are built again from the new sidecar when they are asked for
+            for index_key in [index_key for index_key in _indexes if index_key[:2] == key]:
+                del _indexes[index_key]
+    if cached:
+        # open memory maps keep the unlinked files readable until the old indexes are gone
+        shutil.rmtree(cached[1], ignore_errors=True)
+    return sidecar, fields
+
+
+def get_vector_index(npy_blob_client, index_blob_client, field="Title", mode=VECTOR_INDEX_MODE,
+                     directory=VECTOR_INDEX_DIR):
+    """
+    Returns the VectorIndex of a field of a sidecar in blob storage, building it only when this worker has
+    not built it for the current version of the blob yet.
+
+    Raises ValueError for an unknown mode or a field the sidecar has no embeddings of, and
+    SidecarVersionMismatch when the sidecar is still being uploaded after SIDECAR_LOAD_ATTEMPTS tries.
+    """
+    if mode not in VECTOR_INDEX_MODES:
+        raise ValueError(f"Unknown vector index mode '{mode}', use brute, ivf or auto")
+    key = (index_blob_client.container_name, index_blob_client.blob_name, field, mode)
+    for attempt in range(SIDECAR_LOAD_ATTEMPTS):
+        etag = index_blob_client.get_blob_properties().etag
+        cached = _indexes.get(key)
+        if cached and cached[0] == etag:
+            return cached[1]
+        try:
+            sidecar, fields = get_sidecar(npy_blob_client, index_blob_client, etag, directory)
+            break
+        except SidecarVersionMismatch as e:
+            if attempt + 1 == SIDECAR_LOAD_ATTEMPTS:
+                raise
+            logger.warning(f"{e}, it is being uploaded. Retrying in {SIDECAR_RETRY_SECONDS}s")
+            time.sleep(SIDECAR_RETRY_SECONDS)
+    if field not in fields:
+        raise ValueError(f"No '{field}' embeddings, use one of {sorted(fields)}")
+    with _key_lock(key):
+        cached = _indexes.get(key)
+        if cached and cached[0] == etag:
+            return cached[1]
+        index = VectorIndex(sidecar, field, mode)
+        with _indexes_lock:
+            _indexes[key] = (etag, index)
+    return index